@@ -187,16 +187,39 @@ class GrizzlyArgs(CommonArgs):
                  " Updates are always printed when a result is detected or the"
                  " target is relaunched.")
 
+        self.launcher_grp.add_argument(
+            "--adaptive-relaunch", metavar="MIN", type=int,
+            help="Choose the number of iterations performed before relaunching the browser"
+                 " (between MIN and --relaunch) using the measured launch time and browser"
+                 " degradation (default: disabled)")
+        self.launcher_grp.add_argument(
+            "--adaptive-timeout", action="store_true",
+            help="Lower the iteration timeout (--timeout is the maximum) using the time"
+                 " required to run previous test cases. Requires '--ignore timeout'.")
         self.launcher_grp.add_argument(
             "--coverage", action="store_true",
             help="Enable coverage collection")
+        self.launcher_grp.add_argument(
+            "--pipeline", action="store_true",
+            help="Generate the next test case while the current test case is running")
         self.launcher_grp.add_argument(
             "--rr", action="store_true",
             help="Use RR (Linux only)")
+        self.launcher_grp.add_argument(
+            "--standby", action="store_true",
+            help="Launch a standby browser in the background that replaces the browser at relaunch."
+                 " Requires available memory.")
+        self.launcher_grp.add_argument(
+            "--test-windows", type=int, default=1,
+            help="Number of test cases the harness runs concurrently (default: %(default)s)")
 
         self.reporter_grp.add_argument(
             "-c", "--cache", type=int, default=0,
             help="Maximum number of additional test cases to include in report (default: %(default)s)")
+        self.reporter_grp.add_argument(
+            "--report-queue", type=int, default=0,
+            help="Maximum number of reports waiting to be submitted from the background."
+                 " Results are submitted before continuing when set to 0 (default: %(default)s)")
         self.reporter_grp.add_argument(
             "--s3-fuzzmanager", action="store_true",
             help="Report large attachments (if any) to S3 and then the crash & S3 link to FuzzManager")
@@ -215,6 +238,18 @@ class GrizzlyArgs(CommonArgs):
                 msg.append("No adapters available.")
             self.parser.error(" ".join(msg))
 
+        if args.adaptive_relaunch is not None and not 0 < args.adaptive_relaunch <= args.relaunch:
+            self.parser.error("--adaptive-relaunch must be >= 1 and <= --relaunch")
+
+        if args.adaptive_timeout and "timeout" not in args.ignore:
+            self.parser.error("--adaptive-timeout requires '--ignore timeout'")
+
+        if args.report_queue < 0:
+            self.parser.error("--report-queue must be >= 0")
+
+        if args.test_windows < 1:
+            self.parser.error("--test-windows must be >= 1")
+
         if args.fuzzmanager and args.s3_fuzzmanager:
             self.parser.error("--fuzzmanager and --s3-fuzzmanager are mutually exclusive")
 
@@ -5,6 +5,7 @@
 
 from .adapter import Adapter, AdapterError
 from .iomanager import IOManager, ServerMap
+from .relaunch import RelaunchPolicy
 from .reporter import FilesystemReporter, FuzzManagerReporter, Report, Reporter, S3FuzzManagerReporter
 from .runner import Runner
 from .status import ReducerStats, Status
@@ -13,7 +14,7 @@ from .storage import TestCaseLoadFailure, TestCase, TestFile, TestFileExists
 
 __all__ = (
     "Adapter", "AdapterError", "FilesystemReporter", "FuzzManagerReporter", "IOManager",
-    "ReducerStats", "Report", "Reporter", "Runner", "S3FuzzManagerReporter", "ServerMap", "Status",
-    "TestCase", "TestCaseLoadFailure", "TestFile", "TestFileExists")
+    "ReducerStats", "RelaunchPolicy", "Report", "Reporter", "Runner", "S3FuzzManagerReporter", "ServerMap",
+    "Status", "TestCase", "TestCaseLoadFailure", "TestFile", "TestFileExists")
 __author__ = "Jesse Schwartzentruber"
 __credits__ = ["Jesse Schwartzentruber", "Tyson Smith"]
@@ -4,8 +4,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import deque
+from functools import partial
 from os import environ
-from os.path import isfile
+from os.path import isfile, splitext
 
 from sapphire.server_map import ServerMap
 from .storage import TestCase, TestFile
@@ -26,15 +27,19 @@ class IOManager(object):
         "MOZ_CHAOSMODE",
         "XPCOM_DEBUG_BREAK")
 
-    def __init__(self, report_size=1, working_path=None):
+    def __init__(self, report_size=1, test_windows=1, working_path=None):
         assert report_size > 0
+        assert test_windows > 0
         self.harness = None
         self.server_map = ServerMap()  # manage redirects, include directories and dynamic responses
+        self.test_windows = test_windows  # number of test cases the harness runs concurrently
         self.tests = deque()
         self.working_path = working_path
         self._environ_files = list()  # collection of files that should be added to the testcase
+        self._finished = set()  # landing pages of test cases with a closed harness window
         self._generated = 0  # number of test cases generated
-        self._report_size = report_size
+        # test cases that are still running are always included in the report
+        self._report_size = report_size + test_windows - 1
         # used to record environment variable that directly impact the browser
         self._tracked_env = self.tracked_environ()
         self._add_suppressions()
@@ -56,12 +61,53 @@ class IOManager(object):
                 fname = "%s.supp" % (env_var.split("_")[0].lower(),)
                 self._environ_files.append(TestFile.from_file(supp_file, fname))
 
+    def _remove_test(self, test, cleanup=True):
+        self.server_map.dynamic.pop(self.done_url(test.landing_page), None)
+        self._finished.discard(test.landing_page)
+        if cleanup:
+            test.cleanup()
+
+    def _test_done(self, landing_page):
+        # called by the server when the harness window of a test case closes
+        self._finished.add(landing_page)
+        return b""
+
     def cleanup(self):
         for e_file in self._environ_files:
             e_file.close()
         self.purge_tests()
 
-    def create_testcase(self, adapter_name):
+    def commit_testcase(self, test):
+        # add a test case created by create_testcase(commit=False) and
+        # update the server map, this must be done before the next test case is created
+        assert test.landing_page == self.page_name()
+        # redirects added by the adapter for this test case are kept
+        self.server_map.set_redirect("grz_current_test", test.landing_page, required=False)
+        self.server_map.set_redirect("grz_next_test", test.redirect_page)
+        if self.harness is not None:
+            # add harness to testcase
+            self.server_map.set_dynamic_response(
+                "grz_harness",
+                lambda: self.harness,
+                mime_type="text/html")
+        if self.test_windows > 1:
+            # the server map can be a copy that was made before test cases were removed
+            tracked = set(self.done_url(x.landing_page) for x in self.tests)
+            for url in tuple(self.server_map.dynamic):
+                if url.startswith("grz_done_") and url not in tracked:
+                    del self.server_map.dynamic[url]
+            # the harness requests this when the window of the test case closes
+            self.server_map.set_dynamic_response(
+                self.done_url(test.landing_page),
+                partial(self._test_done, test.landing_page),
+                mime_type="text/plain")
+        self._generated += 1
+        self.tests.append(test)
+        # manage testcase cache size
+        if len(self.tests) > self._report_size:
+            self._remove_test(self.tests.popleft())
+
+    def create_testcase(self, adapter_name, commit=True):
         # create testcase object and landing page names
         test = TestCase(
             self.page_name(),
@@ -73,31 +119,44 @@ class IOManager(object):
         # add environment files to the test case
         for e_file in self._environ_files:
             test.add_meta(e_file.clone())
-        # reset redirect map
-        self.server_map.redirect.clear()
-        self.server_map.set_redirect("grz_current_test", self.page_name(), required=False)
-        self.server_map.set_redirect("grz_next_test", self.page_name(offset=1))
-        if self.harness is not None:
-            # add harness to testcase
-            self.server_map.set_dynamic_response(
-                "grz_harness",
-                lambda: self.harness,
-                mime_type="text/html")
-        self._generated += 1
-        self.tests.append(test)
-        # manage testcase cache size
-        if len(self.tests) > self._report_size:
-            self.tests.popleft().cleanup()
+        if commit:
+            # reset redirect map, redirects of the previous test case are removed
+            self.server_map.redirect.clear()
+            self.commit_testcase(test)
         return test
 
+    @staticmethod
+    def done_url(landing_page):
+        # URL requested by the harness when the window of a test case closes
+        return "grz_done_%s" % (splitext(landing_page)[0],)
+
+    @property
+    def in_flight(self):
+        # test cases created before the most recent test case that can still be
+        # running in other harness windows (oldest to newest)
+        if self.test_windows < 2 or len(self.tests) < 2:
+            return tuple()
+        tests = tuple(self.tests)
+        return tests[max(len(tests) - self.test_windows, 0):-1]
+
     def page_name(self, offset=0):
         return "test_%04d.html" % (self._generated + offset,)
 
-    def purge_tests(self):
+    def purge_tests(self, cleanup=True):
+        # cleanup=False is used when the caller takes ownership of the test cases
         for testcase in self.tests:
-            testcase.cleanup()
+            self._remove_test(testcase, cleanup=cleanup)
         self.tests.clear()
 
+    @property
+    def running(self):
+        # test cases that have not been reported done by the harness (oldest to newest),
+        # one of these most likely triggered a result that was just detected
+        if self.test_windows < 2:
+            return tuple(self.tests)[-1:]
+        tests = tuple(self.tests)[-self.test_windows:]
+        return tuple(x for x in tests if x.landing_page not in self._finished)
+
     @staticmethod
     def tracked_environ():
         # Scan os.environ and collect environment variables
@@ -0,0 +1,144 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Choose the number of iterations to perform between target launches."""
+from collections import deque
+from logging import getLogger
+from math import sqrt
+
+__all__ = ("RelaunchPolicy",)
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = getLogger("relaunch")
+
+
+class RelaunchPolicy(object):
+    """RelaunchPolicy picks the relaunch interval that maximizes the number of
+    iterations performed per second using the observed launch cost and the
+    degradation of the target over its lifetime.
+
+    If each iteration after a launch takes `a + b * i` seconds (`i` being the
+    number of iterations since the launch) and a launch takes `L` seconds, the rate
+    `n / (L + a * n + b * n^2 / 2)` is highest when `n = sqrt(2 * L / b)`. The interval
+    is also limited by the number of iterations that can be performed before the
+    memory usage or the log size of the target is expected to exceed its limit.
+    """
+    LAUNCHES = 10  # number of recent launches used to calculate launch cost
+    MIN_SAMPLES = 20  # number of iterations required before adapting
+    SAMPLES = 2000  # number of recent iterations used to calculate degradation
+
+    __slots__ = (
+        "_launch_costs", "_samples", "_since_launch", "limit", "log_limit",
+        "maximum", "memory_limit", "minimum")
+
+    def __init__(self, minimum, maximum, log_limit=0, memory_limit=0):
+        assert 0 < minimum <= maximum
+        assert log_limit >= 0
+        assert memory_limit >= 0
+        self._launch_costs = deque(maxlen=self.LAUNCHES)
+        # (iterations since launch, duration, log size, memory usage)
+        self._samples = deque(maxlen=self.SAMPLES)
+        self._since_launch = 0
+        # begin with the maximum, long running targets provide the most information
+        self.limit = maximum
+        self.log_limit = log_limit
+        self.maximum = maximum
+        self.memory_limit = memory_limit
+        self.minimum = minimum
+
+    @staticmethod
+    def _fit(points):
+        """Calculate the line of best fit (least squares).
+
+        Args:
+            points (iterable): (x, y) values.
+
+        Returns:
+            tuple: Intercept and slope of the line.
+        """
+        points = tuple(points)
+        count = len(points)
+        mean_x = sum(x for x, _ in points) / float(count)
+        mean_y = sum(y for _, y in points) / float(count)
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        if var_x == 0:
+            return mean_y, 0.0
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+        return mean_y - slope * mean_x, slope
+
+    @classmethod
+    def _remaining(cls, points, limit):
+        """Calculate the number of iterations performed before `limit` is reached.
+
+        Args:
+            points (iterable): (iterations since launch, value) samples.
+            limit (int): Limit of the value. Zero is unlimited.
+
+        Returns:
+            float: Number of iterations or None if the limit will not be reached.
+        """
+        if limit < 1:
+            return None
+        intercept, slope = cls._fit(points)
+        if slope <= 0:
+            return None
+        return max(limit - intercept, 0) / slope
+
+    def launched(self, duration):
+        """Record the launch of the target.
+
+        Args:
+            duration (float): Time in seconds it took to launch the target.
+
+        Returns:
+            None
+        """
+        self._launch_costs.append(duration)
+        self._since_launch = 0
+
+    def sample(self, duration, log_size=0, memory_usage=0):
+        """Record an iteration performed by the target.
+
+        Args:
+            duration (float): Time in seconds spent running the iteration.
+            log_size (int): Size of the target logs in bytes.
+            memory_usage (int): Memory used by the target in bytes.
+
+        Returns:
+            None
+        """
+        self._since_launch += 1
+        self._samples.append((self._since_launch, duration, log_size, memory_usage))
+
+    def update(self):
+        """Calculate the relaunch interval from the recorded samples.
+
+        Args:
+            None
+
+        Returns:
+            int: Number of iterations to perform before relaunching the target.
+        """
+        if len(self._samples) < self.MIN_SAMPLES or not self._launch_costs:
+            return self.limit
+        launch_cost = sum(self._launch_costs) / float(len(self._launch_costs))
+        _, drift = self._fit((x[0], x[1]) for x in self._samples)
+        if drift > 0:
+            best = sqrt(2 * launch_cost / drift)
+        else:
+            # iterations do not slow down over time
+            best = float(self.maximum)
+        for name, idx, limit in (("log size", 2, self.log_limit), ("memory", 3, self.memory_limit)):
+            remaining = self._remaining(((x[0], x[idx]) for x in self._samples), limit)
+            if remaining is not None and remaining < best:
+                LOG.debug("%s limit expected after %0.1f iterations", name, remaining)
+                best = remaining
+        limit = min(max(int(best), self.minimum), self.maximum)
+        if limit != self.limit:
+            LOG.debug(
+                "relaunch interval %d -> %d (launch %0.2fs, drift %0.4fs/iteration)",
+                self.limit, limit, launch_cost, drift)
+            self.limit = limit
+        return self.limit
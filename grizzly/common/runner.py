@@ -3,6 +3,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from logging import getLogger
+from threading import Event, Thread
 from time import sleep, time
 
 from sapphire import SERVED_TIMEOUT
@@ -75,16 +76,25 @@ class Runner(object):
     ERROR = 2
     FAILED = 3
     IGNORED = 4
+    # time in seconds to wait for the target to exit after a crash is found in the logs
+    CRASH_WAIT = 1
+    # time in seconds between scans of the target logs
+    LOG_SCAN_INTERVAL = 0.1
 
-    __slots__ = ("_idle", "_server", "_target", "result", "served", "timeout")
+    __slots__ = (
+        "_crash", "_exited", "_idle", "_server", "_target", "durations", "result", "served",
+        "timeout")
 
     def __init__(self, server, target, idle_threshold=0, idle_delay=60):
+        self._crash = None  # crash marker found in the target logs
+        self._exited = None  # set when the launched target exits
         if idle_threshold > 0:
             self._idle = _IdleChecker(target.is_idle, idle_threshold, idle_delay)
         else:
             self._idle = None
         self._server = server  # a sapphire instance to serve the test case
         self._target = target  # target to run test case
+        self.durations = dict()  # time in seconds spent in each phase of the last run
         self.result = None
         self.served = None
         self.timeout = False
@@ -118,9 +128,23 @@ class Runner(object):
                     continue
                 raise
             break
+        self._exited = Event()
+        # wake the server as soon as the target exits so a crash or a closed
+        # target ends the iteration without waiting for the next poll
+        watcher = Thread(
+            target=self._wake_on_exit, args=(self._server, self._target.monitor, self._exited))
+        watcher.daemon = True
+        watcher.start()
+        # the logs of the new target are scanned until it exits so a crash
+        # ends serving immediately
+        log_watcher = self._target.monitor.watch_logs()
+        if log_watcher is not None:
+            watcher = Thread(target=self._watch_logs, args=(log_watcher, self._exited))
+            watcher.daemon = True
+            watcher.start()
 
     @staticmethod
-    def location(srv_path, srv_port, close_after=None, forced_close=True, timeout=None):
+    def location(srv_path, srv_port, close_after=None, forced_close=True, timeout=None, windows=1):
         """Build a valid URL to pass to a browser.
 
         Args:
@@ -129,6 +153,7 @@ class Runner(object):
             close_after (int): Harness argument.
             forced_close (bool): Harness argument.
             timeout (int): Harness argument.
+            windows (int): Harness argument.
 
         Returns:
             str: A valid URL.
@@ -144,11 +169,13 @@ class Runner(object):
         if timeout is not None:
             assert timeout >= 0
             args.append("timeout=%d" % (timeout * 1000,))
+        if windows > 1:
+            args.append("windows=%d" % (windows,))
         if args:
             return "?".join([location, "&".join(args)])
         return location
 
-    def run(self, ignore, server_map, testcase, coverage=False, wait_for_callback=False):
+    def run(self, ignore, server_map, testcase, coverage=False, in_flight=None, wait_for_callback=False):
         """Serve a testcase and monitor the target for results.
 
         Args:
@@ -156,6 +183,8 @@ class Runner(object):
             server_map (sapphire.ServerMap): A ServerMap.
             testcase (grizzly.TestCase): The test case that will be served.
             coverage (bool): Trigger coverage dump.
+            in_flight (iterable): TestCases that are still running in other
+                                  harness windows.
             wait_for_callback: (bool): Use `_keep_waiting()` to indicate when
                                        framework should move on.
 
@@ -163,17 +192,27 @@ class Runner(object):
             None
         """
         # set initial state
+        self._crash = None
+        self.durations = dict()
         self.served = None
         self.result = None
         self.timeout = False
         if self._idle is not None:
             self._idle.schedule_poll(initial=True)
         # serve the test case
+        start = time()
         server_status, self.served = self._server.serve_testcase(
             testcase,
             continue_cb=self._keep_waiting,
             forever=wait_for_callback,
+            in_flight=in_flight,
             server_map=server_map)
+        if self._crash is not None:
+            LOG.debug("crash found in target logs (%r)", self._crash)
+            # the target can still be running while the crash is being processed
+            # so give it a moment to exit before checking for failures
+            self._exited.wait(self.CRASH_WAIT)
+        self.durations["serve"] = time() - start
         # add all include files that were served
         for url, resource in server_map.include.items():
             testcase.add_batch(resource.target, self.served, prefix=url)
@@ -184,9 +223,13 @@ class Runner(object):
         elif coverage and not self.timeout:
             # dump_coverage() should be called before detect_failure()
             # to help catch any coverage related issues.
+            start = time()
             self._target.dump_coverage()
+            self.durations["coverage"] = time() - start
         # detect failure
+        start = time()
         failure_detected = self._target.detect_failure(ignore, self.timeout)
+        self.durations["detect_failure"] = time() - start
         if failure_detected == self._target.RESULT_FAILURE:
             self.result = self.FAILED
         elif not served_lpage:
@@ -199,6 +242,22 @@ class Runner(object):
         else:
             self.result = self.COMPLETE
 
+    @staticmethod
+    def _wake_on_exit(server, monitor, exited):
+        """Wait for the target to exit, set `exited` and wake the server.
+
+        Args:
+            server (sapphire.Sapphire): Server to wake.
+            monitor (TargetMonitor): Monitor of the target.
+            exited (threading.Event): Set when the target exits.
+
+        Returns:
+            None
+        """
+        monitor.wait()
+        exited.set()
+        server.wake()
+
     def _keep_waiting(self):
         """Callback used by the server to determine if should continue to wait
         for the requests from the target.
@@ -209,7 +268,26 @@ class Runner(object):
         Returns:
             bool: Continue to serve test test case
         """
+        if self._crash is not None:
+            return False
         if self._idle is not None and self._idle.is_idle():
             LOG.debug("idle target detected")
             return False
         return self._target.monitor.is_healthy()
+
+    def _watch_logs(self, log_watcher, exited):
+        """Scan the target logs until the target exits. The server is woken
+        when a crash is found.
+
+        Args:
+            log_watcher (LogWatcher): Watcher for the logs of the target.
+            exited (threading.Event): Set when the target exits.
+
+        Returns:
+            None
+        """
+        while not exited.wait(self.LOG_SCAN_INTERVAL):
+            marker = log_watcher.scan()
+            if marker is not None:
+                self._crash = marker
+                self._server.wake()
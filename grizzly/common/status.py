@@ -3,6 +3,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """Manage Grizzly status reports."""
+from contextlib import contextmanager
 from json import dump, load
 from logging import getLogger
 import os
@@ -25,10 +26,11 @@ class Status(object):
     AGE_LIMIT = 3600  # 1 hour
     PATH = os.path.join(gettempdir(), "grzstatus")
     REPORT_FREQ = 60
+    TIMING_SAMPLES = 100  # number of recent samples kept per phase
 
     __slots__ = (
-        "_lock", "data_file", "ignored", "iteration", "log_size", "results",
-        "start_time", "test_name", "timestamp")
+        "_lock", "data_file", "ignored", "iteration", "log_size", "relaunch", "results",
+        "start_time", "test_name", "timestamp", "timing")
 
     def __init__(self, data_file, start_time):
         assert ".json" in data_file
@@ -38,10 +40,12 @@ class Status(object):
         self.ignored = 0
         self.iteration = 0
         self.log_size = 0
+        self.relaunch = None  # current relaunch interval when chosen by a RelaunchPolicy
         self.results = 0
         self.start_time = start_time
         self.test_name = None
         self.timestamp = start_time
+        self.timing = dict()  # recent durations (in seconds) of each phase of an iteration
 
     def cleanup(self):
         """Remove data file.
@@ -140,6 +144,22 @@ class Status(object):
                 continue
             yield status
 
+    @contextmanager
+    def measure(self, phase):
+        """Record the time spent in the body of a with statement as a sample of `phase`.
+
+        Args:
+            phase (str): Name of the phase being measured.
+
+        Yields:
+            None
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            self.record(phase, time() - start)
+
     @property
     def rate(self):
         """Calculate the number of iterations performed per second since start() was called
@@ -158,10 +178,28 @@ class Status(object):
             "ignored": self.ignored,
             "iteration": self.iteration,
             "log_size": self.log_size,
+            "relaunch": self.relaunch,
             "results": self.results,
             "start_time": self.start_time,
             "test_name": self.test_name,
-            "timestamp": self.timestamp}
+            "timestamp": self.timestamp,
+            "timing": self.timing}
+
+    def record(self, phase, duration):
+        """Add a sample to the timing data of `phase`. Only the most recent
+        TIMING_SAMPLES samples are kept.
+
+        Args:
+            phase (str): Name of the phase.
+            duration (float): Time in seconds spent in the phase.
+
+        Returns:
+            None
+        """
+        samples = self.timing.setdefault(phase, list())
+        samples.append(duration)
+        if len(samples) > self.TIMING_SAMPLES:
+            del samples[:-self.TIMING_SAMPLES]
 
     def report(self, force=False, report_freq=REPORT_FREQ):
         """Write Grizzly status report. Reports are only written when the duration
@@ -31,6 +31,8 @@ class StatusReporter(object):
     EXP_LIMIT = 600  # expiration limit, ignore older reports
     READ_BUF_SIZE = 0x10000  # 64KB
     SUMMARY_LIMIT = 4095  # summary output must be no more than 4KB
+    # upper limits (in seconds) and labels of the timing histogram buckets
+    TIMING_BUCKETS = ((0.01, "<10ms"), (0.1, "<100ms"), (1, "<1s"), (10, "<10s"), (None, ">=10s"))
 
     def __init__(self, reports, reducer=False, tracebacks=None):
         self._reducer = reducer
@@ -123,7 +125,11 @@ class StatusReporter(object):
             if not self._reducer:
                 txt.append(" - Ignored: %02d" % report.ignored)
                 txt.append(" - Results: %d" % report.results)
+            if report.relaunch is not None:
+                txt.append(" - Relaunch: %d" % report.relaunch)
             txt.append("\n")
+            if report.timing:
+                txt.append(self._timing(report.timing))
         return "".join(txt)
 
     def _summary(self, runtime=True, sysinfo=False, timestamp=False):
@@ -275,6 +281,38 @@ class StatusReporter(object):
         txt.append(" of %0.1fGB free" % (disk_usage.total / 1073741824.0,))
         return "".join(txt)
 
+    @classmethod
+    def _timing(cls, timing):
+        """Format the timing data of a status report. Phases are ordered by
+        total time spent, the most expensive first.
+
+        Args:
+            timing (dict): Recent durations (in seconds) of each phase.
+
+        Returns:
+            str: Timing breakdown and histogram of each phase
+        """
+        txt = list()
+        phases = sorted(
+            ((name, samples) for name, samples in timing.items() if samples),
+            key=lambda x: sum(x[1]),
+            reverse=True)
+        for name, samples in phases:
+            counts = [0] * len(cls.TIMING_BUCKETS)
+            for duration in samples:
+                for idx, (limit, _) in enumerate(cls.TIMING_BUCKETS):
+                    if limit is None or duration < limit:
+                        counts[idx] += 1
+                        break
+            buckets = ("%s: %d" % (x[1], y) for x, y in zip(cls.TIMING_BUCKETS, counts))
+            txt.append("   %14s : %d @ %0.3fs avg (%0.3fs max) [%s]\n" % (
+                name,
+                len(samples),
+                sum(samples) / len(samples),
+                max(samples),
+                ", ".join(buckets)))
+        return "".join(txt)
+
     @staticmethod
     def _tracebacks(path, ignore_kbi=True, max_preceeding=5):
         """Search screen logs for tracebacks.
@@ -234,6 +234,20 @@ class TestCase(object):
             for meta_file in self._files.meta:
                 meta_file.dump(out_path)
 
+    def get_file(self, file_name):
+        """Look up and return the TestFile with the specified file name.
+
+        Args:
+            file_name (str): Name of file to retrieve.
+
+        Returns:
+            TestFile: TestFile with matching file name otherwise None.
+        """
+        for tfile in chain(self._files.required, self._files.optional, self._files.meta):
+            if tfile.file_name == file_name:
+                return tfile
+        return None
+
     def load_environ(self, path, env_data):
         # sanity check environment variable data
         for name, value in env_data.items():
@@ -362,6 +376,19 @@ class TestCase(object):
         for idx in reversed(to_remove):
             self._files.optional.pop(idx).close()
 
+    @property
+    def required(self):
+        """Get file names of required TestFiles
+
+        Args:
+            None
+
+        Returns:
+            generator: file names (str) of required files
+        """
+        for test in self._files.required:
+            yield test.file_name
+
 
 class TestFile(object):
     CACHE_LIMIT = 0x80000  # data cache limit per file: 512KB
@@ -428,6 +455,20 @@ class TestFile(object):
         self._fp.seek(pos)
         return data
 
+    @property
+    def data_file(self):
+        """File object containing the data of the TestFile. This can be used to
+        read the data without creating a copy. The position of the file object
+        is not preserved by readers.
+
+        Args:
+            None
+
+        Returns:
+            file: Seekable file object.
+        """
+        return self._fp
+
     def dump(self, path):
         """Write test file data to the filesystem.
 
@@ -4,6 +4,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=protected-access
 
+from sapphire import ServerMap
+
 from .iomanager import IOManager
 from .storage import TestFile
 
@@ -101,3 +103,77 @@ def test_iomanager_05(mocker):
         values={"ASAN_OPTIONS": "ignored=x"},
         clear=True)
     assert not IOManager.tracked_environ()
+
+def test_iomanager_06():
+    """test IOManager.in_flight"""
+    with IOManager(report_size=2, test_windows=3) as iom:
+        assert iom._report_size == 4
+        assert not iom.in_flight
+        tests = list()
+        for _ in range(5):
+            tests.append(iom.create_testcase("test-adapter"))
+        assert len(iom.tests) == 4
+        assert iom.in_flight == tuple(tests[2:4])
+    with IOManager() as iom:
+        for _ in range(2):
+            iom.create_testcase("test-adapter")
+        assert not iom.in_flight
+
+def test_iomanager_07():
+    """test IOManager.create_testcase() without commit and IOManager.commit_testcase()"""
+    with IOManager() as iom:
+        test = iom.create_testcase("test-adapter", commit=False)
+        assert test.landing_page == "test_0000.html"
+        assert not iom.tests
+        assert iom._generated == 0
+        assert "grz_current_test" not in iom.server_map.redirect
+        # redirects added when the test case was generated are kept
+        iom.server_map.set_redirect("adapter_redirect", "test_0000.html")
+        iom.commit_testcase(test)
+        assert iom.tests[-1] is test
+        assert iom._generated == 1
+        assert iom.server_map.redirect["grz_current_test"].target == "test_0000.html"
+        assert iom.server_map.redirect["grz_next_test"].target == "test_0001.html"
+        assert "adapter_redirect" in iom.server_map.redirect
+        # redirects are reset when a test case is created and committed
+        iom.create_testcase("test-adapter")
+        assert "adapter_redirect" not in iom.server_map.redirect
+
+def test_iomanager_08():
+    """test IOManager.running"""
+    with IOManager(test_windows=2) as iom:
+        assert not iom.running
+        tests = list()
+        for _ in range(3):
+            tests.append(iom.create_testcase("test-adapter"))
+        assert iom.running == tuple(tests[1:])
+        # the harness requests the done URL when the window of a test case closes
+        resource = iom.server_map.dynamic[iom.done_url("test_0001.html")]
+        assert resource.target() == b""
+        assert iom.running == (tests[2],)
+        # done URLs of test cases that are no longer kept are removed
+        assert iom.done_url("test_0000.html") not in iom.server_map.dynamic
+        assert iom.done_url("test_0001.html") in iom.server_map.dynamic
+        iom.create_testcase("test-adapter")
+        assert iom.done_url("test_0001.html") not in iom.server_map.dynamic
+        assert "test_0001.html" not in iom._finished
+        iom.purge_tests(cleanup=False)
+        assert not iom.running
+        assert not iom._finished
+        assert not any(x.startswith("grz_done_") for x in iom.server_map.dynamic)
+    with IOManager() as iom:
+        tests = list()
+        for _ in range(2):
+            tests.append(iom.create_testcase("test-adapter"))
+        assert iom.running == (tests[-1],)
+        assert not any(x.startswith("grz_done_") for x in iom.server_map.dynamic)
+    with IOManager(test_windows=2) as iom:
+        iom.create_testcase("test-adapter")
+        # server map copied before the test cases were removed
+        server_map = ServerMap()
+        server_map.dynamic.update(iom.server_map.dynamic)
+        iom.purge_tests()
+        iom.server_map = server_map
+        iom.create_testcase("test-adapter")
+        assert iom.done_url("test_0000.html") not in iom.server_map.dynamic
+        assert iom.done_url("test_0001.html") in iom.server_map.dynamic
@@ -0,0 +1,64 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""test RelaunchPolicy"""
+# pylint: disable=protected-access
+
+from .relaunch import RelaunchPolicy
+
+
+def _run(policy, iterations, launch=10.0, drift=0.0, log_growth=0, mem_growth=0):
+    policy.launched(launch)
+    for i in range(1, iterations + 1):
+        policy.sample(1.0 + drift * i, log_size=log_growth * i, memory_usage=100 + mem_growth * i)
+
+
+def test_relaunch_policy_01():
+    """test RelaunchPolicy() without enough samples"""
+    policy = RelaunchPolicy(1, 500)
+    assert policy.limit == 500
+    assert policy.update() == 500
+    _run(policy, RelaunchPolicy.MIN_SAMPLES - 1, drift=0.5)
+    assert policy.update() == 500
+
+
+def test_relaunch_policy_02():
+    """test RelaunchPolicy() with degradation"""
+    policy = RelaunchPolicy(1, 500)
+    # sqrt(2 * 10 / 0.01) = 44.7
+    _run(policy, 100, drift=0.01)
+    assert policy.update() == 44
+    # iterations do not slow down
+    policy = RelaunchPolicy(1, 500)
+    _run(policy, 100)
+    assert policy.update() == 500
+    # limited by minimum and maximum
+    policy = RelaunchPolicy(50, 500)
+    _run(policy, 100, drift=0.01)
+    assert policy.update() == 50
+    policy = RelaunchPolicy(1, 20)
+    _run(policy, 100, drift=0.00001)
+    assert policy.update() == 20
+
+
+def test_relaunch_policy_03():
+    """test RelaunchPolicy() with log size and memory limits"""
+    # memory limit (100 + 2 * i) reached after 50 iterations
+    policy = RelaunchPolicy(1, 500, memory_limit=200)
+    _run(policy, 100, mem_growth=2)
+    assert policy.update() == 50
+    # log limit (10 * i) reached after 25 iterations
+    policy = RelaunchPolicy(1, 500, log_limit=250, memory_limit=200)
+    _run(policy, 100, log_growth=10, mem_growth=2)
+    assert policy.update() == 25
+    # no limit
+    policy = RelaunchPolicy(1, 500)
+    _run(policy, 100, log_growth=10, mem_growth=2)
+    assert policy.update() == 500
+
+
+def test_relaunch_policy_04():
+    """test RelaunchPolicy._fit()"""
+    assert RelaunchPolicy._fit([(1, 3), (2, 5), (3, 7)]) == (1.0, 2.0)
+    assert RelaunchPolicy._fit([(1, 3), (1, 5)]) == (4.0, 0.0)
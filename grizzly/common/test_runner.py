@@ -4,6 +4,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=protected-access
 from os.path import join as pathjoin
+from threading import Event
+from time import sleep
 
 from pytest import raises
 
@@ -36,12 +38,15 @@ def test_runner_01(mocker):
     assert target.dump_coverage.call_count == 0
     # some files served
     server.serve_testcase.return_value = (SERVED_REQUEST, serv_files)
-    runner.run([], ServerMap(), testcase, coverage=True)
+    runner.run([], ServerMap(), testcase, coverage=True, in_flight=["x"])
+    assert server.serve_testcase.call_args[1]["in_flight"] == ["x"]
     assert runner.result == runner.COMPLETE
     assert runner.served == serv_files
     assert not runner.timeout
     assert target.close.call_count == 0
     assert target.dump_coverage.call_count == 1
+    assert set(runner.durations) == {"coverage", "detect_failure", "serve"}
+    assert all(x >= 0 for x in runner.durations.values())
 
 def test_runner_02(mocker):
     """test Runner() errors"""
@@ -158,6 +163,8 @@ def test_runner_07():
     assert result == "http://127.0.0.1:34567/a.html?forced_close=0"
     result = Runner.location("a.html", 9999, close_after=10, forced_close=False, timeout=60)
     assert result == "http://127.0.0.1:9999/a.html?close_after=10&forced_close=0&timeout=60000"
+    result = Runner.location("a.html", 9999, timeout=60, windows=4)
+    assert result == "http://127.0.0.1:9999/a.html?timeout=60000&windows=4"
 
 def test_runner_08(mocker):
     """test Runner.launch()"""
@@ -167,6 +174,15 @@ def test_runner_08(mocker):
     runner = Runner(server, target)
     runner.launch("http://a/")
     assert target.launch.call_count == 1
+    # the server is woken once the target exits
+    for _ in range(100):
+        if server.wake.call_count:
+            break
+        sleep(0.01)
+    assert target.monitor.wait.call_count == 1
+    assert server.wake.call_count == 1
+    assert runner._exited.is_set()
+    assert target.monitor.watch_logs.call_count == 1
     target.reset_mock()
 
     target.launch.side_effect = TargetLaunchError
@@ -211,6 +227,59 @@ def test_runner_09(mocker, tmp_path):
         assert pathjoin("nested", "nested_inc.bin") in tcase._existing_paths
         assert pathjoin("test", "inc_file3.txt") in tcase._existing_paths
 
+def test_runner_10(mocker):
+    """test Runner.run() stops serving when a crash is found in the target logs"""
+    mocker.patch.object(Runner, "CRASH_WAIT", 0.01)
+    mocker.patch.object(Runner, "LOG_SCAN_INTERVAL", 0.01)
+    server = mocker.Mock(spec=Sapphire, port=0x1337)
+    target = mocker.Mock(spec=Target)
+    target.detect_failure.return_value = target.RESULT_FAILURE
+    target.monitor.is_healthy.return_value = True
+    # the target keeps running until exit is set
+    exit_target = Event()
+    target.monitor.wait.side_effect = exit_target.wait
+    log_watcher = target.monitor.watch_logs.return_value
+    log_watcher.scan.side_effect = (None, None, b"Assertion failure: ", None)
+    def _serve_testcase(_, continue_cb=None, **kwargs):
+        for _ in range(1000):
+            if not continue_cb():
+                break
+            sleep(0.01)
+        return (SERVED_REQUEST, ["a.html"])
+    server.serve_testcase.return_value = (SERVED_ALL, ["a.html"])
+    testcase = mocker.Mock(spec=TestCase, landing_page="a.html")
+    runner = Runner(server, target)
+    try:
+        # logs are only scanned after launch
+        runner.run([], ServerMap(), testcase)
+        assert runner._crash is None
+        assert target.monitor.watch_logs.call_count == 0
+        runner.launch("http://a/")
+        server.serve_testcase.side_effect = _serve_testcase
+        runner.run([], ServerMap(), testcase)
+        assert runner._crash == b"Assertion failure: "
+        assert runner.result == runner.FAILED
+        assert log_watcher.scan.call_count >= 3
+        assert server.wake.called
+        # the target did not exit
+        assert not runner._exited.is_set()
+        # crash state is reset each run
+        log_watcher.scan.side_effect = None
+        log_watcher.scan.return_value = None
+        server.serve_testcase.side_effect = None
+        target.detect_failure.return_value = target.RESULT_NONE
+        runner.run([], ServerMap(), testcase)
+        assert runner._crash is None
+        assert runner.result == runner.COMPLETE
+    finally:
+        exit_target.set()
+    # logs are not scanned once the target exits
+    assert runner._exited.wait(1)
+    sleep(0.05)
+    scans = log_watcher.scan.call_count
+    sleep(0.05)
+    assert log_watcher.scan.call_count == scans
+
 def test_idle_check_01(mocker):
     """test simple _IdleChecker"""
     fake_time = mocker.patch("grizzly.common.runner.time", autospec=True)
@@ -10,6 +10,8 @@ from os import remove, stat
 from os.path import isfile
 from time import sleep, time
 
+from pytest import raises
+
 from .status import ReducerStats, Status
 
 
@@ -160,6 +162,27 @@ def test_status_08(tmp_path):
     assert best_rate > 0
     assert not any(Status.loadall())
 
+def test_status_09(mocker, tmp_path):
+    """test Status.record() and Status.measure()"""
+    mocker.patch.object(Status, "TIMING_SAMPLES", 3)
+    Status.PATH = str(tmp_path)
+    status = Status.start()
+    for duration in range(5):
+        status.record("serve", float(duration))
+    assert status.timing["serve"] == [2.0, 3.0, 4.0]
+    with status.measure("generate"):
+        pass
+    assert len(status.timing["generate"]) == 1
+    assert status.timing["generate"][0] >= 0
+    # the sample is recorded when an exception is raised
+    with raises(RuntimeError):
+        with status.measure("generate"):
+            raise RuntimeError("test")
+    assert len(status.timing["generate"]) == 2
+    status.report(force=True)
+    loaded = Status.load(status.data_file)
+    assert loaded.timing == status.timing
+
 def test_reducer_stats_01(tmp_path):
     """test ReducerStats() empty"""
     ReducerStats.PATH = str(tmp_path)
@@ -252,6 +252,29 @@ def test_status_reporter_09(tmp_path):
     merged_log = rptr._summary(runtime=True, sysinfo=True, timestamp=True)
     assert len(merged_log) < StatusReporter.SUMMARY_LIMIT
 
+def test_status_reporter_10(tmp_path):
+    """test StatusReporter._specific() with timing data"""
+    Status.PATH = str(tmp_path / "grzstatus")
+    status = Status.start()
+    status.iteration = 3
+    for duration in (0.005, 0.5, 2.5):
+        status.record("serve", duration)
+    status.record("generate", 0.05)
+    status.timing["launch"] = list()
+    status.relaunch = 25
+    status.report(force=True)
+    rptr = StatusReporter.load()
+    output = rptr._specific()
+    lines = output.split("\n")[:-1]
+    assert len(lines) == 4
+    assert "Relaunch: 25" in lines[1]
+    # most expensive phase first
+    assert "serve : 3 @ 1.002s avg (2.500s max)" in lines[2]
+    assert "<10ms: 1, <100ms: 0, <1s: 1, <10s: 1, >=10s: 0" in lines[2]
+    assert "generate : 1 @ 0.050s avg" in lines[3]
+    assert "<100ms: 1" in lines[3]
+    assert " launch :" not in output
+
 def test_reduce_status_reporter_01(tmp_path):
     """test empty StatusReporter in reducer mode"""
     Status.PATH = str(tmp_path / "grzstatus")
@@ -266,6 +266,20 @@ def test_testcase_11(tmp_path):
         with pytest.raises(TestFileExists, match="'file.bin' exists in test"):
             tcase.add_batch(str(include), [str(inc_1)])
 
+def test_testcase_12():
+    """test TestCase.get_file() and TestCase.required"""
+    with TestCase("a.html", "b.html", "test-adapter") as tcase:
+        assert not any(tcase.required)
+        assert tcase.get_file("a.html") is None
+        tcase.add_from_data("a", "a.html")
+        tcase.add_from_data("b", "b.html", required=False)
+        tcase.add_meta(TestFile.from_data("c", "prefs.js"))
+        assert tuple(tcase.required) == ("a.html",)
+        assert tcase.get_file("a.html").data == b"a"
+        assert tcase.get_file("b.html").data == b"b"
+        assert tcase.get_file("prefs.js").data == b"c"
+        assert tcase.get_file("missing.html") is None
+
 def test_testfile_01():
     """test simple TestFile"""
     with pytest.raises(TypeError, match="TestFile requires a name"):
@@ -349,3 +363,12 @@ def test_testfile_07(tmp_path):
     in_file.write_bytes(b"foobar")
     with TestFile.from_file(str(in_file), file_name="outfile.txt") as tfile:
         assert tfile.data == b"foobar"
+
+def test_testfile_08():
+    """test TestFile.data_file"""
+    with TestFile.from_data(b"foobar", "test.txt") as tfile:
+        tfile.data_file.seek(3)
+        assert tfile.data_file.read() == b"bar"
+        # TestFile does not depend on the position of the file object
+        assert tfile.data == b"foobar"
+        assert tfile.size == 6
@@ -7,7 +7,7 @@ from logging import basicConfig, DEBUG, getLogger
 from sapphire import Sapphire
 
 from .adapters import get as get_adapter
-from .common import FilesystemReporter, FuzzManagerReporter, IOManager, S3FuzzManagerReporter
+from .common import FilesystemReporter, FuzzManagerReporter, IOManager, RelaunchPolicy, S3FuzzManagerReporter
 from .session import Session
 from .target import load as load_target, TargetLaunchError, TargetLaunchTimeout
 
@@ -51,6 +51,7 @@ def main(args):
         # TODO: move this into Session
         iomanager = IOManager(
             report_size=(max(args.cache, 0) + 1),
+            test_windows=args.test_windows,
             working_path=args.working_path)
 
         log.debug("initializing Adapter %r", args.adapter)
@@ -76,10 +77,24 @@ def main(args):
             args.prefs,
             relaunch,
             rr=args.rr,
+            standby=args.standby,
             valgrind=args.valgrind,
             xvfb=args.xvfb)
         adapter.monitor = target.monitor
 
+        if args.adaptive_relaunch is not None:
+            minimum = args.adaptive_relaunch
+            if args.coverage and target.forced_close:
+                # see coverage check below
+                minimum = max(minimum, 2)
+            relaunch_policy = RelaunchPolicy(
+                min(minimum, relaunch),
+                relaunch,
+                log_limit=args.log_limit,
+                memory_limit=args.memory)
+        else:
+            relaunch_policy = None
+
         if args.coverage and relaunch == 1 and target.forced_close:
             # this is a workaround to avoid not dumping coverage
             # GRZ_FORCED_CLOSE=0 is also an option but the browser MUST
@@ -90,6 +105,8 @@ def main(args):
         adapter.setup(args.input, iomanager.server_map)
         log.debug("configuring harness")
         iomanager.harness = adapter.get_harness()
+        if iomanager.harness is None and args.test_windows > 1:
+            raise RuntimeError("--test-windows requires an Adapter that uses the harness")
 
         log.debug("initializing the Reporter")
         if args.fuzzmanager:
@@ -115,7 +132,11 @@ def main(args):
                 reporter,
                 server,
                 target,
-                coverage=args.coverage)
+                adaptive_timeout=args.adaptive_timeout,
+                coverage=args.coverage,
+                pipeline=args.pipeline,
+                relaunch_policy=relaunch_policy,
+                report_queue=args.report_queue)
             if args.log_level == DEBUG or args.verbose:
                 display_mode = Session.DISPLAY_VERBOSE
             else:
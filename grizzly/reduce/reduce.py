@@ -15,7 +15,6 @@ import os
 import re
 import shutil
 import tempfile
-import time
 import zipfile
 import zlib
 
@@ -649,11 +648,15 @@ class ReductionJob(object):
             def _dyn_resp_close():  # pragma: no cover
                 if self.target.monitor.is_healthy():
                     # delay to help catch window close/shutdown related crashes
-                    time.sleep(0.1)
+                    # (ends early if the target exits)
+                    self.target.monitor.wait(timeout=0.1)
                     self.target.close()
                 return b"<h1>Close Browser</h1>"
             self._server_map.set_dynamic_response("grz_close_browser", _dyn_resp_close, mime_type="text/html")
             self._server_map.set_redirect("grz_next_test", str(self.landing_page), required=True)
+        else:
+            # the test case can request '/grz_done' to end the iteration without waiting
+            self._server_map.set_finish("grz_done")
 
         # run test case
         runner.run(self._ignore, self._server_map, testcase, wait_for_callback=self._no_harness)
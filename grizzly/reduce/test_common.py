@@ -85,6 +85,14 @@ class FakeTarget(object):
             def is_healthy():
                 return self._is_healthy
 
+            @staticmethod
+            def wait(timeout=None):
+                return True
+
+            @staticmethod
+            def watch_logs():
+                return None
+
         self.monitor = FakeMonitor()
 
     def save_logs(self, dest, **kwds):
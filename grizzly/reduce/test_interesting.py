@@ -45,6 +45,9 @@ class FakeServer(object):
         assert value is None or value >= 0
         FakeServer._last_timeout = value
 
+    def wake(self):
+        pass
+
 
 @pytest.fixture
 def fake_sapphire(monkeypatch):
@@ -65,6 +68,7 @@ def test_interesting(tmp_path):
     assert obj.lithium_interesting(str(tmp_path / "lithium"))
     assert "grz_close_browser" in obj._server_map.dynamic
     assert "grz_harness" in obj._server_map.dynamic
+    assert "grz_done" not in obj._server_map.dynamic
     assert "grz_current_test" in obj._server_map.redirect
     assert "grz_next_test" in obj._server_map.redirect
     assert obj.target._calls["close"] == 1
@@ -183,6 +187,7 @@ def test_no_harness(tmp_path):
     assert obj.lithium_interesting(str(prefix))
     assert "grz_close_browser" not in obj._server_map.dynamic
     assert "grz_harness" not in obj._server_map.dynamic
+    assert "grz_done" in obj._server_map.dynamic
     assert "grz_current_test" in obj._server_map.redirect
     assert "grz_next_test" not in obj._server_map.redirect
     assert obj.target._calls["close"] == 1
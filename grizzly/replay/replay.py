@@ -6,7 +6,6 @@
 from logging import getLogger
 from os.path import dirname, isfile, join as pathjoin
 from tempfile import mkdtemp
-from time import sleep
 
 from FTB.Signatures.CrashInfo import CrashSignature
 from sapphire import Sapphire, ServerMap
@@ -136,12 +135,16 @@ class ReplayManager(object):
             def _dyn_close():  # pragma: no cover
                 if self.target.monitor.is_healthy():
                     # delay to help catch window close/shutdown related crashes
-                    sleep(0.1)
+                    # (ends early if the target exits)
+                    self.target.monitor.wait(timeout=0.1)
                     self.target.close()
                 return b"<h1>Close Browser</h1>"
             server_map.set_dynamic_response("grz_close_browser", _dyn_close, mime_type="text/html")
             server_map.set_dynamic_response("grz_harness", lambda: self._harness, mime_type="text/html")
             server_map.set_redirect("grz_next_test", self.testcase.landing_page, required=True)
+        else:
+            # the test case can request '/grz_done' to end the iteration without waiting
+            server_map.set_finish("grz_done")
         server_map.set_redirect("grz_current_test", self.testcase.landing_page, required=False)
 
         success = False
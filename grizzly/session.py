@@ -3,17 +3,23 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from collections import deque
 from logging import getLogger
+from math import ceil
 from os.path import isdir
+from queue import Queue
 from shutil import rmtree
+from sys import exc_info
 from tempfile import mkdtemp
-from time import sleep, time
+from threading import Thread
+from time import time
 
-from .common import Report, Runner, Status, TestFile
+from sapphire import ServerMap
+from .common import Adapter, Report, Runner, Status, TestFile
 from .target import TargetLaunchError
 
 
-__all__ = ("SessionError", "LogOutputLimiter", "Session")
+__all__ = ("SessionError", "LogOutputLimiter", "ReportQueue", "ServeTimeout", "Session", "TestCaseProducer")
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith", "Jesse Schwartzentruber"]
 
@@ -54,6 +60,195 @@ class LogOutputLimiter(object):
         return ready
 
 
+class ReportQueue(object):
+    """Process results in a background thread. The number of reports waiting to be
+    processed is limited, once the limit is reached submit() blocks until
+    a pending report is processed.
+    """
+    __slots__ = ("_error", "_handler", "_pending", "_thread")
+
+    def __init__(self, handler, max_pending=1):
+        assert max_pending > 0
+        self._error = None  # exc_info of the first failure
+        self._handler = handler
+        self._pending = Queue(maxsize=max_pending)
+        self._thread = Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _raise_error(self):
+        if self._error is not None:
+            exc = self._error
+            self._error = None
+            raise exc[1].with_traceback(exc[2])
+
+    def _worker(self):
+        while True:
+            args = self._pending.get()
+            if args is None:
+                break
+            try:
+                self._handler(*args)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to process report")
+                if self._error is None:
+                    self._error = exc_info()
+
+    def close(self):
+        """Wait for pending reports to be processed and stop the background thread.
+        An exception raised while processing a report is re-raised.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._thread is not None:
+            self._pending.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def submit(self, *args):
+        """Add a report to the queue. An exception raised while processing a
+        previous report is re-raised.
+
+        Args:
+            args: Arguments that are passed to the handler.
+
+        Returns:
+            None
+        """
+        assert self._thread is not None
+        self._raise_error()
+        self._pending.put(args)
+
+
+class ServeTimeout(object):
+    """Learn the time required to serve test cases from the durations of completed
+    iterations. The timeout is a high percentile of recent durations plus a margin.
+    After a timeout the maximum is used until RECOVER iterations complete.
+    """
+    MIN_SAMPLES = 50  # number of completed iterations required before learning
+    MINIMUM = 10  # lowest timeout in seconds
+    MULTIPLIER = 1.5
+    PERCENTILE = 0.99
+    RECOVER = 10
+    SAMPLES = 500  # number of recent durations used
+
+    __slots__ = ("_holdoff", "_samples", "current", "maximum", "minimum")
+
+    def __init__(self, maximum, minimum=MINIMUM):
+        assert maximum > 0
+        self._holdoff = 0
+        self._samples = deque(maxlen=self.SAMPLES)
+        self.current = maximum
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+
+    def completed(self, duration):
+        """Record the duration of an iteration that completed before the timeout.
+
+        Args:
+            duration (float): Time in seconds spent serving the test case.
+
+        Returns:
+            None
+        """
+        self._samples.append(duration)
+        if self._holdoff > 0:
+            self._holdoff -= 1
+            return
+        if len(self._samples) < self.MIN_SAMPLES:
+            return
+        ranked = sorted(self._samples)
+        value = ranked[min(int(len(ranked) * self.PERCENTILE), len(ranked) - 1)]
+        timeout = min(max(int(ceil(value * self.MULTIPLIER)), self.minimum), self.maximum)
+        if timeout != self.current:
+            log.debug("serve timeout %ds -> %ds", self.current, timeout)
+            self.current = timeout
+
+    def timed_out(self):
+        """Record an iteration that timed out.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self.current < self.maximum:
+            log.info("Timeout at learned limit (%ds), using %ds", self.current, self.maximum)
+            self.current = self.maximum
+        self._holdoff = self.RECOVER
+
+
+class TestCaseProducer(object):
+    """Run a test case generator in a background thread. Only one test case is
+    generated at a time so test cases are created in the same order as they
+    would be when generating synchronously.
+    """
+    __slots__ = ("_results", "_thread")
+
+    def __init__(self):
+        self._results = Queue(maxsize=1)  # (result, exc_info) of the generator
+        self._thread = None
+
+    def _run(self, generator, args):
+        try:
+            result = generator(*args)
+        except Exception:  # pylint: disable=broad-except
+            self._results.put((None, exc_info()))
+        else:
+            self._results.put((result, None))
+
+    @property
+    def busy(self):
+        """A test case is being generated or has not been collected.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if take() must be called before start().
+        """
+        return self._thread is not None
+
+    def start(self, generator, *args):
+        """Call generator in a background thread.
+
+        Args:
+            generator (callable): Creates and returns the next test case.
+            args: Arguments that are passed to generator.
+
+        Returns:
+            None
+        """
+        assert self._thread is None
+        self._thread = Thread(target=self._run, args=(generator, args))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def take(self):
+        """Wait for the generator to complete. Exceptions raised by the generator
+        are re-raised.
+
+        Args:
+            None
+
+        Returns:
+            object: Value returned by the generator.
+        """
+        assert self._thread is not None
+        result, exc = self._results.get()
+        self._thread.join()
+        self._thread = None
+        if exc is not None:
+            raise exc[1].with_traceback(exc[2])
+        return result
+
+
 class Session(object):
     DISPLAY_VERBOSE = 0  # display status every iteration
     DISPLAY_NORMAL = 1  # quickly reduce the amount of output
@@ -63,12 +258,20 @@ class Session(object):
     EXIT_LAUNCH_FAILURE = 7
     TARGET_LOG_SIZE_WARN = 0x1900000  # display warning when target log files exceed limit (25MB)
 
-    __slots__ = ("adapter", "coverage", "iomanager", "reporter", "server", "status", "target")
+    __slots__ = (
+        "adaptive_timeout", "adapter", "coverage", "iomanager", "pipeline", "relaunch_policy",
+        "report_queue", "reporter", "server", "status", "target")
 
-    def __init__(self, adapter, iomanager, reporter, server, target, coverage=False):
+    def __init__(self, adapter, iomanager, reporter, server, target, adaptive_timeout=False, coverage=False,
+                 pipeline=False, relaunch_policy=None, report_queue=0):
         self.adapter = adapter
+        self.adaptive_timeout = adaptive_timeout  # learn the serve timeout from completed iterations
         self.coverage = coverage
         self.iomanager = iomanager
+        self.pipeline = pipeline  # generate the next test case while the current test case runs
+        self.relaunch_policy = relaunch_policy  # RelaunchPolicy used to set the relaunch interval
+        # process results in the background, report_queue is the number of pending reports
+        self.report_queue = ReportQueue(self.submit_report, report_queue) if report_queue > 0 else None
         self.reporter = reporter
         self.server = server
         self.status = Status.start()
@@ -81,7 +284,11 @@ class Session(object):
         self.close()
 
     def close(self):
-        self.status.cleanup()
+        try:
+            if self.report_queue is not None:
+                self.report_queue.close()
+        finally:
+            self.status.cleanup()
 
     def display_status(self, log_limiter):
         if self.adapter.remaining is not None:
@@ -94,6 +301,16 @@ class Session(object):
         elif log_limiter.ready(self.status.iteration, self.target.monitor.launches):
             log.info("I%04d-R%02d ", self.status.iteration, self.status.results)
 
+    def commit_testcase(self, test, server_map):
+        # use a test case created by prepare_testcase()
+        log.debug("calling iomanager.commit_testcase()")
+        self.iomanager.server_map = server_map
+        self.iomanager.commit_testcase(test)
+        self.status.test_name = test.input_fname
+        if self.target.prefs is not None:
+            test.add_meta(TestFile.from_file(self.target.prefs, "prefs.js"))
+        return test
+
     def generate_testcase(self):
         log.debug("calling iomanager.create_testcase()")
         test = self.iomanager.create_testcase(self.adapter.NAME)
@@ -105,19 +322,69 @@ class Session(object):
             test.add_meta(TestFile.from_file(self.target.prefs, "prefs.js"))
         return test
 
+    def pipeline_supported(self):
+        # adapters that use the results of a test case to generate the next test case
+        # or that limit the number of test cases must generate synchronously
+        if self.adapter.remaining is not None:
+            return False
+        adapter_cls = type(self.adapter)
+        return getattr(adapter_cls, "on_served", None) is Adapter.on_served \
+            and getattr(adapter_cls, "on_timeout", None) is Adapter.on_timeout
+
+    def prepare_testcase(self, server_map):
+        # create the next test case without adding it to the IOManager, this is called
+        # from a background thread while the current test case is running
+        test = self.iomanager.create_testcase(self.adapter.NAME, commit=False)
+        log.debug("calling self.adapter.generate() (background)")
+        self.adapter.generate(test, server_map)
+        return test, server_map
+
     def report_result(self):
         # create working directory for target logs
         result_logs = mkdtemp(prefix="grz_logs_", dir=self.iomanager.working_path)
         self.target.save_logs(result_logs)
-        report = Report.from_path(result_logs)
-        crash_info = report.crash_info(self.target.binary)
-        short_sig = crash_info.createShortSignature()
-        log.info("Result: %s (%s:%s)", short_sig, report.major[:8], report.minor[:8])
-        # order test cases newest to oldest
-        self.iomanager.tests.reverse()
-        self.reporter.submit(self.iomanager.tests, report=report)
-        if isdir(result_logs):
-            rmtree(result_logs)
+        if self.iomanager.test_windows > 1:
+            self._running_last()
+        if self.report_queue is None:
+            # order test cases newest to oldest
+            self.iomanager.tests.reverse()
+            self.submit_report(result_logs, self.iomanager.tests)
+        else:
+            # the report queue takes ownership of the logs and test cases
+            # (ordered newest to oldest) so the target can be relaunched
+            tests = list(reversed(self.iomanager.tests))
+            self.iomanager.purge_tests(cleanup=False)
+            log.debug("queuing report")
+            self.report_queue.submit(result_logs, tests, True)
+
+    def _running_last(self):
+        # move the test cases that were still running in a harness window when the
+        # result was detected to the end so they are reported first
+        running = self.iomanager.running
+        if not running:
+            log.info("All test case windows were closed, the result cannot be attributed")
+            return
+        log.info("Test case(s) running when the result was detected: %s",
+                 ", ".join(x.landing_page for x in running))
+        others = tuple(x for x in self.iomanager.tests if x not in running)
+        self.iomanager.tests.clear()
+        self.iomanager.tests.extend(others + running)
+
+    def submit_report(self, result_logs, tests, cleanup=False):
+        # parse the logs and submit the report, this is called from a background
+        # thread when the report queue is in use
+        try:
+            report = Report.from_path(result_logs)
+            crash_info = report.crash_info(self.target.binary)
+            short_sig = crash_info.createShortSignature()
+            log.info("Result: %s (%s:%s)", short_sig, report.major[:8], report.minor[:8])
+            self.reporter.submit(tests, report=report)
+        finally:
+            if cleanup:
+                for test in tests:
+                    test.cleanup()
+            if isdir(result_logs):
+                rmtree(result_logs)
 
     def run(self, ignore, iteration_limit=None, display_mode=DISPLAY_NORMAL):
         log_limiter = LogOutputLimiter(verbose=display_mode == self.DISPLAY_VERBOSE)
@@ -125,8 +392,8 @@ class Session(object):
 
         def _dyn_close():  # pragma: no cover
             if self.target.monitor.is_healthy():
-                # delay to help catch window close/shutdown related crashes
-                sleep(0.1)
+                # delay to help catch window close/shutdown related crashes (ends early if the target exits)
+                self.target.monitor.wait(timeout=0.1)
                 self.target.close()
             return b"<h1>Close Browser</h1>"
         self.iomanager.server_map.set_dynamic_response(
@@ -134,14 +401,45 @@ class Session(object):
             _dyn_close,
             mime_type="text/html")
 
+        serve_timeout = None
+        if self.adaptive_timeout:
+            if "timeout" in ignore:
+                serve_timeout = ServeTimeout(self.server.timeout)
+            else:
+                # a shorter timeout would report slow test cases as hangs
+                log.warning("Adaptive timeout is only used when timeouts are ignored")
+        producer = None
+        if self.pipeline:
+            if self.pipeline_supported():
+                producer = TestCaseProducer()
+            else:
+                log.info("Adapter uses test case results, test cases are generated synchronously")
+        try:
+            self._run(runner, producer, serve_timeout, ignore, iteration_limit, log_limiter)
+        finally:
+            if producer is not None and producer.busy:
+                producer.take()[0].cleanup()
+
+    def _run(self, runner, producer, serve_timeout, ignore, iteration_limit, log_limiter):
         while True:
             self.status.report()
             self.status.iteration += 1
 
+            pending = None
             if self.target.closed:
-                # (re-)launch target
+                if producer is not None and producer.busy:
+                    # Adapter.generate() and Adapter.pre_launch() must not run in parallel
+                    pending = producer.take()
+                    if getattr(type(self.adapter), "pre_launch", None) is not Adapter.pre_launch:
+                        # generate the test case after Adapter.pre_launch() is called
+                        pending[0].cleanup()
+                        pending = None
+                # (re-)launch target, a pending test case is served to the new browser
                 self.iomanager.purge_tests()
                 self.adapter.pre_launch()
+                if self.relaunch_policy is not None:
+                    self.target.rl_reset = self.relaunch_policy.update()
+                    self.status.relaunch = self.target.rl_reset
                 if self.iomanager.harness is None:
                     # harness is not in use, open the test case
                     location = runner.location(
@@ -154,25 +452,59 @@ class Session(object):
                         self.server.port,
                         close_after=self.target.rl_reset,
                         forced_close=self.target.forced_close,
-                        timeout=self.adapter.TEST_DURATION)
+                        timeout=self.adapter.TEST_DURATION,
+                        windows=self.iomanager.test_windows)
                 log.info("Launching target")
+                launch_start = time()
                 try:
-                    runner.launch(location, max_retries=3, retry_delay=0)
+                    with self.status.measure("launch"):
+                        runner.launch(location, max_retries=3, retry_delay=0)
                 except TargetLaunchError:
                     # this result likely has nothing to do with Grizzly
                     self.status.results += 1
                     log.error("Target launch error. Check browser logs for details.")
                     self.report_result()
                     raise
+                if self.relaunch_policy is not None:
+                    self.relaunch_policy.launched(time() - launch_start)
             self.target.step()
 
             # create and populate a test case
-            current_test = self.generate_testcase()
+            with self.status.measure("generate"):
+                if pending is not None:
+                    current_test = self.commit_testcase(*pending)
+                elif producer is not None and producer.busy:
+                    # time spent waiting for the background test case
+                    current_test = self.commit_testcase(*producer.take())
+                else:
+                    current_test = self.generate_testcase()
+            if producer is not None:
+                # the next test case is generated with a copy of the server map
+                # so the server map of the current test case is not modified
+                next_map = ServerMap()
+                next_map.dynamic.update(self.iomanager.server_map.dynamic)
+                next_map.include.update(self.iomanager.server_map.include)
+                producer.start(self.prepare_testcase, next_map)
             # display status
             self.display_status(log_limiter=log_limiter)
 
             # run test case
-            runner.run(ignore, self.iomanager.server_map, current_test, coverage=self.coverage)
+            if serve_timeout is not None:
+                self.server.timeout = serve_timeout.current
+            runner.run(
+                ignore,
+                self.iomanager.server_map,
+                current_test,
+                coverage=self.coverage,
+                in_flight=self.iomanager.in_flight)
+            for phase, duration in runner.durations.items():
+                self.status.record(phase, duration)
+            run_duration = sum(runner.durations.values())
+            if serve_timeout is not None:
+                if runner.timeout:
+                    serve_timeout.timed_out()
+                elif runner.result == runner.COMPLETE and current_test.duration is not None:
+                    serve_timeout.completed(current_test.duration)
             # adapter callbacks
             if runner.timeout:
                 log.debug("calling self.adapter.on_timeout()")
@@ -186,14 +518,17 @@ class Session(object):
                     # this can happen if the target crashes between serving test cases
                     log.info("Ignoring test case since nothing was served")
                     self.iomanager.tests.pop().cleanup()
-                elif self.adapter.IGNORE_UNSERVED:
+                elif self.adapter.IGNORE_UNSERVED and self.iomanager.test_windows < 2:
+                    # with multiple test windows files can be requested after the
+                    # iteration is complete so unserved files are kept
                     log.debug("removing unserved files from the test case")
                     current_test.purge_optional(runner.served)
             # process results
             if runner.result == runner.FAILED:
                 self.status.results += 1
                 log.debug("result detected")
-                self.report_result()
+                with self.status.measure("report"):
+                    self.report_result()
             elif runner.result == runner.IGNORED:
                 self.status.ignored += 1
                 log.info("Ignored (%d)", self.status.ignored)
@@ -207,7 +542,8 @@ class Session(object):
                     raise SessionError("Please check Adapter and Target")
 
             # trigger relaunch by closing the browser if needed
-            self.target.check_relaunch()
+            with self.status.measure("check_relaunch"):
+                self.target.check_relaunch()
 
             if self.adapter.remaining is not None and self.adapter.remaining < 1:
                 # all test cases have been replayed
@@ -222,3 +558,9 @@ class Session(object):
             self.status.log_size = self.target.log_size()
             if self.status.log_size > self.TARGET_LOG_SIZE_WARN:
                 log.warning("Large browser logs: %dMBs", (self.status.log_size / 0x100000))
+
+            if self.relaunch_policy is not None and not self.target.closed:
+                self.relaunch_policy.sample(
+                    run_duration,
+                    log_size=self.status.log_size,
+                    memory_usage=self.target.memory_usage())
@@ -4,19 +4,22 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from logging import getLogger
 from os import close, getenv, kill, makedirs, unlink
-from os.path import isdir, isfile
+from os.path import dirname, isdir, isfile, join as pathjoin
 from platform import system
 import signal
+from socket import socket, timeout as sock_timeout
+from threading import Event, Thread
 from time import localtime, sleep, strftime, time
 from tempfile import mkdtemp, mkstemp
 
-from psutil import AccessDenied, NoSuchProcess, Process, process_iter
+from psutil import AccessDenied, NoSuchProcess, Process, process_iter, virtual_memory
 
 from ffpuppet import BrowserTimeoutError, FFPuppet, LaunchError
 from prefpicker import PrefPicker
 
+from .resource_sampler import ResourceSampler
 from .target_monitor import TargetMonitor
-from .target import Target, TargetLaunchError, TargetLaunchTimeout, TargetError
+from .target import sanitizer_opts, Target, TargetLaunchError, TargetLaunchTimeout, TargetError
 
 __all__ = ("PuppetTarget",)
 __author__ = "Tyson Smith"
@@ -25,18 +28,185 @@ __credits__ = ["Tyson Smith", "Jesse Schwartzentruber"]
 LOG = getLogger("puppet_target")
 
 
+class _Standby(object):
+    """A browser that is launched in the background and waits to be activated.
+    The browser is sent to a gate (a local socket) after launch. Requests to the gate
+    are held until the browser is activated and then redirected to the actual location.
+    To avoid a request time out in the browser, held requests are periodically
+    answered with a page that reloads the gate.
+    """
+    CLOSE_TIMEOUT = 30  # maximum time in seconds close() waits for the background thread
+    PATH = "/grz_standby"
+    REFRESH = 60  # maximum time in seconds a request to the gate is held
+
+    __slots__ = ("_gate", "_location", "_ready", "_thread", "_wake", "env_mod", "puppet")
+
+    def __init__(self, puppet, env_mod):
+        self._gate = socket()
+        self._gate.bind(("127.0.0.1", 0))
+        self._gate.listen(5)
+        self._gate.settimeout(0.25)
+        self._location = None
+        self._ready = Event()  # browser has launched
+        self._thread = None
+        self._wake = Event()  # browser is activated or standby is closed
+        self.env_mod = env_mod
+        self.puppet = puppet
+
+    @property
+    def _closing(self):
+        return self._wake.is_set() and self._location is None
+
+    def _hold(self, conn):
+        # returns True once the browser has been redirected
+        conn.settimeout(10)
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = conn.recv(4096)
+            if not data:
+                return False
+            request += data
+        path = request.split(b" ", 2)[1].decode("ascii", "replace")
+        if not path.startswith(self.PATH):
+            conn.sendall(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        if self._wake.wait(timeout=self.REFRESH) and self._location is not None:
+            conn.sendall((
+                "HTTP/1.1 302 Found\r\n"
+                "Location: %s\r\n"
+                "Content-Length: 0\r\n"
+                "Connection: close\r\n\r\n" % (self._location,)).encode("ascii"))
+            return True
+        body = b"<meta http-equiv='refresh' content='0'>"
+        conn.sendall(b"".join((
+            b"HTTP/1.1 200 OK\r\n",
+            b"Cache-Control: no-store\r\n",
+            b"Content-Type: text/html\r\n",
+            b"Content-Length: %d\r\n" % (len(body),),
+            b"Connection: close\r\n\r\n",
+            body)))
+        return False
+
+    def _kill(self):
+        pid = self.puppet.get_pid()
+        if pid is not None:
+            LOG.debug("killing launching standby browser (pid: %d)", pid)
+            try:
+                Process(pid).kill()
+            except (AccessDenied, NoSuchProcess):  # pragma: no cover
+                pass
+
+    def _run(self, launch):
+        try:
+            launch(self.puppet, self.location, self.env_mod)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.debug("standby browser launch failed: %s", exc)
+            return
+        self._ready.set()
+        while not self._closing:
+            try:
+                conn, _ = self._gate.accept()
+            except sock_timeout:
+                continue
+            try:
+                if self._hold(conn):
+                    break
+            except OSError as exc:
+                LOG.debug("standby gate error: %s", exc)
+            finally:
+                conn.close()
+
+    def activate(self, location, timeout):
+        """Redirect the browser to `location`. A launch that is in progress is
+        given up to `timeout` seconds to complete.
+
+        Args:
+            location (str): URL to open.
+            timeout (float): Maximum time in seconds to wait.
+
+        Returns:
+            bool: True if the browser was redirected otherwise False.
+        """
+        assert self._thread is not None
+        if not self._ready.wait(timeout=timeout) or not self.puppet.is_healthy():
+            return False
+        self._location = location
+        self._wake.set()
+        # wait for the browser to request the gate
+        self._thread.join(timeout=timeout)
+        return not self._thread.is_alive()
+
+    def close(self):
+        """Stop the gate. The browser is not closed unless it is still launching,
+        in that case the browser process is killed to abort the launch.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._location = None
+        self._wake.set()
+        if self._thread is not None:
+            deadline = time() + self.CLOSE_TIMEOUT
+            while True:
+                self._thread.join(timeout=0.25)
+                if not self._thread.is_alive():
+                    break
+                if time() >= deadline:
+                    LOG.warning("standby browser thread did not exit")
+                    break
+                if not self._ready.is_set():
+                    # FFPuppet.launch() fails once the browser process is gone
+                    self._kill()
+        self._gate.close()
+
+    @property
+    def location(self):
+        return "http://127.0.0.1:%d%s" % (self._gate.getsockname()[1], self.PATH)
+
+    def start(self, launch):
+        """Launch the browser in a background thread.
+
+        Args:
+            launch (callable): Called with the FFPuppet, location and env_mod.
+
+        Returns:
+            None
+        """
+        assert self._thread is None
+        self._thread = Thread(target=self._run, args=(launch,))
+        self._thread.daemon = True
+        self._thread.start()
+
+
 class PuppetTarget(Target):
-    __slots__ = ("use_rr", "use_valgrind", "_browser_logs", "_puppet", "_tmp_prefs")
+    # available memory (in addition to memory_limit) required to launch a standby browser
+    STANDBY_MIN_MEMORY = 0x80000000  # 2GB
+
+    __slots__ = (
+        "use_rr", "use_standby", "use_valgrind", "use_xvfb", "_abort_tokens", "_browser_logs",
+        "_launches", "_puppet", "_sampler", "_standby", "_tmp_prefs")
 
     def __init__(self, binary, extension, launch_timeout, log_limit, memory_limit, prefs, relaunch, **kwds):
         super(PuppetTarget, self).__init__(binary, extension, launch_timeout, log_limit,
                                            memory_limit, prefs, relaunch)
         self.use_rr = kwds.pop("rr", False)
+        self.use_standby = kwds.pop("standby", False)
         self.use_valgrind = kwds.pop("valgrind", False)
-        use_xvfb = kwds.pop("xvfb", False)
+        self.use_xvfb = kwds.pop("xvfb", False)
         if kwds:
             LOG.warning("PuppetTarget ignoring unsupported arguments: %s", ", ".join(kwds))
+        if self.use_standby and (self.use_rr or self.use_valgrind):
+            LOG.warning("Standby browser is not supported with rr or Valgrind")
+            self.use_standby = False
+        self._abort_tokens = list()
         self._browser_logs = None
+        self._launches = 0  # launches of previously used FFPuppet objects
+        # collect resource usage of the browser in the background
+        self._sampler = ResourceSampler(lambda: self._puppet.get_pid())
+        self._standby = None
         # generate prefs.js file if needed
         if self.prefs is None:
             for prefs_template in PrefPicker.templates():
@@ -52,25 +222,23 @@ class PuppetTarget(Target):
             self._tmp_prefs = True
         else:
             self._tmp_prefs = False
-        # create Puppet object
-        self._puppet = FFPuppet(
-            use_rr=self.use_rr,
-            use_valgrind=self.use_valgrind,
-            use_xvfb=use_xvfb)
+        self._puppet = self._create_puppet()
 
     def _abort_hung_proc(self):
         # send SIGABRT to the busiest process
-        with self._lock:
-            proc_usage = self._puppet.cpu_usage()
+        proc_usage = self._cpu_usage()
         for pid, cpu in sorted(proc_usage, reverse=True, key=lambda x: x[1]):
             LOG.debug("sending SIGABRT to pid: %r, cpu: %0.2f%%", pid, cpu)
             kill(pid, signal.SIGABRT)
             break
 
     def add_abort_token(self, token):
+        self._abort_tokens.append(token)
         self._puppet.add_abort_token(token)
 
     def cleanup(self):
+        self._sampler.stop()
+        self._discard_standby()
         # prevent parallel calls to FFPuppet.close() and/or FFPuppet.clean_up()
         if self._browser_logs:
             self.close()
@@ -98,8 +266,33 @@ class PuppetTarget(Target):
     def closed(self):
         return self._puppet.reason is not None
 
+    def _cpu_usage(self):
+        # use the most recent sample if available, a sample is only
+        # considered if it has been collected in the last few intervals
+        sample = self._sampler.latest(max_age=ResourceSampler.INTERVAL * 4)
+        if sample is not None and all(x.cpu is not None for x in sample.processes):
+            return [(x.pid, x.cpu) for x in sample.processes]
+        with self._lock:
+            return list(self._puppet.cpu_usage())
+
+    def _create_puppet(self):
+        puppet = FFPuppet(
+            use_rr=self.use_rr,
+            use_valgrind=self.use_valgrind,
+            use_xvfb=self.use_xvfb)
+        for token in self._abort_tokens:
+            puppet.add_abort_token(token)
+        return puppet
+
+    def _discard_standby(self):
+        if self._standby is not None:
+            LOG.debug("discarding standby browser")
+            self._standby.close()
+            self._standby.puppet.clean_up()
+            self._standby = None
+
     def is_idle(self, threshold):
-        for _, cpu in self._puppet.cpu_usage():
+        for _, cpu in self._cpu_usage():
             if cpu >= threshold:
                 return False
         return True
@@ -117,9 +310,13 @@ class PuppetTarget(Target):
                     return self._puppet.is_healthy()
                 @property
                 def launches(_):
-                    return self._puppet.launches
+                    return self._launches + self._puppet.launches
                 def log_length(_, log_id):
                     return self._puppet.log_length(log_id)
+                def log_path(_):
+                    return self._log_path()
+                def wait(_, timeout=None):
+                    return self._puppet.wait(timeout=timeout)
             self._monitor = _PuppetMonitor()
         return self._monitor
 
@@ -232,25 +429,101 @@ class PuppetTarget(Target):
         # do not allow network connections to non local endpoints
         env_mod["MOZ_DISABLE_NONLOCAL_CONNECTIONS"] = "1"
         env_mod["MOZ_CRASHREPORTER_SHUTDOWN"] = "1"
-        try:
-            self._puppet.launch(
-                self.binary,
-                launch_timeout=self.launch_timeout,
-                location=location,
-                log_limit=self.log_limit,
-                memory_limit=self.memory_limit,
-                prefs_js=self.prefs,
-                extension=self.extension,
-                env_mod=env_mod)
-        except LaunchError as exc:
-            LOG.error("FFPuppet LaunchError: %s", str(exc))
-            self.close()
-            if isinstance(exc, BrowserTimeoutError):
-                raise TargetLaunchTimeout(str(exc))
-            raise TargetLaunchError(str(exc))
+        if not self._use_standby(location, env_mod):
+            try:
+                self._launch_puppet(self._puppet, location, env_mod)
+            except LaunchError as exc:
+                LOG.error("FFPuppet LaunchError: %s", str(exc))
+                self.close()
+                if isinstance(exc, BrowserTimeoutError):
+                    raise TargetLaunchTimeout(str(exc))
+                raise TargetLaunchError(str(exc))
+        self._sampler.reset()
+        self._sampler.start()
+        self._launch_standby(env_mod)
+
+    def _launch_puppet(self, puppet, location, env_mod):
+        puppet.launch(
+            self.binary,
+            launch_timeout=self.launch_timeout,
+            location=location,
+            log_limit=self.log_limit,
+            memory_limit=self.memory_limit,
+            prefs_js=self.prefs,
+            extension=self.extension,
+            env_mod=dict(env_mod))
+
+    def _launch_standby(self, env_mod):
+        # launch a browser in the background to replace the current browser at relaunch
+        if not self.use_standby or self._standby is not None:
+            return
+        available = virtual_memory().available
+        if available < self.STANDBY_MIN_MEMORY + self.memory_limit:
+            LOG.debug("insufficient memory for standby browser (%dMB available)", available // 0x100000)
+            return
+        LOG.debug("launching standby browser")
+        self._standby = _Standby(self._create_puppet(), env_mod)
+        self._standby.start(self._launch_puppet)
+
+    def _use_standby(self, location, env_mod):
+        # replace the current browser with the standby browser
+        if self._standby is None:
+            return False
+        standby = self._standby
+        self._standby = None
+        if standby.env_mod != env_mod or not standby.activate(location, self.launch_timeout):
+            LOG.debug("standby browser is not usable")
+            standby.close()
+            standby.puppet.clean_up()
+            return False
+        standby.close()
+        LOG.debug("using standby browser")
+        with self._lock:
+            self._launches += self._puppet.launches
+            self._puppet.clean_up()
+            self._puppet = standby.puppet
+        return True
 
     def log_size(self):
         return self._puppet.log_length("stderr") + self._puppet.log_length("stdout")
 
-    def save_logs(self, *args, **kwargs):
-        self._puppet.save_logs(*args, **kwargs)
+    def memory_usage(self):
+        # total resident memory (in bytes) of the browser processes
+        sample = self._sampler.latest(max_age=ResourceSampler.INTERVAL * 4)
+        if sample is not None:
+            return sum(x.rss for x in sample.processes)
+        pid = self._puppet.get_pid()
+        if pid is None:
+            return 0
+        usage = 0
+        try:
+            proc = Process(pid)
+            usage += proc.memory_info().rss
+            for child in proc.children(recursive=True):
+                usage += child.memory_info().rss
+        except (AccessDenied, NoSuchProcess):  # pragma: no cover
+            pass
+        return usage
+
+    def _log_path(self):
+        # FFPuppet writes the browser logs and the sanitizer logs to the same directory
+        # and passes the location to the browser via log_path in *SAN_OPTIONS,
+        # read it from the environment of the browser
+        pid = self._puppet.get_pid()
+        if pid is None:
+            return None
+        try:
+            env = Process(pid).environ()
+        except (AccessDenied, NoSuchProcess):
+            return None
+        for env_var in ("ASAN_OPTIONS", "TSAN_OPTIONS", "UBSAN_OPTIONS"):
+            log_path = sanitizer_opts(env.get(env_var, "")).get("log_path")
+            if log_path:
+                return dirname(log_path.strip("'\""))
+        return None
+
+    def save_logs(self, dest, *args, **kwargs):
+        self._puppet.save_logs(dest, *args, **kwargs)
+        if self._sampler.samples:
+            # resource usage leading up to the result
+            self._sampler.dump(pathjoin(dest, "resource_usage.json"))
@@ -0,0 +1,151 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from collections import deque, namedtuple
+from json import dump
+from threading import Event, Lock, Thread
+from time import time
+
+from psutil import AccessDenied, NoSuchProcess, Process
+
+__all__ = ("ProcessUsage", "ResourceSample", "ResourceSampler")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+# cpu is None the first time a process is sampled
+ProcessUsage = namedtuple("ProcessUsage", "pid cpu rss threads fds")
+ResourceSample = namedtuple("ResourceSample", "timestamp processes")
+
+
+class ResourceSampler(object):
+    """Collect the resource usage (CPU, RSS, threads and file descriptors) of a
+    process tree from a background thread. The most recent samples are kept so
+    callers can read the usage without calling psutil themselves.
+    """
+    INTERVAL = 0.5  # time in seconds between samples
+    SIZE = 240  # number of samples kept
+
+    __slots__ = ("_lock", "_pid_cb", "_procs", "_samples", "_stop", "_thread")
+
+    def __init__(self, pid_cb):
+        assert callable(pid_cb)
+        self._lock = Lock()
+        self._pid_cb = pid_cb  # returns the pid of the root process or None
+        self._procs = dict()  # Process objects are reused to calculate CPU usage
+        self._samples = deque(maxlen=self.SIZE)
+        self._stop = Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            sample = self._collect()
+            if sample is not None:
+                with self._lock:
+                    self._samples.append(sample)
+            self._stop.wait(self.INTERVAL)
+
+    def _collect(self):
+        # collect the resource usage of each process in the process tree
+        pid = self._pid_cb()
+        if pid is None:
+            return None
+        try:
+            root = self._procs.get(pid) or Process(pid)
+            tree = [root] + root.children(recursive=True)
+        except (AccessDenied, NoSuchProcess):
+            return None
+        procs = dict()
+        usage = list()
+        for proc in tree:
+            proc = self._procs.get(proc.pid, proc)
+            try:
+                with proc.oneshot():
+                    if proc.pid in self._procs:
+                        cpu = proc.cpu_percent(interval=None)
+                    else:
+                        # the first call to cpu_percent() sets the baseline
+                        proc.cpu_percent(interval=None)
+                        cpu = None
+                    fds = proc.num_fds() if hasattr(proc, "num_fds") else proc.num_handles()
+                    usage.append(ProcessUsage(proc.pid, cpu, proc.memory_info().rss, proc.num_threads(), fds))
+            except (AccessDenied, NoSuchProcess):
+                continue
+            procs[proc.pid] = proc
+        self._procs = procs
+        return ResourceSample(time(), tuple(usage))
+
+    def dump(self, dst_file):
+        """Save the collected samples as JSON.
+
+        Args:
+            dst_file (str): File to write.
+
+        Returns:
+            None
+        """
+        with open(dst_file, "w") as out_fp:
+            dump([{
+                "timestamp": x.timestamp,
+                "processes": [y._asdict() for y in x.processes]} for x in self.samples], out_fp)
+
+    def latest(self, max_age=None):
+        """Most recent sample.
+
+        Args:
+            max_age (float): Ignore samples older than `max_age` seconds.
+
+        Returns:
+            ResourceSample: Most recent sample or None.
+        """
+        with self._lock:
+            sample = self._samples[-1] if self._samples else None
+        if sample is not None and max_age is not None and sample.timestamp < time() - max_age:
+            return None
+        return sample
+
+    def reset(self):
+        """Remove collected samples.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._samples.clear()
+
+    @property
+    def samples(self):
+        with self._lock:
+            return tuple(self._samples)
+
+    def start(self):
+        """Start collecting samples in a background thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop collecting samples.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
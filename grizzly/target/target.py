@@ -139,6 +139,10 @@ class Target(metaclass=ABCMeta):
         LOG.debug("log_size() not implemented! returning 0")
         return 0
 
+    def memory_usage(self):  # pylint: disable=no-self-use
+        LOG.debug("memory_usage() not implemented! returning 0")
+        return 0
+
     @abstractproperty
     def monitor(self):
         pass
@@ -3,10 +3,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from abc import ABCMeta, abstractmethod, abstractproperty
-from os import remove
+from os import listdir
+from os.path import getsize, isfile, join as pathjoin
+from time import sleep, time
 
 
-__all__ = ("TargetMonitor",)
+__all__ = ("LogWatcher", "TargetMonitor")
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith", "Jesse Schwartzentruber"]
 
@@ -28,16 +30,116 @@ class TargetMonitor(metaclass=ABCMeta):
     def launches(self):
         pass
 
-    def log_data(self, log_id, offset=0):
-        log_file = self.clone_log(log_id, offset=offset)
-        if log_file is None:
-            return None
-        try:
-            with open(log_file, "rb") as log_fp:
-                return log_fp.read()
-        finally:
-            remove(log_file)
-
     @abstractmethod
     def log_length(self, log_id):
         pass
+
+    def log_path(self):
+        # directory containing the log files of the running target or None
+        # targets that write logs to files should override this
+        return None
+
+    def watch_logs(self):
+        """Create a LogWatcher to scan the target logs for crashes while
+        the target is running.
+
+        Args:
+            None
+
+        Returns:
+            LogWatcher: Watcher for the logs of the target.
+        """
+        return LogWatcher(self)
+
+    def wait(self, timeout=None):
+        # wait for the target to exit, returns True if the target is not running
+        # targets that can block until exit should override this
+        deadline = time() + timeout if timeout is not None else None
+        while self.is_running():
+            if deadline is not None and time() >= deadline:
+                return False
+            sleep(0.1 if deadline is None else min(0.1, max(deadline - time(), 0)))
+        return True
+
+
+class LogWatcher(object):
+    """LogWatcher incrementally scans the log files of a running target for
+    messages that are written when the target crashes. The files are read
+    directly and only data added since the previous scan is read.
+    """
+    # messages written by fatal errors
+    MARKERS = (
+        b"==ERROR:",  # ASan, LSan, MSan
+        b"Assertion failure: ",  # MOZ_ASSERT
+        b"Hit MOZ_CRASH(",
+        b"panicked at ")  # Rust panic
+    # bytes kept between scans to find markers split across reads
+    OVERLAP = max(len(x) for x in MARKERS) - 1
+
+    __slots__ = ("_log_path", "_monitor", "_offsets", "_tails")
+
+    def __init__(self, monitor):
+        self._log_path = None
+        self._monitor = monitor
+        self._offsets = dict()
+        self._tails = dict()
+
+    def _log_files(self):
+        # log files (stderr, stdout, sanitizer logs, etc) are created by the target
+        # in the log directory while it is running
+        if self._log_path is None:
+            self._log_path = self._monitor.log_path()
+            if self._log_path is None:
+                return
+        try:
+            names = listdir(self._log_path)
+        except OSError:
+            return
+        for name in names:
+            path = pathjoin(self._log_path, name)
+            if isfile(path):
+                yield path
+
+    def _scan_log(self, path):
+        # scan data added to a log file since the previous call
+        try:
+            length = getsize(path)
+        except OSError:  # pragma: no cover
+            return None
+        offset = self._offsets.get(path, 0)
+        if length < offset:
+            # the log was replaced
+            offset = 0
+            self._tails.pop(path, None)
+        if length == offset:
+            return None
+        try:
+            with open(path, "rb") as in_fp:
+                in_fp.seek(offset)
+                data = in_fp.read(length - offset)
+        except OSError:  # pragma: no cover
+            return None
+        if not data:
+            return None
+        self._offsets[path] = offset + len(data)
+        data = self._tails.get(path, b"") + data
+        self._tails[path] = data[-self.OVERLAP:]
+        for marker in self.MARKERS:
+            if marker in data:
+                return marker
+        return None
+
+    def scan(self):
+        """Scan data added to the log files since the previous scan.
+
+        Args:
+            None
+
+        Returns:
+            bytes: Marker that was found otherwise None.
+        """
+        for path in self._log_files():
+            marker = self._scan_log(path)
+            if marker is not None:
+                return marker
+        return None
@@ -2,14 +2,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=protected-access
+from http.client import HTTPConnection
 from os.path import isfile
 from platform import system
+from threading import Event, Thread
 
 from pytest import mark, raises
 
+from psutil import NoSuchProcess
+
 from ffpuppet import BrowserTerminatedError, BrowserTimeoutError, FFPuppet
 
-from .puppet_target import PuppetTarget
+from .puppet_target import _Standby, PuppetTarget
+from .resource_sampler import ProcessUsage, ResourceSample, ResourceSampler
 from .target import Target, TargetLaunchError, TargetLaunchTimeout
 
 def test_puppet_target_01(mocker, tmp_path):
@@ -43,6 +48,7 @@ def test_puppet_target_01(mocker, tmp_path):
 def test_puppet_target_02(mocker, tmp_path):
     """test PuppetTarget.launch()"""
     fake_ffp = mocker.patch("grizzly.target.puppet_target.FFPuppet", autospec=True)
+    mocker.patch("grizzly.target.puppet_target.ResourceSampler", autospec=True)
     fake_file = tmp_path / "fake"
     fake_file.touch()
     # test providing prefs.js
@@ -275,6 +281,20 @@ def test_puppet_target_06(mocker, tmp_path):
     assert target.monitor.log_length("stdout") == 100
     target.monitor.clone_log("somelog")
     assert fake_ffp.return_value.clone_log.call_count == 1
+    # log location
+    fake_proc = mocker.patch("grizzly.target.puppet_target.Process", autospec=True)
+    fake_ffp.return_value.get_pid.return_value = None
+    assert target.monitor.log_path() is None
+    assert fake_proc.call_count == 0
+    fake_ffp.return_value.get_pid.return_value = 1234
+    fake_proc.return_value.environ.return_value = {
+        "ASAN_OPTIONS": "detect_leaks=1:log_path='/tmp/ffplogs/ffp_asan_1.log'"}
+    assert target.monitor.log_path() == "/tmp/ffplogs"
+    fake_proc.assert_called_with(1234)
+    fake_proc.return_value.environ.return_value = {}
+    assert target.monitor.log_path() is None
+    fake_proc.return_value.environ.side_effect = NoSuchProcess(1234)
+    assert target.monitor.log_path() is None
 
 def test_puppet_target_07(mocker, tmp_path):
     """test PuppetTarget with GRZ_BROWSER_LOGS set"""
@@ -282,6 +302,7 @@ def test_puppet_target_07(mocker, tmp_path):
     fake_getenv = mocker.patch("grizzly.target.puppet_target.getenv", autospec=True)
     fake_getenv.return_value = str(browser_logs)
     fake_ffp = mocker.patch("grizzly.target.puppet_target.FFPuppet", autospec=True)
+    mocker.patch("grizzly.target.puppet_target.ResourceSampler", autospec=True)
     fake_file = tmp_path / "fake"
     fake_file.touch()
     target = PuppetTarget(str(fake_file), None, 300, 25, 5000, None, 35)
@@ -292,3 +313,186 @@ def test_puppet_target_07(mocker, tmp_path):
     target.cleanup()
     assert fake_ffp.return_value.save_logs.call_count == 1
     assert target._browser_logs is None
+
+def test_puppet_target_08(mocker, tmp_path):
+    """test PuppetTarget with standby browser"""
+    fake_ffp = mocker.patch("grizzly.target.puppet_target.FFPuppet", autospec=True)
+    mocker.patch("grizzly.target.puppet_target.ResourceSampler", autospec=True)
+    fake_ffp.return_value.launches = 1
+    fake_standby = mocker.patch("grizzly.target.puppet_target._Standby", autospec=True)
+    fake_standby.return_value.env_mod = {
+        "MOZ_CRASHREPORTER_SHUTDOWN": "1",
+        "MOZ_DISABLE_NONLOCAL_CONNECTIONS": "1"}
+    fake_vmem = mocker.patch("grizzly.target.puppet_target.virtual_memory", autospec=True)
+    fake_vmem.return_value.available = PuppetTarget.STANDBY_MIN_MEMORY + 5000
+    fake_file = tmp_path / "fake"
+    fake_file.touch()
+    target = PuppetTarget(str(fake_file), None, 300, 25, 5000, str(fake_file), 35, standby=True)
+    # first launch also launches standby browser
+    target.launch("launch_target_page")
+    assert fake_ffp.return_value.launch.call_count == 1
+    assert fake_standby.call_count == 1
+    assert fake_standby.return_value.start.call_count == 1
+    # relaunch uses standby browser
+    fake_standby.return_value.activate.return_value = True
+    target.launch("launch_target_page")
+    assert fake_ffp.return_value.launch.call_count == 1
+    fake_standby.return_value.activate.assert_called_with("launch_target_page", 300)
+    assert fake_ffp.return_value.clean_up.call_count == 1
+    assert target._puppet is fake_standby.return_value.puppet
+    assert target.monitor.launches == 1 + fake_standby.return_value.puppet.launches
+    assert fake_standby.call_count == 2
+    # standby browser failed
+    fake_standby.return_value.activate.return_value = False
+    target.launch("launch_target_page")
+    assert fake_standby.return_value.puppet.launch.call_count == 1
+    assert fake_standby.return_value.puppet.clean_up.call_count == 1
+    assert fake_standby.call_count == 3
+    # environment does not match
+    fake_standby.return_value.activate.reset_mock()
+    target.launch("launch_target_page", env_mod={"TEST": "1"})
+    assert fake_standby.return_value.activate.call_count == 0
+    assert fake_standby.return_value.puppet.launch.call_count == 2
+    assert fake_standby.call_count == 4
+    # insufficient memory
+    fake_vmem.return_value.available = 0
+    target.launch("launch_target_page")
+    assert fake_standby.return_value.puppet.launch.call_count == 3
+    assert fake_standby.call_count == 4
+    assert target._standby is None
+    target.cleanup()
+    # standby is not supported with rr
+    target = PuppetTarget(str(fake_file), None, 300, 25, 5000, str(fake_file), 35, rr=True, standby=True)
+    assert not target.use_standby
+
+def test_puppet_target_09(mocker, tmp_path):
+    """test PuppetTarget using ResourceSampler samples"""
+    fake_ffp = mocker.patch("grizzly.target.puppet_target.FFPuppet", autospec=True)
+    fake_ffp.return_value.cpu_usage.return_value = [(999, 90)]
+    fake_file = tmp_path / "fake"
+    fake_file.touch()
+    target = PuppetTarget(str(fake_file), None, 300, 25, 5000, None, 10)
+    target._sampler = mocker.Mock(spec=ResourceSampler)
+    # no recent sample available
+    target._sampler.latest.return_value = None
+    assert not target.is_idle(50)
+    assert fake_ffp.return_value.cpu_usage.call_count == 1
+    # use the recent sample
+    fake_ffp.reset_mock()
+    target._sampler.latest.return_value = ResourceSample(0, (
+        ProcessUsage(123, 30, 1024, 10, 12),
+        ProcessUsage(124, 10, 2048, 5, 8)))
+    assert not target.is_idle(25)
+    assert target.is_idle(50)
+    assert target.memory_usage() == 3072
+    assert fake_ffp.return_value.cpu_usage.call_count == 0
+    # processes sampled for the first time do not have cpu usage
+    target._sampler.latest.return_value = ResourceSample(0, (ProcessUsage(123, None, 1024, 10, 12),))
+    assert not target.is_idle(50)
+    assert fake_ffp.return_value.cpu_usage.call_count == 1
+    # samples are saved with the logs
+    target._sampler.samples = ()
+    target.save_logs(str(tmp_path))
+    assert target._sampler.dump.call_count == 0
+    target._sampler.samples = (target._sampler.latest.return_value,)
+    target.save_logs(str(tmp_path))
+    target._sampler.dump.assert_called_once_with(str(tmp_path / "resource_usage.json"))
+    target.cleanup()
+    assert target._sampler.stop.call_count == 1
+
+def _gate_request(location, path, results):
+    port = int(location.split(":")[-1].split("/")[0])
+    conn = HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("GET", path)
+    resp = conn.getresponse()
+    results.append((resp.status, resp.getheader("Location"), resp.read()))
+    conn.close()
+
+def test_standby_01(mocker):
+    """test _Standby"""
+    mocker.patch.object(_Standby, "REFRESH", 0.1)
+    puppet = mocker.Mock(spec=FFPuppet)
+    puppet.is_healthy.return_value = True
+    launch = mocker.Mock()
+    standby = _Standby(puppet, {"TEST": "1"})
+    try:
+        standby.start(launch)
+        results = list()
+        # unknown path
+        _gate_request(standby.location, "/favicon.ico", results)
+        assert results.pop()[0] == 404
+        launch.assert_called_once_with(puppet, standby.location, {"TEST": "1"})
+        # request is held and answered with a page that reloads the gate
+        _gate_request(standby.location, _Standby.PATH, results)
+        status, _, body = results.pop()
+        assert status == 200
+        assert b"refresh" in body
+        # activate
+        mocker.patch.object(_Standby, "REFRESH", 10)
+        client = Thread(target=_gate_request, args=(standby.location, _Standby.PATH, results))
+        client.start()
+        try:
+            assert standby.activate("http://127.0.0.1/test", 10)
+        finally:
+            client.join()
+        assert results.pop()[:2] == (302, "http://127.0.0.1/test")
+    finally:
+        standby.close()
+
+def test_standby_02(mocker):
+    """test _Standby failures"""
+    puppet = mocker.Mock(spec=FFPuppet)
+    # launch failure
+    standby = _Standby(puppet, None)
+    try:
+        standby.start(mocker.Mock(side_effect=BrowserTimeoutError))
+        assert not standby.activate("http://127.0.0.1/test", 0.1)
+    finally:
+        standby.close()
+    # unhealthy browser
+    puppet.is_healthy.return_value = False
+    standby = _Standby(puppet, None)
+    try:
+        standby.start(mocker.Mock())
+        assert not standby.activate("http://127.0.0.1/test", 10)
+    finally:
+        standby.close()
+    # browser does not request the gate
+    puppet.is_healthy.return_value = True
+    standby = _Standby(puppet, None)
+    try:
+        standby.start(mocker.Mock())
+        assert not standby.activate("http://127.0.0.1/test", 0.1)
+    finally:
+        standby.close()
+
+def test_standby_03(mocker):
+    """test _Standby.close() while the browser is launching"""
+    fake_proc = mocker.patch("grizzly.target.puppet_target.Process", autospec=True)
+    killed = Event()
+    fake_proc.return_value.kill.side_effect = killed.set
+    def _launch(*_):
+        # FFPuppet.launch() fails once the browser process is killed
+        if killed.wait(10):
+            raise BrowserTerminatedError("Failure waiting for browser connection")
+    puppet = mocker.Mock(spec=FFPuppet)
+    puppet.get_pid.return_value = 1234
+    standby = _Standby(puppet, None)
+    standby.start(_launch)
+    standby.close()
+    assert killed.is_set()
+    fake_proc.assert_called_once_with(1234)
+    assert not standby._thread.is_alive()
+    # the launch does not abort, close() does not wait indefinitely
+    mocker.patch.object(_Standby, "CLOSE_TIMEOUT", 0.1)
+    fake_proc.reset_mock()
+    fake_proc.return_value.kill.side_effect = None
+    done = Event()
+    standby = _Standby(puppet, None)
+    standby.start(lambda *_: done.wait(10))
+    try:
+        standby.close()
+        assert standby._thread.is_alive()
+    finally:
+        done.set()
+        standby._thread.join()
@@ -0,0 +1,73 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from json import load
+from os import getpid
+from time import sleep, time
+
+from psutil import NoSuchProcess
+
+from .resource_sampler import ResourceSample, ResourceSampler
+
+def test_resource_sampler_01():
+    """test ResourceSampler._collect()"""
+    sampler = ResourceSampler(lambda: None)
+    assert sampler._collect() is None
+    sampler = ResourceSampler(getpid)
+    # first sample sets the cpu baseline
+    sample = sampler._collect()
+    assert isinstance(sample, ResourceSample)
+    assert sample.processes
+    assert sample.processes[0].pid == getpid()
+    assert sample.processes[0].cpu is None
+    assert sample.processes[0].rss > 0
+    assert sample.processes[0].threads > 0
+    assert sample.processes[0].fds > 0
+    sample = sampler._collect()
+    assert sample.processes[0].cpu is not None
+
+def test_resource_sampler_02(mocker):
+    """test ResourceSampler._collect() with missing process"""
+    fake_proc = mocker.patch("grizzly.target.resource_sampler.Process", autospec=True)
+    fake_proc.side_effect = NoSuchProcess(1234)
+    sampler = ResourceSampler(lambda: 1234)
+    assert sampler._collect() is None
+
+def test_resource_sampler_03(mocker, tmp_path):
+    """test ResourceSampler samples, latest(), reset() and dump()"""
+    mocker.patch.object(ResourceSampler, "SIZE", 2)
+    sampler = ResourceSampler(getpid)
+    assert sampler.latest() is None
+    for _ in range(3):
+        sampler._samples.append(sampler._collect())
+    assert len(sampler.samples) == 2
+    assert sampler.latest() is sampler.samples[-1]
+    assert sampler.latest(max_age=60) is not None
+    sampler._samples.append(sampler._collect()._replace(timestamp=time() - 120))
+    assert sampler.latest(max_age=60) is None
+    dump_file = tmp_path / "usage.json"
+    sampler.dump(str(dump_file))
+    with dump_file.open("r") as in_fp:
+        data = load(in_fp)
+    assert len(data) == 2
+    assert data[0]["processes"][0]["pid"] == getpid()
+    sampler.reset()
+    assert not sampler.samples
+
+def test_resource_sampler_04(mocker):
+    """test ResourceSampler.start() and stop()"""
+    mocker.patch.object(ResourceSampler, "INTERVAL", 0.01)
+    sampler = ResourceSampler(getpid)
+    try:
+        sampler.start()
+        sampler.start()
+        for _ in range(100):
+            if sampler.samples:
+                break
+            sleep(0.1)
+        assert sampler.samples
+    finally:
+        sampler.stop()
+    assert sampler._thread is None
+    sampler.stop()
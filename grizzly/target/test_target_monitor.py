@@ -3,7 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import os
 
-from .target_monitor import TargetMonitor
+from .target_monitor import LogWatcher, TargetMonitor
 
 def test_target_monitor_01(tmp_path):
     """test a basic TargetMonitor"""
@@ -28,5 +28,80 @@ def test_target_monitor_01(tmp_path):
     assert mon.is_healthy()
     assert mon.is_running()
     assert mon.launches == 1
-    assert mon.log_data("test_log") == b"test"
     assert mon.log_length("test_log") == 100
+
+def test_target_monitor_02(mocker):
+    """test TargetMonitor.wait()"""
+    mocker.patch("grizzly.target.target_monitor.sleep", autospec=True)
+    class _BasicMonitor(TargetMonitor):
+        # pylint: disable=no-self-argument
+        def clone_log(_, log_id, offset=0):
+            pass
+        def is_healthy(_):
+            pass
+        def is_running(_):
+            pass
+        @property
+        def launches(_):
+            pass
+        def log_length(_, log_id):
+            pass
+    mon = _BasicMonitor()
+    mon.is_running = mocker.Mock(side_effect=(True, True, False))
+    assert mon.wait()
+    assert mon.is_running.call_count == 3
+    mon.is_running = mocker.Mock(return_value=True)
+    assert not mon.wait(timeout=0)
+
+def test_log_watcher_01(mocker, tmp_path):
+    """test LogWatcher.scan()"""
+    monitor = mocker.Mock(spec=TargetMonitor)
+    monitor.log_path.return_value = None
+    watcher = TargetMonitor.watch_logs(monitor)
+    assert isinstance(watcher, LogWatcher)
+    # log location is not available yet
+    assert watcher.scan() is None
+    monitor.log_path.return_value = str(tmp_path)
+    # empty logs
+    stderr = tmp_path / "ffp_log_stderr.txt"
+    stderr.write_bytes(b"")
+    stdout = tmp_path / "ffp_log_stdout.txt"
+    stdout.write_bytes(b"")
+    (tmp_path / "rr-traces").mkdir()
+    assert watcher.scan() is None
+    # no crash
+    stderr.write_bytes(b"start\nline\n")
+    assert watcher.scan() is None
+    # only new data is read
+    fake_open = mocker.patch("grizzly.target.target_monitor.open", create=True)
+    assert watcher.scan() is None
+    assert fake_open.call_count == 0
+    mocker.stopall()
+    # marker split across scans
+    with stderr.open("ab") as log_fp:
+        log_fp.write(b"==12345==ERR")
+    assert watcher.scan() is None
+    with stderr.open("ab") as log_fp:
+        log_fp.write(b"OR: AddressSanitizer: heap-use-after-free")
+    assert watcher.scan() == b"==ERROR:"
+    # marker in another log
+    stdout.write_bytes(b"thread '<unnamed>' panicked at 'oops', src/lib.rs:1:1")
+    assert watcher.scan() == b"panicked at "
+    # log replaced
+    stderr.write_bytes(b"Assertion failure: x")
+    assert watcher.scan() == b"Assertion failure: "
+    # sanitizer writes to a log file (log_path.<pid>)
+    san_log = tmp_path / "ffp_asan_1.log.4321"
+    san_log.write_bytes(b"==4321==ERROR: AddressSanitizer: SEGV on unknown address")
+    assert watcher.scan() == b"==ERROR:"
+    assert watcher.scan() is None
+    # the location is only looked up until it is available
+    assert monitor.log_path.call_count == 2
+    assert monitor.clone_log.call_count == 0
+
+def test_log_watcher_02(mocker, tmp_path):
+    """test LogWatcher.scan() with a missing log directory"""
+    monitor = mocker.Mock(spec=TargetMonitor)
+    monitor.log_path.return_value = str(tmp_path / "missing")
+    watcher = LogWatcher(monitor)
+    assert watcher.scan() is None
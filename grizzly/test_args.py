@@ -51,4 +51,64 @@ def test_grizzly_args_04(capsys, tmp_path):
     _, err = capsys.readouterr()
     assert "error: Adapter 'missing' does not exist. Available adapters: a1, b2" in err
 
+def test_grizzly_args_05(capsys, tmp_path):
+    """test GrizzlyArgs.parse_args() handling test windows"""
+    fake_bin = (tmp_path / "fake.bin")
+    fake_bin.touch()
+    argp = GrizzlyArgs()
+    argp._adapters = ["test_adapter"]
+    assert argp.parse_args(argv=[str(fake_bin), "test_adapter", "--test-windows", "4"]).test_windows == 4
+    with raises(SystemExit):
+        argp.parse_args(argv=[str(fake_bin), "test_adapter", "--test-windows", "0"])
+    _, err = capsys.readouterr()
+    assert "error: --test-windows must be >= 1" in err
+
+def test_grizzly_args_06(tmp_path):
+    """test GrizzlyArgs.parse_args() handling pipeline"""
+    fake_bin = (tmp_path / "fake.bin")
+    fake_bin.touch()
+    argp = GrizzlyArgs()
+    argp._adapters = ["test_adapter"]
+    assert not argp.parse_args(argv=[str(fake_bin), "test_adapter"]).pipeline
+    assert argp.parse_args(argv=[str(fake_bin), "test_adapter", "--pipeline"]).pipeline
+
+def test_grizzly_args_07(capsys, tmp_path):
+    """test GrizzlyArgs.parse_args() handling report queue"""
+    fake_bin = (tmp_path / "fake.bin")
+    fake_bin.touch()
+    argp = GrizzlyArgs()
+    argp._adapters = ["test_adapter"]
+    assert argp.parse_args(argv=[str(fake_bin), "test_adapter", "--report-queue", "2"]).report_queue == 2
+    with raises(SystemExit):
+        argp.parse_args(argv=[str(fake_bin), "test_adapter", "--report-queue", "-1"])
+    _, err = capsys.readouterr()
+    assert "error: --report-queue must be >= 0" in err
+
+def test_grizzly_args_08(capsys, tmp_path):
+    """test GrizzlyArgs.parse_args() handling adaptive relaunch"""
+    fake_bin = (tmp_path / "fake.bin")
+    fake_bin.touch()
+    argp = GrizzlyArgs()
+    argp._adapters = ["test_adapter"]
+    assert argp.parse_args(argv=[str(fake_bin), "test_adapter"]).adaptive_relaunch is None
+    args = argp.parse_args(argv=[str(fake_bin), "test_adapter", "--adaptive-relaunch", "5"])
+    assert args.adaptive_relaunch == 5
+    for value in ("0", "1001"):
+        with raises(SystemExit):
+            argp.parse_args(argv=[str(fake_bin), "test_adapter", "--adaptive-relaunch", value])
+        _, err = capsys.readouterr()
+        assert "error: --adaptive-relaunch must be >= 1 and <= --relaunch" in err
+
+def test_grizzly_args_09(capsys, tmp_path):
+    """test GrizzlyArgs.parse_args() handling adaptive timeout"""
+    fake_bin = (tmp_path / "fake.bin")
+    fake_bin.touch()
+    argp = GrizzlyArgs()
+    argp._adapters = ["test_adapter"]
+    assert argp.parse_args(argv=[str(fake_bin), "test_adapter", "--adaptive-timeout"]).adaptive_timeout
+    with raises(SystemExit):
+        argp.parse_args(argv=[str(fake_bin), "test_adapter", "--adaptive-timeout", "--ignore", "memory"])
+    _, err = capsys.readouterr()
+    assert "error: --adaptive-timeout requires '--ignore timeout'" in err
+
 # TODO: Add CommonArgs tests
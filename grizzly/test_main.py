@@ -18,6 +18,8 @@ class FakeArgs(object):
         self.binary = None
         self.input = None
         self.adapter = None
+        self.adaptive_relaunch = None
+        self.adaptive_timeout = False
         self.cache = 0
         self.coverage = False
         self.extension = None
@@ -27,11 +29,15 @@ class FakeArgs(object):
         self.log_level = 10  # 10 = DEBUG, 20 = INFO
         self.log_limit = 0
         self.memory = 0
+        self.pipeline = False
         self.platform = "test"
         self.prefs = None
         self.rr = False
         self.relaunch = 1000
+        self.report_queue = 0
         self.s3_fuzzmanager = False
+        self.standby = False
+        self.test_windows = 1
         self.timeout = 60
         self.tool = None
         self.valgrind = False
@@ -76,6 +82,12 @@ def test_main_01(tmp_path, mocker):
     args.fuzzmanager = False
     args.s3_fuzzmanager = True
     assert main(args) == Session.EXIT_SUCCESS
+    assert fake_session.call_args[1]["relaunch_policy"] is None
+    args.adaptive_relaunch = 5
+    assert main(args) == Session.EXIT_SUCCESS
+    policy = fake_session.call_args[1]["relaunch_policy"]
+    assert policy.minimum == 5
+    assert policy.maximum == args.relaunch
 
 def test_main_02(tmp_path, mocker):
     """test main()"""
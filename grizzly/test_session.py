@@ -11,8 +11,8 @@ from collections import deque
 import pytest
 
 from sapphire import Sapphire, ServerMap, SERVED_ALL, SERVED_NONE, SERVED_REQUEST, SERVED_TIMEOUT
-from .common import Adapter, IOManager, Reporter, Status, TestCase
-from .session import LogOutputLimiter, Session, SessionError
+from .common import Adapter, IOManager, RelaunchPolicy, Reporter, Status, TestCase
+from .session import LogOutputLimiter, ReportQueue, ServeTimeout, Session, SessionError, TestCaseProducer
 from .target import Target, TargetLaunchError
 
 
@@ -64,6 +64,11 @@ def test_session_02(tmp_path, mocker):
             session.run([], iteration_limit=10)
             assert session.status.iteration == 10
             assert session.status.test_name is None
+            assert session.status.timing["launch"]
+            assert len(session.status.timing["generate"]) == 10
+            assert len(session.status.timing["serve"]) == 10
+            assert len(session.status.timing["detect_failure"]) == 10
+            assert len(session.status.timing["check_relaunch"]) == 10
 
 def test_session_03(tmp_path, mocker):
     """test Session.dump_coverage()"""
@@ -119,6 +124,7 @@ def test_session_05(tmp_path, mocker):
     fake_iomgr.server_map = ServerMap()
     fake_iomgr.create_testcase.return_value = fake_testcase
     fake_iomgr.harness = None
+    fake_iomgr.test_windows = 1
     fake_iomgr.tests = mocker.Mock(spec=deque)
     fake_iomgr.working_path = str(tmp_path)
     fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
@@ -173,6 +179,7 @@ def test_session_07(tmp_path, mocker):
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase)
     fake_iomgr.harness = None
+    fake_iomgr.test_windows = 1
     fake_iomgr.server_map = ServerMap()
     fake_iomgr.tests = deque()
     fake_iomgr.working_path = str(tmp_path)
@@ -207,6 +214,7 @@ def test_session_08(tmp_path, mocker):
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase)
     fake_iomgr.harness = None
+    fake_iomgr.test_windows = 1
     fake_iomgr.server_map = ServerMap()
     fake_iomgr.tests = mocker.Mock(spec=deque)
     fake_iomgr.tests.pop.return_value = mocker.Mock(spec=TestCase)
@@ -240,6 +248,7 @@ def test_session_09(tmp_path, mocker):
     fake_adapter = mocker.Mock(spec=Adapter)
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.harness = None
+    fake_iomgr.test_windows = 1
     fake_iomgr.input_files = []
     fake_iomgr.server_map = ServerMap()
     fake_iomgr.tests = deque()
@@ -272,6 +281,7 @@ def test_session_10(tmp_path, mocker):
     Status.PATH = str(tmp_path)
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.tests = deque()
+    fake_iomgr.test_windows = 1
     fake_iomgr.working_path = str(tmp_path)
     fake_reporter = mocker.Mock(spec=Reporter)
     fake_target = mocker.Mock(spec=Target, binary="bin")
@@ -284,6 +294,334 @@ def test_session_10(tmp_path, mocker):
     assert fake_reporter.submit.call_count == 1
     assert not tmpd.is_dir()
 
+def test_session_11(tmp_path, mocker):
+    """test Session with multiple test windows"""
+    class FuzzAdapter(Adapter):
+        NAME = "fuzz"
+        def setup(self, input_path, server_map):
+            self.enable_harness()
+        def generate(self, testcase, server_map):
+            testcase.add_from_data("test", testcase.landing_page)
+    Status.PATH = str(tmp_path)
+    adapter = FuzzAdapter()
+    adapter.setup(None, None)
+    running = list()
+    def fake_serve_tc(tcase, in_flight=None, **_):
+        running.append(tuple(x.landing_page for x in in_flight))
+        return (SERVED_ALL, [tcase.landing_page])
+    fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
+    fake_serv.serve_testcase.side_effect = fake_serve_tc
+    fake_target = mocker.Mock(spec=Target, closed=True, prefs=None, rl_reset=10)
+    fake_target.launch.side_effect = lambda *_, **__: setattr(fake_target, "closed", False)
+    fake_target.log_size.return_value = 1000
+    fake_target.monitor.launches = 1
+    with IOManager(test_windows=3) as iomgr:
+        iomgr.harness = adapter.get_harness()
+        with Session(adapter, iomgr, None, fake_serv, fake_target) as session:
+            session.run([], iteration_limit=4)
+            assert session.status.iteration == 4
+        assert "windows=3" in fake_target.launch.call_args[0][0]
+        # test cases that are still running in other windows are served
+        assert running == [
+            tuple(),
+            ("test_0000.html",),
+            ("test_0000.html", "test_0001.html"),
+            ("test_0001.html", "test_0002.html")]
+        assert len(iomgr.tests) == 3
+
+def test_session_12(tmp_path, mocker):
+    """test Session with pipelined test case generation"""
+    class FuzzAdapter(Adapter):
+        NAME = "fuzz"
+        def setup(self, input_path, server_map):
+            self.enable_harness()
+            self.generated = list()
+        def generate(self, testcase, server_map):
+            self.generated.append(testcase.landing_page)
+            testcase.add_from_data("test", testcase.landing_page)
+            server_map.set_redirect("adapter_redirect", testcase.landing_page, required=False)
+    Status.PATH = str(tmp_path)
+    adapter = FuzzAdapter()
+    adapter.setup(None, None)
+    served = list()
+    def fake_serve_tc(tcase, **_):
+        served.append(tcase.landing_page)
+        if len(served) == 3:
+            # trigger a relaunch, the pending test case is kept
+            fake_target.closed = True
+        return (SERVED_ALL, [tcase.landing_page])
+    fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
+    fake_serv.serve_testcase.side_effect = fake_serve_tc
+    fake_target = mocker.Mock(spec=Target, closed=True, prefs=None, rl_reset=10)
+    fake_target.launch.side_effect = lambda *_, **__: setattr(fake_target, "closed", False)
+    fake_target.log_size.return_value = 1000
+    fake_target.monitor.launches = 1
+    with IOManager() as iomgr:
+        iomgr.harness = adapter.get_harness()
+        with Session(adapter, iomgr, None, fake_serv, fake_target, pipeline=True) as session:
+            session.run([], iteration_limit=5)
+            assert session.status.iteration == 5
+        assert fake_target.launch.call_count == 2
+        # test cases are served in order
+        assert served == ["test_%04d.html" % (x,) for x in range(5)]
+        # the test case pending at relaunch is served by the new browser
+        # only the last test case is discarded
+        assert adapter.generated == ["test_%04d.html" % (x,) for x in range(6)]
+        assert "grz_harness" in iomgr.server_map.dynamic
+        assert "grz_close_browser" in iomgr.server_map.dynamic
+        # redirects set by the adapter are kept
+        assert iomgr.server_map.redirect["adapter_redirect"].target == "test_0004.html"
+        assert "grz_next_test" in iomgr.server_map.redirect
+
+def test_session_13(tmp_path, mocker):
+    """test Session pipelined test case generation fallback"""
+    class FuzzAdapter(Adapter):
+        NAME = "fuzz"
+        def generate(self, testcase, server_map):
+            pass
+        def on_served(self, testcase, served):
+            pass
+    class PlaybackAdapter(Adapter):
+        NAME = "playback"
+        def generate(self, testcase, server_map):
+            pass
+    Status.PATH = str(tmp_path)
+    fake_producer = mocker.patch("grizzly.session.TestCaseProducer", autospec=True)
+    fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
+    fake_serv.serve_testcase.side_effect = lambda tc, **_: (SERVED_ALL, [tc.landing_page])
+    fake_target = mocker.Mock(spec=Target, prefs=None)
+    fake_target.log_size.return_value = 1000
+    fake_target.monitor.launches = 1
+    with IOManager() as iomgr:
+        # Adapter.on_served() is overridden
+        adapter = FuzzAdapter()
+        with Session(adapter, iomgr, None, fake_serv, fake_target, pipeline=True) as session:
+            assert not session.pipeline_supported()
+            session.run([], iteration_limit=2)
+        # Adapter.remaining is in use
+        adapter = PlaybackAdapter()
+        adapter.remaining = 1
+        with Session(adapter, iomgr, None, fake_serv, fake_target, pipeline=True) as session:
+            assert not session.pipeline_supported()
+    assert fake_producer.call_count == 0
+
+def test_session_14(tmp_path, mocker):
+    """test Session.report_result() with report queue"""
+    fake_report = mocker.patch("grizzly.session.Report", autospec=True)
+    Status.PATH = str(tmp_path)
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    tests = [mocker.Mock(spec=TestCase), mocker.Mock(spec=TestCase)]
+    fake_iomgr.tests = deque(tests)
+    fake_iomgr.test_windows = 1
+    fake_iomgr.working_path = str(tmp_path)
+    fake_reporter = mocker.Mock(spec=Reporter)
+    fake_target = mocker.Mock(spec=Target, binary="bin")
+    with Session(None, fake_iomgr, fake_reporter, None, fake_target, report_queue=2) as session:
+        session.report_result()
+        # the report queue owns the test cases
+        fake_iomgr.purge_tests.assert_called_once_with(cleanup=False)
+    assert fake_target.save_logs.call_count == 1
+    assert fake_report.from_path.return_value.crash_info.call_count == 1
+    assert fake_reporter.submit.call_count == 1
+    assert fake_reporter.submit.call_args[0][0] == list(reversed(tests))
+    assert all(x.cleanup.call_count == 1 for x in tests)
+    assert not any(tmp_path.glob("grz_logs_*"))
+
+def test_session_15(tmp_path, mocker):
+    """test Session with RelaunchPolicy"""
+    class FuzzAdapter(Adapter):
+        NAME = "fuzz"
+        def setup(self, input_path, server_map):
+            self.enable_harness()
+        def generate(self, testcase, server_map):
+            pass
+    Status.PATH = str(tmp_path)
+    adapter = FuzzAdapter()
+    adapter.setup(None, None)
+    fake_policy = mocker.Mock(spec=RelaunchPolicy)
+    fake_policy.update.return_value = 2
+    fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
+    fake_serv.serve_testcase.side_effect = lambda tc, **_: (SERVED_ALL, [tc.landing_page])
+    fake_target = mocker.Mock(spec=Target, closed=True, prefs=None, rl_reset=10)
+    fake_target.launch.side_effect = lambda *_, **__: setattr(fake_target, "closed", False)
+    fake_target.log_size.return_value = 1000
+    fake_target.memory_usage.return_value = 2000
+    fake_target.monitor.launches = 1
+    with IOManager() as iomgr:
+        iomgr.harness = adapter.get_harness()
+        with Session(adapter, iomgr, None, fake_serv, fake_target, relaunch_policy=fake_policy) as session:
+            session.run([], iteration_limit=3)
+            assert session.status.relaunch == 2
+    assert fake_target.rl_reset == 2
+    assert "close_after=2" in fake_target.launch.call_args[0][0]
+    assert fake_policy.update.call_count == 1
+    assert fake_policy.launched.call_count == 1
+    assert fake_policy.sample.call_count == 2
+    assert fake_policy.sample.call_args[1] == {"log_size": 1000, "memory_usage": 2000}
+
+def test_session_16(tmp_path, mocker):
+    """test Session with adaptive timeout"""
+    class FuzzAdapter(Adapter):
+        NAME = "fuzz"
+        def generate(self, testcase, server_map):
+            pass
+    Status.PATH = str(tmp_path)
+    mocker.patch.object(ServeTimeout, "MIN_SAMPLES", 2)
+    timeouts = list()
+    def fake_serve_tc(tcase, **_):
+        timeouts.append(fake_serv.timeout)
+        if len(timeouts) == 4:
+            return (SERVED_TIMEOUT, [tcase.landing_page])
+        tcase.duration = 2.0
+        return (SERVED_ALL, [tcase.landing_page])
+    fake_serv = mocker.Mock(spec=Sapphire, port=0x1337, timeout=60)
+    fake_serv.serve_testcase.side_effect = fake_serve_tc
+    fake_target = mocker.Mock(spec=Target, prefs=None)
+    fake_target.closed = False
+    fake_target.detect_failure.return_value = Target.RESULT_NONE
+    fake_target.log_size.return_value = 1000
+    fake_target.monitor.launches = 1
+    with IOManager() as iomgr:
+        with Session(FuzzAdapter(), iomgr, None, fake_serv, fake_target, adaptive_timeout=True) as session:
+            session.run(["timeout"], iteration_limit=5)
+    assert timeouts == [60, 60, 10, 10, 60]
+    # timeouts must be ignored
+    timeouts.clear()
+    with IOManager() as iomgr:
+        with Session(FuzzAdapter(), iomgr, None, fake_serv, fake_target, adaptive_timeout=True) as session:
+            session.run([], iteration_limit=3)
+    assert timeouts == [60, 60, 60]
+
+def test_session_17(tmp_path, mocker):
+    """test Session.report_result() with multiple test windows"""
+    fake_report = mocker.patch("grizzly.session.Report", autospec=True)
+    Status.PATH = str(tmp_path)
+    fake_reporter = mocker.Mock(spec=Reporter)
+    fake_target = mocker.Mock(spec=Target, binary="bin")
+    with IOManager(report_size=2, test_windows=3) as iomgr:
+        tests = list()
+        for _ in range(4):
+            tests.append(iomgr.create_testcase("fuzz"))
+        # the harness reported that the windows of these test cases closed
+        for test in tests[1:3]:
+            iomgr.server_map.dynamic[iomgr.done_url(test.landing_page)].target()
+        with Session(None, iomgr, fake_reporter, None, fake_target) as session:
+            session.report_result()
+        assert fake_report.from_path.call_count == 1
+        # the test case that was running is reported first
+        assert fake_reporter.submit.call_args[0][0][0] is tests[3]
+        assert list(fake_reporter.submit.call_args[0][0])[1:] == [tests[2], tests[1], tests[0]]
+        # all test case windows were closed
+        fake_reporter.reset_mock()
+        iomgr.server_map.dynamic[iomgr.done_url(tests[3].landing_page)].target()
+        with Session(None, iomgr, fake_reporter, None, fake_target) as session:
+            session.report_result()
+        assert len(fake_reporter.submit.call_args[0][0]) == 4
+
+def test_session_18(tmp_path, mocker):
+    """test Session with pipelined test case generation and Adapter.pre_launch()"""
+    class FuzzAdapter(Adapter):
+        NAME = "fuzz"
+        def setup(self, input_path, server_map):
+            self.calls = list()
+        def generate(self, testcase, server_map):
+            self.calls.append(("generate", testcase.landing_page))
+            testcase.add_from_data("test", testcase.landing_page)
+        def pre_launch(self):
+            self.calls.append(("pre_launch", None))
+    Status.PATH = str(tmp_path)
+    adapter = FuzzAdapter()
+    adapter.setup(None, None)
+    served = list()
+    def fake_serve_tc(tcase, **_):
+        served.append(tcase.landing_page)
+        if len(served) == 2:
+            # trigger a relaunch
+            fake_target.closed = True
+        return (SERVED_ALL, [tcase.landing_page])
+    fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
+    fake_serv.serve_testcase.side_effect = fake_serve_tc
+    fake_target = mocker.Mock(spec=Target, closed=True, prefs=None, rl_reset=10)
+    fake_target.launch.side_effect = lambda *_, **__: setattr(fake_target, "closed", False)
+    fake_target.log_size.return_value = 1000
+    fake_target.monitor.launches = 1
+    with IOManager() as iomgr:
+        with Session(adapter, iomgr, None, fake_serv, fake_target, pipeline=True) as session:
+            session.run([], iteration_limit=3)
+    assert served == ["test_0000.html", "test_0001.html", "test_0002.html"]
+    # the test case pending at relaunch is generated again after pre_launch()
+    assert adapter.calls == [
+        ("pre_launch", None),
+        ("generate", "test_0000.html"),
+        ("generate", "test_0001.html"),
+        ("generate", "test_0002.html"),
+        ("pre_launch", None),
+        ("generate", "test_0002.html"),
+        ("generate", "test_0003.html")]
+
+def test_serve_timeout_01(mocker):
+    """test ServeTimeout"""
+    mocker.patch.object(ServeTimeout, "MIN_SAMPLES", 10)
+    mocker.patch.object(ServeTimeout, "RECOVER", 2)
+    serve_timeout = ServeTimeout(60)
+    assert serve_timeout.current == 60
+    # not enough samples
+    for _ in range(9):
+        serve_timeout.completed(12.0)
+    assert serve_timeout.current == 60
+    # 12 * 1.5
+    serve_timeout.completed(12.0)
+    assert serve_timeout.current == 18
+    # timeout uses the maximum until RECOVER iterations complete
+    serve_timeout.timed_out()
+    assert serve_timeout.current == 60
+    serve_timeout.completed(12.0)
+    serve_timeout.completed(12.0)
+    assert serve_timeout.current == 60
+    serve_timeout.completed(12.0)
+    assert serve_timeout.current == 18
+    # limited by minimum and maximum
+    serve_timeout = ServeTimeout(60)
+    for _ in range(10):
+        serve_timeout.completed(0.5)
+    assert serve_timeout.current == ServeTimeout.MINIMUM
+    serve_timeout.completed(100.0)
+    assert serve_timeout.current == 60
+    assert ServeTimeout(5).minimum == 5
+
+def test_report_queue_01(mocker):
+    """test ReportQueue"""
+    fake_handler = mocker.Mock()
+    queue = ReportQueue(fake_handler, max_pending=1)
+    queue.submit(1, 2)
+    queue.submit(3, 4)
+    queue.close()
+    assert fake_handler.call_args_list == [((1, 2),), ((3, 4),)]
+    # exceptions raised by the handler are raised by submit() or close()
+    fake_handler.side_effect = RuntimeError("test")
+    queue = ReportQueue(fake_handler)
+    queue.submit(1)
+    with pytest.raises(RuntimeError, match="test"):
+        queue.close()
+    # close() can be called more than once
+    queue.close()
+
+def test_testcase_producer_01():
+    """test TestCaseProducer"""
+    producer = TestCaseProducer()
+    assert not producer.busy
+    producer.start(lambda x, y: x + y, 1, 2)
+    assert producer.busy
+    assert producer.take() == 3
+    assert not producer.busy
+    # exceptions raised by the generator are raised by take()
+    def _generator():
+        raise RuntimeError("test")
+    producer.start(_generator)
+    with pytest.raises(RuntimeError, match="test"):
+        producer.take()
+    assert not producer.busy
+
 def test_log_output_limiter_01(mocker):
     """test LogOutputLimiter.ready() not ready"""
     fake_time = mocker.patch("grizzly.session.time", autospec=True)
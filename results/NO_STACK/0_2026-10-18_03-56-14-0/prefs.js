@@ -0,0 +1 @@
+main prefs
\ No newline at end of file
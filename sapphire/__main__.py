@@ -33,6 +33,9 @@ def parse_args(argv=None):
     parser.add_argument(
         "--remote", action="store_true",
         help="Allow connections from addresses other than 127.0.0.1")
+    parser.add_argument(
+        "--selector", action="store_true",
+        help="Serve all connections from a single threaded event loop")
     parser.add_argument(
         "--timeout", type=int,
         help="Duration in seconds to serve before exiting. Default run forever.")
@@ -0,0 +1,13 @@
+# coding=utf-8
+"""
+Sapphire benchmark
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from .benchmark import Benchmark, Job, JobShape, SHAPES
+
+__all__ = ("Benchmark", "Job", "JobShape", "SHAPES")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
@@ -0,0 +1,69 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from argparse import ArgumentParser
+from logging import basicConfig, DEBUG, INFO
+from sys import exit as sysexit
+
+from .benchmark import Benchmark, SHAPES
+
+
+def configure_logging(log_level):
+    if log_level == DEBUG:
+        log_fmt = "%(levelname).1s %(name)s [%(asctime)s] %(message)s"
+    else:
+        log_fmt = "[%(asctime)s] %(message)s"
+    basicConfig(format=log_fmt, datefmt="%Y-%m-%d %H:%M:%S", level=log_level)
+
+def parse_args(argv=None):
+    # log levels for console logging
+    level_map = {"DEBUG": DEBUG, "INFO": INFO}
+    parser = ArgumentParser(description="Measure Sapphire performance using synthetic HTTP clients")
+    parser.add_argument(
+        "--baseline",
+        help="Compare results to a baseline (JSON file created with --output)."
+             " Exit with 1 if a regression is found.")
+    parser.add_argument(
+        "--clients", default=4, type=int,
+        help="Number of concurrent clients (default: %(default)s)")
+    parser.add_argument(
+        "--iterations", default=5, type=int,
+        help="Number of times each job shape is served (default: %(default)s)")
+    parser.add_argument(
+        "--log-level", default="INFO",
+        help="Configure console logging. Options: %s (default: %%(default)s)" %
+        ", ".join(k for k, v in sorted(level_map.items(), key=lambda x: x[1])))
+    parser.add_argument(
+        "--no-keep-alive", action="store_true",
+        help="Use a new connection for each request")
+    parser.add_argument(
+        "--output",
+        help="Save results to a JSON file")
+    parser.add_argument(
+        "--selector", action="store_true",
+        help="Serve all connections from a single threaded event loop")
+    parser.add_argument(
+        "--shapes", nargs="+", choices=tuple(SHAPES),
+        help="Job shapes to run (default: all)")
+    parser.add_argument(
+        "--tolerance", default=0.1, type=float,
+        help="Allowed change compared to the baseline before a result is"
+             " considered a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+    # sanity check
+    if args.clients < 1:
+        parser.error("--clients must be at least 1")
+    if args.iterations < 1:
+        parser.error("--iterations must be at least 1")
+    if args.tolerance < 0:
+        parser.error("--tolerance must be positive")
+    log_level = level_map.get(args.log_level.upper(), None)
+    if log_level is None:
+        parser.error("Invalid log-level %r" % (args.log_level,))
+    args.log_level = log_level
+    return args
+
+ARGS = parse_args()
+configure_logging(ARGS.log_level)
+sysexit(Benchmark.main(ARGS))
@@ -0,0 +1,392 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Sapphire benchmark using synthetic HTTP clients
+"""
+from collections import namedtuple, OrderedDict
+from http.client import HTTPConnection, HTTPException
+from io import BytesIO
+import json
+from logging import getLogger
+from math import ceil
+import os
+import platform
+from queue import Empty, Queue
+from shutil import rmtree
+import socket
+from tempfile import mkdtemp
+import threading
+import time
+
+from ..core import Sapphire
+from ..server_map import ServerMap
+from ..status_codes import SERVED_ALL
+
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = getLogger("sphr_bench")
+
+# description: short description of the job shape
+# prepare: callable that creates the content of a job in a directory and returns a Job
+JobShape = namedtuple("JobShape", "description prepare")
+# optional: URLs to request that are not required to complete the job
+# required: URLs to request that are required to complete the job
+# server_map: ServerMap to use or None
+# testcase: serve the files in wwwroot from memory using serve_testcase() if True
+# wwwroot: directory to serve
+Job = namedtuple("Job", "optional required server_map testcase wwwroot")
+
+
+class _TestFile(object):
+    __slots__ = ("data_file", "file_name")
+
+    def __init__(self, file_name, data):
+        self.data_file = BytesIO(data)
+        self.file_name = file_name
+
+
+class _TestCase(object):
+    """Minimal in memory test case that can be passed to Sapphire.serve_testcase()"""
+    __slots__ = ("_files", "duration", "optional", "required")
+
+    def __init__(self, path):
+        self._files = dict()
+        self.duration = None
+        self.optional = tuple()
+        for entry in os.listdir(path):
+            with open(os.path.join(path, entry), "rb") as in_fp:
+                self._files[entry] = _TestFile(entry, in_fp.read())
+        self.required = tuple(self._files)
+
+    def get_file(self, file_name):
+        return self._files.get(file_name)
+
+
+def _write_files(path, count, size, prefix="file"):
+    data = os.urandom(size)
+    names = list()
+    for num in range(count):
+        name = "%s_%04d.bin" % (prefix, num)
+        with open(os.path.join(path, name), "wb") as out_fp:
+            out_fp.write(data)
+        names.append(name)
+    return names
+
+
+def _small_files(path):
+    return Job(tuple(), _write_files(path, 500, 0x400), None, False, path)
+
+
+def _large_files(path):
+    return Job(tuple(), _write_files(path, 4, 0x2000000), None, False, path)
+
+
+def _in_memory(path):
+    return Job(tuple(), _write_files(path, 500, 0x400), None, True, path)
+
+
+def _turnaround(path):
+    # a single small file so the time spent by serve_testcase() is mostly fixed overhead
+    return Job(tuple(), _write_files(path, 1, 0x400), None, True, path)
+
+
+def _includes(path):
+    srv_map = ServerMap()
+    optional = list()
+    for num in range(10):
+        inc_path = os.path.join(path, "inc_%02d" % (num,))
+        os.makedirs(os.path.join(inc_path, "nested"))
+        srv_map.set_include("inc_%02d" % (num,), inc_path)
+        for name in _write_files(inc_path, 25, 0x800):
+            optional.append("inc_%02d/%s" % (num, name))
+        for name in _write_files(os.path.join(inc_path, "nested"), 25, 0x800):
+            optional.append("inc_%02d/nested/%s" % (num, name))
+    wwwroot = os.path.join(path, "wwwroot")
+    os.makedirs(wwwroot)
+    return Job(tuple(optional), _write_files(wwwroot, 10, 0x400, prefix="index"), srv_map, False, wwwroot)
+
+
+def _redirects(path):
+    srv_map = ServerMap()
+    required = _write_files(path, 250, 0x400)
+    for num, name in enumerate(tuple(required)):
+        srv_map.set_redirect("redirect_%04d" % (num,), name)
+        required.append("redirect_%04d" % (num,))
+    return Job(tuple(), required, srv_map, False, path)
+
+
+def _dynamic(path):
+    srv_map = ServerMap()
+    data = os.urandom(0x4000)
+    optional = list()
+    for num in range(250):
+        srv_map.set_dynamic_response("dynamic_%04d" % (num,), lambda: data)
+        optional.append("dynamic_%04d" % (num,))
+    srv_map.set_dynamic_response("stream", lambda: (data for _ in range(256)))
+    optional.extend("stream" for _ in range(10))
+    return Job(tuple(optional), _write_files(path, 10, 0x400), srv_map, False, path)
+
+
+SHAPES = OrderedDict((
+    ("small_files", JobShape("500 files of 1KB", _small_files)),
+    ("large_files", JobShape("4 files of 32MB", _large_files)),
+    ("in_memory", JobShape("500 files of 1KB served with serve_testcase()", _in_memory)),
+    ("turnaround", JobShape("1 file of 1KB served with serve_testcase()", _turnaround)),
+    ("includes", JobShape("500 files of 2KB in 10 includes and 10 required files", _includes)),
+    ("redirects", JobShape("250 redirects and 250 files of 1KB", _redirects)),
+    ("dynamic", JobShape("250 dynamic responses, 10 streamed and 10 required files", _dynamic)),
+))
+
+
+def percentile(values, pct):
+    """Calculate a percentile using the nearest rank method.
+
+    Args:
+        values (list): Sorted values.
+        pct (float): Percentile (0 - 100).
+
+    Returns:
+        float: Percentile or 0 if values is empty.
+    """
+    if not values:
+        return 0
+    return values[max(int(ceil(len(values) * pct / 100.0)), 1) - 1]
+
+
+class Benchmark(object):
+    """Measure the performance of Sapphire by serving jobs of different shapes
+    to concurrent synthetic HTTP clients.
+    """
+    VERSION = 2  # version of the results format
+
+    __slots__ = ("clients", "iterations", "keep_alive", "use_selector")
+
+    def __init__(self, clients=4, iterations=5, keep_alive=True, use_selector=False):
+        assert clients > 0
+        assert iterations > 0
+        self.clients = clients
+        self.iterations = iterations
+        self.keep_alive = keep_alive  # use persistent connections
+        self.use_selector = use_selector
+
+    @staticmethod
+    def _client(port, job_queues, ready, stats, keep_alive=True, retries=10):
+        # optional URLs are requested by all clients before required URLs so
+        # every request is received before the job is complete
+        conn = None
+        try:
+            for index, urls in enumerate(job_queues):
+                if index > 0:
+                    ready.wait()
+                while retries > 0:
+                    try:
+                        url = urls.get_nowait()
+                    except Empty:
+                        break
+                    if conn is None:
+                        conn = HTTPConnection("127.0.0.1", port, timeout=60)
+                    start = time.time()
+                    try:
+                        conn.request("GET", "/%s" % (url,))
+                        resp = conn.getresponse()
+                        size = len(resp.read())
+                        will_close = resp.will_close
+                    except (HTTPException, socket.error):
+                        stats.add_error()
+                        conn.close()
+                        conn = None
+                        # the request must be retried or the job will not complete
+                        urls.put(url)
+                        retries -= 1
+                        continue
+                    stats.add_request(time.time() - start, size, resp.status)
+                    if will_close or not keep_alive:
+                        conn.close()
+                        conn = None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @staticmethod
+    def compare(baseline, results, tolerance=0.1):
+        """Compare results to a baseline.
+
+        Args:
+            baseline (dict): Results loaded from a baseline file.
+            results (dict): Results from run().
+            tolerance (float): Allowed change before a result is a regression.
+
+        Returns:
+            list: Descriptions (str) of the regressions found.
+        """
+        regressions = list()
+        if baseline.get("version") != results["version"]:
+            LOG.warning("Baseline version mismatch, skipping comparison")
+            return regressions
+        for name, current in results["shapes"].items():
+            previous = baseline["shapes"].get(name)
+            if previous is None:
+                continue
+            # (key, True if larger is better)
+            for key, larger in (
+                    ("req_per_sec", True),
+                    ("latency_p50", False),
+                    ("latency_p99", False),
+                    ("served_all_p50", False),
+                    ("served_all_p99", False)):
+                if not previous[key]:
+                    continue
+                change = (current[key] - previous[key]) / previous[key]
+                if (larger and change < -tolerance) or (not larger and change > tolerance):
+                    regressions.append("%s %s: %0.4f -> %0.4f (%+0.1f%%)" % (
+                        name, key, previous[key], current[key], change * 100))
+        return regressions
+
+    def run(self, shapes=None):
+        """Run the benchmark.
+
+        Args:
+            shapes (dict): Mapping of names to JobShapes. SHAPES is used if None.
+
+        Returns:
+            dict: Results that can be stored as JSON.
+        """
+        if shapes is None:
+            shapes = SHAPES
+        results = {
+            "config": {
+                "clients": self.clients,
+                "iterations": self.iterations,
+                "keep_alive": self.keep_alive,
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "use_selector": self.use_selector},
+            "shapes": OrderedDict(),
+            "version": self.VERSION}
+        for name, shape in shapes.items():
+            LOG.info("Running %r (%s)...", name, shape.description)
+            working_path = mkdtemp(prefix="sphr_bench_")
+            try:
+                results["shapes"][name] = self.run_shape(shape, working_path)
+            finally:
+                rmtree(working_path, ignore_errors=True)
+            LOG.info(
+                "%s: %0.1f req/s, latency p50 %0.2fms, p99 %0.2fms, SERVED_ALL p50 %0.2fms",
+                name,
+                results["shapes"][name]["req_per_sec"],
+                results["shapes"][name]["latency_p50"] * 1000,
+                results["shapes"][name]["latency_p99"] * 1000,
+                results["shapes"][name]["served_all_p50"] * 1000)
+        return results
+
+    def run_shape(self, shape, working_path):
+        """Serve a job shape to the clients multiple times.
+
+        Args:
+            shape (JobShape): Job shape to run.
+            working_path (str): Directory to create the job content in.
+
+        Returns:
+            dict: Results of the job shape.
+        """
+        job = shape.prepare(working_path)
+        testcase = _TestCase(job.wwwroot) if job.testcase else None
+        stats = _Stats()
+        served_all = list()
+        total = 0
+        with Sapphire(keep_alive=10 if self.keep_alive else 0, timeout=300,
+                      use_selector=self.use_selector) as serv:
+            for _ in range(self.iterations):
+                job_queues = (Queue(), Queue())
+                for url in job.optional:
+                    job_queues[0].put(url)
+                for url in job.required:
+                    job_queues[1].put(url)
+                ready = threading.Barrier(self.clients)
+                clients = list()
+                for _ in range(self.clients):
+                    clients.append(threading.Thread(
+                        target=self._client,
+                        args=(serv.port, job_queues, ready, stats),
+                        kwargs={"keep_alive": self.keep_alive}))
+                start = time.time()
+                for client in clients:
+                    client.start()
+                try:
+                    # time from the start of serving until the job is complete
+                    serve_start = time.time()
+                    if testcase is not None:
+                        status = serv.serve_testcase(testcase, server_map=job.server_map)[0]
+                    else:
+                        status = serv.serve_path(job.wwwroot, server_map=job.server_map)[0]
+                    serve_elapsed = time.time() - serve_start
+                finally:
+                    for client in clients:
+                        client.join()
+                if status != SERVED_ALL:
+                    LOG.warning("Job was not complete (status: %r)", status)
+                else:
+                    served_all.append(serve_elapsed)
+                total += time.time() - start
+        latencies = sorted(stats.latencies)
+        served_all.sort()
+        return {
+            "bytes": stats.received,
+            "errors": stats.errors,
+            "incomplete": self.iterations - len(served_all),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p99": percentile(latencies, 99),
+            "req_per_sec": len(latencies) / total if total else 0,
+            "requests": len(latencies),
+            "served_all_p50": percentile(served_all, 50),
+            "served_all_p99": percentile(served_all, 99),
+            "status": dict((str(code), count) for code, count in sorted(stats.status.items()))}
+
+    @classmethod
+    def main(cls, args):
+        bench = cls(
+            clients=args.clients,
+            iterations=args.iterations,
+            keep_alive=not args.no_keep_alive,
+            use_selector=args.selector)
+        shapes = OrderedDict((name, SHAPES[name]) for name in args.shapes) if args.shapes else None
+        results = bench.run(shapes=shapes)
+        if args.output:
+            with open(args.output, "w") as out_fp:
+                json.dump(results, out_fp, indent=2, sort_keys=True)
+            LOG.info("Results saved to %r", args.output)
+        if args.baseline:
+            with open(args.baseline, "r") as in_fp:
+                baseline = json.load(in_fp)
+            regressions = cls.compare(baseline, results, tolerance=args.tolerance)
+            for regression in regressions:
+                LOG.warning("Regression: %s", regression)
+            if regressions:
+                return 1
+            LOG.info("No regressions found compared to %r", args.baseline)
+        return 0
+
+
+class _Stats(object):
+    """Request statistics shared by the clients"""
+    __slots__ = ("_lock", "errors", "latencies", "received", "status")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.errors = 0
+        self.latencies = list()
+        self.received = 0
+        self.status = dict()
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def add_request(self, latency, size, status):
+        with self._lock:
+            self.latencies.append(latency)
+            self.received += size
+            self.status[status] = self.status.get(status, 0) + 1
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""
+Sapphire benchmark unit tests
+"""
+import json
+import os
+
+import pytest
+
+from .benchmark import Benchmark, Job, JobShape, percentile, SHAPES
+from ..server_map import ServerMap
+
+
+def _tiny_job(path):
+    srv_map = ServerMap()
+    srv_map.set_dynamic_response("dynamic", lambda: b"dynamic")
+    srv_map.set_redirect("redirect", "test_0.html")
+    required = ["redirect"]
+    for num in range(10):
+        with open(os.path.join(path, "test_%d.html" % (num,)), "wb") as out_fp:
+            out_fp.write(b"test")
+        required.append("test_%d.html" % (num,))
+    return Job(("dynamic",) * 5, required, srv_map, False, path)
+
+
+def _tiny_testcase(path):
+    with open(os.path.join(path, "test.html"), "wb") as out_fp:
+        out_fp.write(b"test")
+    return Job(tuple(), ["test.html"], None, True, path)
+
+
+def test_percentile_01():
+    """test percentile()"""
+    assert percentile([], 50) == 0
+    assert percentile([1], 99) == 1
+    values = list(range(1, 101))
+    assert percentile(values, 0) == 1
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+
+
+@pytest.mark.parametrize("keep_alive", [False, True])
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_benchmark_01(tmp_path, keep_alive, use_selector):
+    """test Benchmark.run_shape()"""
+    bench = Benchmark(clients=3, iterations=2, keep_alive=keep_alive, use_selector=use_selector)
+    result = bench.run_shape(JobShape("tiny", _tiny_job), str(tmp_path))
+    assert result["errors"] == 0
+    assert result["incomplete"] == 0
+    assert result["requests"] == 32
+    assert result["status"] == {"200": 30, "307": 2}
+    assert result["req_per_sec"] > 0
+    assert 0 < result["latency_p50"] <= result["latency_p99"]
+    assert 0 < result["served_all_p50"] <= result["served_all_p99"]
+
+
+def test_benchmark_02(tmp_path):
+    """test Benchmark.run_shape() with serve_testcase()"""
+    result = Benchmark(clients=2, iterations=1).run_shape(JobShape("tiny", _tiny_testcase), str(tmp_path))
+    assert result["incomplete"] == 0
+    assert result["requests"] == 1
+    assert result["bytes"] == 4
+
+
+def test_benchmark_03():
+    """test Benchmark.compare()"""
+    results = {"shapes": {"a": {
+        "latency_p50": 1.0,
+        "latency_p99": 2.0,
+        "req_per_sec": 100.0,
+        "served_all_p50": 1.0,
+        "served_all_p99": 0}}, "version": Benchmark.VERSION}
+    assert not Benchmark.compare(results, results)
+    # version mismatch
+    assert not Benchmark.compare({"version": -1}, results)
+    # missing shape
+    assert not Benchmark.compare({"shapes": {}, "version": Benchmark.VERSION}, results)
+    # regressions
+    current = {"shapes": {"a": {
+        "latency_p50": 1.05,
+        "latency_p99": 3.0,
+        "req_per_sec": 50.0,
+        "served_all_p50": 0.5,
+        "served_all_p99": 1.0}}, "version": Benchmark.VERSION}
+    regressions = Benchmark.compare(results, current, tolerance=0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("a req_per_sec:")
+    assert regressions[1].startswith("a latency_p99:")
+
+
+def test_benchmark_04(mocker, tmp_path):
+    """test Benchmark.main()"""
+    mocker.patch.dict(
+        "sapphire.benchmark.benchmark.SHAPES", {"tiny": JobShape("tiny", _tiny_job)}, clear=True)
+    output = tmp_path / "results.json"
+    args = mocker.Mock(
+        baseline=None,
+        clients=2,
+        iterations=1,
+        no_keep_alive=False,
+        output=str(output),
+        selector=False,
+        shapes=None,
+        tolerance=0.1)
+    assert Benchmark.main(args) == 0
+    results = json.loads(output.read_text())
+    assert results["version"] == Benchmark.VERSION
+    assert "tiny" in results["shapes"]
+    # compare to baseline
+    args.baseline = str(output)
+    args.output = None
+    args.shapes = ["tiny"]
+    args.tolerance = 1000
+    assert Benchmark.main(args) == 0
+    # regression
+    mocker.patch.object(Benchmark, "compare", return_value=["regression"])
+    assert Benchmark.main(args) == 1
+
+
+def test_benchmark_05(tmp_path):
+    """test SHAPES prepare valid jobs"""
+    for name, shape in SHAPES.items():
+        if name == "large_files":
+            continue
+        path = tmp_path / name
+        path.mkdir()
+        job = shape.prepare(str(path))
+        assert job.required
+        assert os.path.isdir(job.wwwroot)
+        redirects = job.server_map.redirect if job.server_map is not None else dict()
+        for url in job.required:
+            assert url in redirects or os.path.isfile(os.path.join(job.wwwroot, url))
+
+
+def test_benchmark_06(tmp_path):
+    """test Benchmark.run_shape() turnaround shape"""
+    result = Benchmark(clients=2, iterations=3).run_shape(SHAPES["turnaround"], str(tmp_path))
+    assert result["errors"] == 0
+    assert result["incomplete"] == 0
+    assert result["requests"] == 3
+    assert result["bytes"] == 0x400 * 3
+    assert 0 < result["served_all_p50"] <= result["served_all_p99"]
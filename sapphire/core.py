@@ -6,6 +6,7 @@ Sapphire HTTP server
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import errno
+from itertools import chain
 import logging
 import os
 import random
@@ -14,8 +15,10 @@ import socket
 import tempfile
 import time
 
+from .metrics import ServeResult, ServerMetrics
 from .sapphire_job import SapphireJob
 from .sapphire_load_manager import SapphireLoadManager
+from .sapphire_selector import SapphireSelector
 from .status_codes import SERVED_ALL, SERVED_NONE, SERVED_TIMEOUT
 
 
@@ -27,11 +30,18 @@ LOG = logging.getLogger("sapphire")
 
 
 class Sapphire(object):
-    def __init__(self, allow_remote=False, auto_close=-1, max_workers=10, port=None, timeout=60):
+    def __init__(self, allow_remote=False, auto_close=-1, keep_alive=5, max_workers=10, multiplexer=None,
+                 port=None, timeout=60, use_selector=False):
+        assert multiplexer is None or not use_selector, "use_selector is not supported by multiplexer"
         self._auto_close = auto_close  # call 'window.close()' on 4xx error pages
+        self._keep_alive = keep_alive  # persistent connection idle timeout (0 to disable)
+        self._manager = None  # serves jobs, remains active between jobs
         self._max_workers = max_workers  # limit worker threads
+        self._metrics = ServerMetrics()  # metrics of all jobs served
+        self._multiplexer = multiplexer  # shared listener and worker pool (SapphireMultiplexer)
         self._socket = Sapphire._create_listening_socket(allow_remote, port)
         self._timeout = None
+        self._use_selector = use_selector  # use single threaded event loop instead of worker threads
         self.timeout = timeout
 
     def __enter__(self):
@@ -66,14 +76,59 @@ class Sapphire(object):
             break
         return sock
 
+    def _serve_job(self, job, continue_cb):
+        if not job.pending:
+            job.finish()
+            LOG.debug("nothing to serve")
+            return ServeResult(SERVED_NONE, tuple(), metrics=job.metrics)
+        start = time.time()
+        if self._manager is None:
+            if self._multiplexer is not None:
+                manager = self._multiplexer.open(job, self._socket)
+            elif self._use_selector:
+                manager = SapphireSelector(job, self._socket)
+            else:
+                manager = SapphireLoadManager(job, self._socket, self._max_workers)
+            manager.start()
+            self._manager = manager
+        else:
+            # keep the listener and connections from the previous job
+            self._manager.switch(job)
+        try:
+            was_timeout = not self._manager.wait(self.timeout, continue_cb=continue_cb)
+        finally:
+            self._manager.finish_job()
+        status = SERVED_TIMEOUT if was_timeout else job.status
+        if status == SERVED_ALL:
+            job.metrics.served_all = time.time() - start
+        self._metrics.add(job.metrics)
+        LOG.debug("status: %r, timeout: %r", job.status, was_timeout)
+        return ServeResult(status, tuple(job.served), metrics=job.metrics)
+
     def close(self):
         """
         close()
 
-        This function closes the listening server socket if it is open.
+        This function stops serving and closes the listening server socket if it is open.
         """
-        if self._socket is not None:
-            self._socket.close()
+        try:
+            if self._manager is not None:
+                self._manager.close()
+        finally:
+            self._manager = None
+            if self._socket is not None:
+                self._socket.close()
+            if self._metrics.jobs:
+                LOG.debug("request metrics:\n%s", self._metrics.dump())
+
+    @property
+    def metrics(self):
+        """
+        metrics -> ServerMetrics
+
+        returns the metrics of all the jobs served
+        """
+        return self._metrics
 
     @property
     def port(self):
@@ -93,7 +148,8 @@ class Sapphire(object):
         the server serve loop will exit. optional_files is list of files that do not need to be
         served in order to exit the serve loop.
 
-        returns a tuple (server status, files served)
+        returns a ServeResult tuple (server status, files served), the metrics of the job
+        are available via the 'metrics' attribute
         server status is an int:
         - SERVED_ALL: All files excluding files int the optional_files list were served
         - SERVED_NONE: No files were served
@@ -105,43 +161,69 @@ class Sapphire(object):
             path,
             auto_close=self._auto_close,
             forever=forever,
+            keep_alive=self._keep_alive,
             optional_files=optional_files,
             server_map=server_map)
-        if not job.pending:
-            job.finish()
-            LOG.debug("nothing to serve")
-            return (SERVED_NONE, tuple())
-        with SapphireLoadManager(job, self._socket, self._max_workers) as loadmgr:
-            was_timeout = not loadmgr.wait(self.timeout, continue_cb=continue_cb)
-        LOG.debug("status: %r, timeout: %r", job.status, was_timeout)
-        return (SERVED_TIMEOUT if was_timeout else job.status, tuple(job.served))
+        return self._serve_job(job, continue_cb)
 
-    def serve_testcase(self, testcase, continue_cb=None, forever=False, working_path=None, server_map=None):
+    def serve_testcase(self, testcase, continue_cb=None, forever=False, in_flight=None, server_map=None,
+                       working_path=None):
         """
         serve_testcase() -> tuple
         testcase is the Grizzly TestCase to serve. The callback continue_cb should
         be a function that returns True or False. If continue_cb is specified and returns False
-        the server serve loop will exit. working_path is where the testcase will be unpacked
-        temporary.
+        the server serve loop will exit. The test case is served directly from the TestFile
+        objects unless working_path is specified, in which case the test case is written to
+        a temporary directory in working_path and served from there.
+        in_flight is a list of TestCases that are still running, their files are served
+        as optional files unless testcase contains a file with the same name.
 
         returns a tuple (server status, files served)
         see serve_path() for more info
         """
         LOG.debug("serve_testcase() called")
-        wwwdir = tempfile.mkdtemp(prefix="sphr_test_", dir=working_path)
-        try:
-            testcase.dump(wwwdir)
-            serve_start = time.time()
-            result = self.serve_path(
-                wwwdir,
-                continue_cb=continue_cb,
+        optional = list(testcase.optional)
+        # newer test cases take precedence
+        others = list()
+        known = set(chain(testcase.required, optional))
+        for other in reversed(in_flight or ()):
+            for file_name in chain(other.required, other.optional):
+                if file_name not in known:
+                    known.add(file_name)
+                    optional.append(file_name)
+                    others.append(other.get_file(file_name))
+        serve_start = time.time()
+        if working_path is not None:
+            wwwdir = tempfile.mkdtemp(prefix="sphr_test_", dir=working_path)
+            try:
+                testcase.dump(wwwdir)
+                for test_file in others:
+                    test_file.dump(wwwdir)
+                result = self.serve_path(
+                    wwwdir,
+                    continue_cb=continue_cb,
+                    forever=forever,
+                    optional_files=tuple(optional),
+                    server_map=server_map)
+            finally:
+                # remove test case working directory
+                shutil.rmtree(wwwdir, ignore_errors=True)
+        else:
+            contents = dict()
+            for file_name in chain(testcase.required, testcase.optional):
+                contents[file_name] = testcase.get_file(file_name).data_file
+            for test_file in others:
+                contents[test_file.file_name] = test_file.data_file
+            job = SapphireJob(
+                None,
+                auto_close=self._auto_close,
+                contents=contents,
                 forever=forever,
-                optional_files=tuple(testcase.optional),
+                keep_alive=self._keep_alive,
+                optional_files=optional,
                 server_map=server_map)
-            testcase.duration = time.time() - serve_start
-        finally:
-            # remove test case working directory
-            shutil.rmtree(wwwdir, ignore_errors=True)
+            result = self._serve_job(job, continue_cb)
+        testcase.duration = time.time() - serve_start
         return result
 
     @property
@@ -155,10 +237,25 @@ class Sapphire(object):
         else:
             self._timeout = max(value, 1)
 
+    def wake(self):
+        """
+        wake() -> None
+
+        Wake the serve loop so continue_cb is checked immediately instead of at the next poll.
+        This can be called from any thread, for example when the target exits.
+        """
+        manager = self._manager
+        if manager is not None:
+            manager.wake()
+
     @classmethod
     def main(cls, args):
         try:
-            with cls(allow_remote=args.remote, port=args.port, timeout=args.timeout) as serv:
+            with cls(
+                    allow_remote=args.remote,
+                    port=args.port,
+                    timeout=args.timeout,
+                    use_selector=args.selector) as serv:
                 LOG.info(
                     "Serving %r @ http://%s:%d/",
                     os.path.abspath(args.path),
@@ -0,0 +1,212 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Sapphire request metrics
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from math import ceil
+import threading
+
+__all__ = ("Histogram", "JobMetrics", "ServerMetrics", "ServeResult")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+
+class Histogram(object):
+    """Histogram using fixed bucket boundaries. Values are counted in the first
+    bucket with an upper bound greater than or equal to the value. Values above
+    the last bound are counted in an overflow bucket.
+    """
+    COUNT_BOUNDS = tuple(2 ** x for x in range(11))  # 1 to 1024
+    TIME_BOUNDS = tuple(0.0001 * 2 ** x for x in range(21))  # 0.1ms to ~105s
+
+    __slots__ = ("bounds", "buckets", "count", "maximum", "total")
+
+    def __init__(self, bounds=TIME_BOUNDS):
+        assert bounds
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.maximum = 0
+        self.total = 0
+
+    def add(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.maximum = max(self.maximum, value)
+        self.total += value
+
+    def dump(self, fmt="%0.4f"):
+        """Create a text representation of the histogram.
+
+        Args:
+            fmt (str): Format used for values.
+
+        Returns:
+            list: Lines (str) describing the non-empty buckets.
+        """
+        lines = list()
+        largest = max(self.buckets)
+        for index, count in enumerate(self.buckets):
+            if not count:
+                continue
+            if index < len(self.bounds):
+                label = "<= %s" % (fmt % (self.bounds[index],),)
+            else:
+                label = " > %s" % (fmt % (self.bounds[-1],),)
+            lines.append("%12s: %8d %s" % (label, count, "#" * max(1, (40 * count) // largest)))
+        return lines
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def merge(self, other):
+        assert other.bounds == self.bounds
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+        self.count += other.count
+        self.maximum = max(self.maximum, other.maximum)
+        self.total += other.total
+
+    def percentile(self, pct):
+        """Estimate a percentile. The result is the upper bound of the bucket
+        containing the percentile (limited to the largest value added).
+
+        Args:
+            pct (float): Percentile (0 - 100).
+
+        Returns:
+            float: Estimated value.
+        """
+        assert 0 <= pct <= 100
+        if not self.count:
+            return 0
+        target = max(ceil(self.count * pct / 100.0), 1)
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and index < len(self.bounds):
+                return min(self.bounds[index], self.maximum)
+        return self.maximum
+
+    def summary(self, fmt="%0.4f"):
+        return "count: %d, mean: %s, p50: %s, p99: %s, max: %s" % (
+            self.count,
+            fmt % (self.mean,),
+            fmt % (self.percentile(50),),
+            fmt % (self.percentile(99),),
+            fmt % (self.maximum,))
+
+
+class JobMetrics(object):
+    """Metrics collected while serving a SapphireJob. This is updated by the
+    threads serving the job.
+    """
+    __slots__ = ("_lock", "accept_wait", "bytes_sent", "first_byte", "occupancy", "requests", "served_all")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # time spent waiting for a worker before a connection could be accepted
+        self.accept_wait = Histogram()
+        self.bytes_sent = 0
+        # time from accepting a connection to sending the first byte of a response
+        self.first_byte = Histogram()
+        # workers in use (or open connections) when a connection is accepted
+        self.occupancy = Histogram(bounds=Histogram.COUNT_BOUNDS)
+        self.requests = defaultdict(int)  # number of responses by status code
+        self.served_all = None  # time from the start of the job to SERVED_ALL
+
+    def record_accept(self, occupancy, wait=0):
+        with self._lock:
+            self.accept_wait.add(wait)
+            self.occupancy.add(occupancy)
+
+    def record_first_byte(self, elapsed):
+        with self._lock:
+            self.first_byte.add(elapsed)
+
+    def record_response(self, code, sent):
+        with self._lock:
+            self.bytes_sent += sent
+            self.requests[code] += 1
+
+
+class ServerMetrics(object):
+    """Metrics of all the jobs served by a Sapphire instance"""
+    __slots__ = ("accept_wait", "bytes_sent", "first_byte", "jobs", "occupancy", "requests", "served_all")
+
+    def __init__(self):
+        self.accept_wait = Histogram()
+        self.bytes_sent = 0
+        self.first_byte = Histogram()
+        self.jobs = 0
+        self.occupancy = Histogram(bounds=Histogram.COUNT_BOUNDS)
+        self.requests = defaultdict(int)
+        self.served_all = Histogram()
+
+    def add(self, job_metrics):
+        """Include the metrics of a job.
+
+        Args:
+            job_metrics (JobMetrics): Metrics of a complete job.
+
+        Returns:
+            None
+        """
+        # pylint: disable=protected-access
+        with job_metrics._lock:
+            self.accept_wait.merge(job_metrics.accept_wait)
+            self.bytes_sent += job_metrics.bytes_sent
+            self.first_byte.merge(job_metrics.first_byte)
+            self.occupancy.merge(job_metrics.occupancy)
+            for code, count in job_metrics.requests.items():
+                self.requests[code] += count
+        if job_metrics.served_all is not None:
+            self.served_all.add(job_metrics.served_all)
+        self.jobs += 1
+
+    def dump(self):
+        """Create a text report of the collected metrics.
+
+        Args:
+            None
+
+        Returns:
+            str: Report.
+        """
+        lines = [
+            "Jobs: %d, requests: %d, bytes sent: %s" % (
+                self.jobs, sum(self.requests.values()), format(self.bytes_sent, ",")),
+            "Responses: %s" % (
+                ", ".join("%d: %d" % (code, count) for code, count in sorted(self.requests.items())),)]
+        for name, histogram, fmt in (
+                ("Accept to first byte (s)", self.first_byte, "%0.4f"),
+                ("Time to SERVED_ALL (s)", self.served_all, "%0.4f"),
+                ("Accept wait (s)", self.accept_wait, "%0.4f"),
+                ("Occupancy", self.occupancy, "%d")):
+            lines.append("%s - %s" % (name, histogram.summary(fmt=fmt)))
+            lines.extend(histogram.dump(fmt=fmt))
+        return "\n".join(lines)
+
+
+class ServeResult(tuple):
+    """Result of serving a job. This is a (status, files served) tuple, the
+    metrics of the job are available as 'metrics'.
+    """
+
+    def __new__(cls, status, served, metrics=None):
+        result = super().__new__(cls, (status, served))
+        result.metrics = metrics
+        return result
+
+    @property
+    def served(self):
+        return self[1]
+
+    @property
+    def status(self):
+        return self[0]
@@ -12,7 +12,8 @@ import os
 from queue import Queue
 import threading
 
-from .server_map import Resource
+from .metrics import JobMetrics
+from .server_map import Resource, ServerMapIndex
 from .status_codes import SERVED_ALL, SERVED_NONE, SERVED_REQUEST
 
 __author__ = "Tyson Smith"
@@ -26,41 +27,68 @@ Tracker = namedtuple("Tracker", "files lock")
 
 class SapphireJob(object):
     __slots__ = (
-        "_complete", "_pending", "_served", "auto_close", "accepting", "base_path",
-        "exceptions", "forever", "initial_queue_size", "server_map", "worker_complete")
+        "_complete", "_contents_lock", "_map_index", "_optional", "_pending", "_required", "_sending",
+        "_sent", "_served", "_wakeup", "auto_close", "base_path", "contents", "exceptions", "forever",
+        "initial_queue_size", "keep_alive", "metrics", "server_map")
 
-    def __init__(self, base_path, auto_close=-1, forever=False, optional_files=None, server_map=None):
+    def __init__(self, base_path, auto_close=-1, contents=None, forever=False, keep_alive=0,
+                 optional_files=None, server_map=None):
+        assert (base_path is None) != (contents is None), "either base_path or contents is required"
         self._complete = threading.Event()
+        self._contents_lock = threading.Lock()  # file objects in contents are shared by requests
+        # built once per job, changes to server_map after this point are ignored
+        self._map_index = ServerMapIndex(server_map) if server_map is not None else None
+        self._optional = frozenset()  # optional files found when the job was created
         self._pending = Tracker(files=set(), lock=threading.Lock())
+        self._required = frozenset()  # files that were pending when the job was created
+        self._sending = 0  # number of responses being sent
         self._served = Tracker(files=defaultdict(int), lock=threading.Lock())
-        self.accepting = threading.Event()
-        self.accepting.set()
+        self._sent = threading.Condition(self._served.lock)  # notified when a response is sent
+        self._wakeup = threading.Event()  # set by finish() and wake()
         self.auto_close = auto_close
-        self.base_path = os.path.abspath(base_path)  # wwwroot
+        self.base_path = os.path.abspath(base_path) if base_path is not None else None  # wwwroot
+        # in memory wwwroot, mapping of file names to data (bytes or a seekable file object)
+        self.contents = contents
         self.exceptions = Queue()
         self.forever = forever
         self.initial_queue_size = 0
+        self.keep_alive = keep_alive  # persistent connection idle timeout (0 to disable)
+        self.metrics = JobMetrics()
         self.server_map = server_map
-        self.worker_complete = threading.Event()
         self._build_queue(optional_files)
 
     def _build_queue(self, optional_files):
         # build file list to track files that must be served
         # this is intended to only be called once by __init__()
-        for d_name, _, filenames in os.walk(self.base_path, followlinks=False):
-            for f_name in filenames:
-                # do not add optional files to queue of required files
+        optional = set()
+        if self.contents is not None:
+            # serve from memory
+            for f_name in self.contents:
                 if optional_files and f_name in optional_files:
                     LOG.debug("optional: %r", f_name)
+                    optional.add(f_name)
                     continue
-                file_path = os.path.abspath(os.path.join(d_name, f_name))
-                if "?" in file_path:
-                    LOG.warning("Cannot add files with '?' in path. Skipping %r", file_path)
+                if "?" in f_name:
+                    LOG.warning("Cannot add files with '?' in path. Skipping %r", f_name)
                     continue
-                self._pending.files.add(file_path)
+                self._pending.files.add(f_name)
                 LOG.debug("required: %r", f_name)
+        else:
+            for d_name, _, filenames in os.walk(self.base_path, followlinks=False):
+                for f_name in filenames:
+                    # do not add optional files to queue of required files
+                    file_path = os.path.abspath(os.path.join(d_name, f_name))
+                    if optional_files and f_name in optional_files:
+                        LOG.debug("optional: %r", f_name)
+                        optional.add(file_path)
+                        continue
+                    if "?" in file_path:
+                        LOG.warning("Cannot add files with '?' in path. Skipping %r", file_path)
+                        continue
+                    self._pending.files.add(file_path)
+                    LOG.debug("required: %r", f_name)
         # if nothing was found check if the path exists
-        if not self._pending.files and not os.path.isdir(self.base_path):
+        if not self._pending.files and self.base_path is not None and not os.path.isdir(self.base_path):
             raise OSError("%r does not exist" % (self.base_path),)
         if self.server_map:
             for redirect, resource in self.server_map.redirect.items():
@@ -71,57 +99,94 @@ class SapphireJob(object):
                     "required" if resource.required else "optional",
                     redirect,
                     resource.target)
+        self._optional = frozenset(optional)
+        self._required = frozenset(self._pending.files)
         self.initial_queue_size = len(self._pending.files)
         LOG.debug("%d files required to serve", self.initial_queue_size)
 
     def check_request(self, request):
         if "?" in request:
             request = request.split("?", 1)[0]
-        to_serve = os.path.normpath(os.path.join(self.base_path, request))
-        if "\x00" not in to_serve and os.path.isfile(to_serve):
-            res = Resource(Resource.URL_FILE, to_serve)
+        if self.contents is not None:
+            # serve from memory
+            to_serve = os.path.normpath(request)
+            res_type = Resource.URL_DATA if to_serve in self.contents else None
+        else:
+            to_serve = os.path.normpath(os.path.join(self.base_path, request))
+            res_type = Resource.URL_FILE if "\x00" not in to_serve and os.path.isfile(to_serve) else None
+        if res_type is not None:
+            res = Resource(res_type, to_serve)
             with self._pending.lock:
                 res.required = to_serve in self._pending.files
             return res
-        if self.server_map is not None:
-            if request in self.server_map.redirect:
-                return self.server_map.redirect[request]
-            if request in self.server_map.dynamic:
-                return self.server_map.dynamic[request]
-            # collect possible include matches
-            includes = tuple(x for x in self.server_map.include if request.startswith(x))
-            if includes:
-                LOG.debug("potential include matches %r", includes)
-                # attempt to find match
-                url = request
-                while True:
-                    if url in includes:
-                        LOG.debug("found include match %r", url)
-                        location = request.split(url, 1)[-1].lstrip("/") if url else request
-                        # check location points to something
-                        if location:
-                            target = os.path.join(
-                                self.server_map.include[url].target,
-                                location)
-                            # if the mapping url is empty check the file exists
-                            if url or os.path.isfile(target):
-                                return Resource(
-                                    Resource.URL_INCLUDE,
-                                    os.path.normpath(target),
-                                    mime=self.server_map.include[url].mime,
-                                    required=self.server_map.include[url].required)
-                    if "/" in url:
-                        url = url.rsplit("/", 1)[0]
-                    elif url:
-                        # try empty mount point
-                        url = ""
-                    else:
-                        # include does not exist
-                        break
+        if self._map_index is not None:
+            return self._map_index.find(request)
         return None
 
+    def content_size(self, name):
+        """Size of an entry in contents.
+
+        Args:
+            name (str): Name of the entry.
+
+        Returns:
+            int: Size in bytes.
+        """
+        data = self.contents[name]
+        if isinstance(data, bytes):
+            return len(data)
+        with self._contents_lock:
+            data.seek(0, os.SEEK_END)
+            return data.tell()
+
+    def read_content(self, name, offset=0, size=-1):
+        """Read data from an entry in contents.
+
+        Args:
+            name (str): Name of the entry.
+            offset (int): Position to start reading from.
+            size (int): Maximum number of bytes to read, -1 reads all remaining data.
+
+        Returns:
+            bytes: Data that was read.
+        """
+        data = self.contents[name]
+        if isinstance(data, bytes):
+            return data[offset:] if size < 0 else data[offset:offset + size]
+        with self._contents_lock:
+            data.seek(offset)
+            return data.read(size)
+
+    def begin_send(self):
+        # a worker is sending a response, end_send() must be called once it is done
+        with self._sent:
+            self._sending += 1
+
+    def end_send(self, target=None, complete=True):
+        """Record the end of a response started with begin_send(). A file is
+        only recorded as served once the response is completely sent.
+
+        Args:
+            target (str): File that was sent, if any.
+            complete (bool): The response was completely sent.
+
+        Returns:
+            None
+        """
+        with self._sent:
+            self._sending -= 1
+            if target is not None:
+                if complete:
+                    self._served.files[target] += 1
+                elif target in self._required and target not in self._served.files:
+                    # the file must be requested again
+                    with self._pending.lock:
+                        self._pending.files.add(target)
+            self._sent.notify_all()
+
     def finish(self):
         self._complete.set()
+        self._wakeup.set()
 
     def increment_served(self, target):
         # update list of served files
@@ -133,17 +198,24 @@ class SapphireJob(object):
             return self._complete.wait(wait)
         return self._complete.is_set()
 
+    def is_finishing(self):
+        # all required files have been requested, the job is complete once the last
+        # response is sent and requests received from now on belong to the next job
+        return self._complete.is_set() or (not self.forever and not self.pending)
+
     def is_forbidden(self, target_file):
         target_file = os.path.abspath(target_file)
         # check if target_file lives somewhere in wwwroot
-        if not target_file.startswith(self.base_path):
-            if self.server_map:
-                for resources in self.server_map.include.values():
-                    if target_file.startswith(resources.target):
-                        return False  # this is a valid include path
+        if self.base_path is None or not target_file.startswith(self.base_path):
+            if self._map_index is not None and self._map_index.is_included(target_file):
+                return False  # this is a valid include path
             return True  # this is NOT a valid include path
         return False  # this is a valid path
 
+    def is_optional(self, target_file):
+        # target_file was found as an optional file when the job was created
+        return target_file in self._optional
+
     @property
     def pending(self):
         # number of pending files
@@ -151,11 +223,13 @@ class SapphireJob(object):
             return len(self._pending.files)
 
     def remove_pending(self, file_name):
-        # return True when all file have been removed
+        # return True when this call removed the last pending file
+        # only one caller will receive True so only one request will finish the job
         with self._pending.lock:
-            if self._pending.files:
-                self._pending.files.discard(file_name)
-            return not self._pending.files
+            if file_name in self._pending.files:
+                self._pending.files.remove(file_name)
+                return not self._pending.files
+            return False
 
     @property
     def served(self):
@@ -166,7 +240,7 @@ class SapphireJob(object):
             # make a copy of what is available (maybe a copy not necessary?)
             served = tuple(self._served.files.keys())
         for fname in served:
-            if fname.startswith(self.base_path):
+            if self.base_path is not None and fname.startswith(self.base_path):
                 # file is in www root
                 yield os.path.relpath(fname, self.base_path)
             else:
@@ -182,3 +256,20 @@ class SapphireJob(object):
         if queue_size < self.initial_queue_size:
             return SERVED_REQUEST
         return SERVED_NONE
+
+    def wait_sends(self, timeout=None):
+        # wait for responses that are being sent, returns False if the timeout expired
+        with self._sent:
+            return self._sent.wait_for(lambda: self._sending < 1, timeout=timeout)
+
+    def wait(self, timeout=None):
+        # wait until the job is complete or wake() is called
+        # return True if the job is complete
+        if not self._complete.is_set():
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+        return self._complete.is_set()
+
+    def wake(self):
+        # wake a thread blocked in wait()
+        self._wakeup.set()
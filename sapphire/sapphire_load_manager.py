@@ -2,7 +2,11 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
 from logging import getLogger
+from queue import Queue
+import socket
 import sys
 import threading
 import time
@@ -15,18 +19,101 @@ __credits__ = ["Tyson Smith"]
 
 LOG = getLogger("sphr_loadmgr")
 
+# busy: number of workers handling a connection
+# handled: number of connections handled
+# peak: maximum number of workers handling a connection at the same time
+# saturated: time in seconds the listener waited for a worker to become available
+# size: number of workers in the pool
+PoolStats = namedtuple("PoolStats", "busy handled peak saturated size")
 
-class SapphireLoadManager(object):
+
+def wait_job(job, timeout, continue_cb=None, poll=0.5):
+    """Wait for a job that is served by worker threads to complete.
+
+    Args:
+        job (SapphireJob): Job to wait for.
+        timeout (float): Maximum number of seconds to wait, 0 waits indefinitely.
+        continue_cb (callable): Stop waiting when this returns False.
+        poll (float): Number of seconds between calls to continue_cb.
+
+    Returns:
+        bool: False if the timeout was reached otherwise True.
+    """
+    if timeout > 0:
+        deadline = time.time() + timeout
+    else:
+        deadline = None
+    if continue_cb is not None and not callable(continue_cb):
+        raise TypeError("continue_cb must be callable")
+    # it is important to keep this loop fast because it can limit
+    # the total iteration rate of Grizzly, the job wakes this loop when it is
+    # complete or when wake() is called, 'poll' is only used for continue_cb
+    while not job.wait(poll):
+        # check for a timeout
+        if deadline and deadline <= time.time():
+            return False
+        # check if callback returns False
+        if continue_cb is not None and not continue_cb():
+            LOG.debug("continue_cb() returned False")
+            break
+    return True
+
+
+class _IdleEvent(threading.Event):
+    """Event that notifies the pool when a worker begins waiting on an idle
+    persistent connection so the connection can be reclaimed if needed.
+    """
+
+    def __init__(self, pool_ready):
+        super().__init__()
+        self._pool_ready = pool_ready
+
+    def set(self):
+        super().set()
+        with self._pool_ready:
+            self._pool_ready.notify_all()
+
+
+class _PoolWorker(object):
+    __slots__ = ("conn", "idle", "thread")
+
+    def __init__(self, idle):
+        self.conn = None  # connection currently handled by the worker
+        self.idle = idle
+        self.thread = None
+
+    def reclaim(self):
+        # unblock the worker if it is waiting on a persistent connection
+        conn = self.conn
+        if conn is not None:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except (OSError, socket.error):
+                pass
+
+
+class WorkerPool(metaclass=ABCMeta):
+    """Fixed pool of worker threads that handle connections accepted by a
+    listener thread. The listener is implemented by subclasses.
+    """
     SHUTDOWN_DELAY = 0.5  # allow extra time before closing socket if needed
 
-    __slots__ = ("_job", "_listener", "_socket", "_workers")
+    __slots__ = (
+        "_busy", "_closing", "_connections", "_handled", "_job_ready", "_listener", "_peak", "_pool",
+        "_pool_ready", "_saturated")
 
-    def __init__(self, job, sock, max_workers=1):
+    def __init__(self, max_workers=1):
         assert max_workers > 0
-        self._job = job
+        self._busy = 0
+        self._closing = False
+        self._connections = Queue()  # accepted connections waiting for a worker
+        self._handled = 0
+        self._job_ready = threading.Condition()  # notified when a job is switched or closing
         self._listener = None
-        self._socket = sock
-        self._workers = max_workers
+        self._peak = 0
+        self._pool_ready = threading.Condition()  # notified when a worker is available or idle
+        self._pool = tuple(_PoolWorker(_IdleEvent(self._pool_ready)) for _ in range(max_workers))
+        self._saturated = 0.0
 
     def __enter__(self):
         self.start()
@@ -35,11 +122,168 @@ class SapphireLoadManager(object):
     def __exit__(self, *exc):
         self.close()
 
+    def _close_pool(self, shutdown_delay):
+        LOG.debug("closing worker pool")
+        # idle connections do not need to be waited on
+        for worker in self._pool:
+            if worker.idle.is_set():
+                worker.reclaim()
+        # avoid cutting off connections, wait for workers to finish
+        with self._pool_ready:
+            if not self._pool_ready.wait_for(lambda: self._busy < 1, timeout=shutdown_delay):
+                LOG.debug("closing %d remaining connection(s)", self._busy)
+                for worker in self._pool:
+                    worker.reclaim()
+        for worker in self._pool:
+            if worker.thread is not None:
+                self._connections.put(None)
+        for worker in self._pool:
+            if worker.thread is not None:
+                worker.thread.join(timeout=60)
+                if worker.thread.is_alive():  # pragma: no cover
+                    # this is here to catch unexpected hangs
+                    LOG.error("Worker thread failed to join!")
+                worker.thread = None
+
+    def _hand_off(self, conn, job, wait, next_job):
+        # pass an accepted connection to an available worker
+        accepted = time.time()
+        with self._pool_ready:
+            self._busy += 1
+            self._peak = max(self._peak, self._busy)
+            busy = self._busy
+        job.metrics.record_accept(busy, wait=wait)
+        self._connections.put((conn, job, accepted, next_job))
+
+    @staticmethod
+    def _spawn(target, args=()):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        # launch thread and handle thread errors
+        for retry in reversed(range(10)):
+            try:
+                thread.start()
+            except threading.ThreadError:
+                # thread errors can be due to low system resources while fuzzing
+                LOG.warning("ThreadError, threads: %d", threading.active_count())
+                if retry < 1:
+                    raise
+                time.sleep(1)
+                continue
+            break
+        return thread
+
+    def _start_pool(self):
+        # pre-spawn the worker pool so threads are not created while serving
+        for worker in self._pool:
+            if worker.thread is None:
+                worker.thread = self._spawn(self._worker, args=(worker,))
+
+    def _wait_for_worker(self):
+        # wait for an available worker, returns the time spent waiting
+        # or None if closing
+        wait = 0
+        with self._pool_ready:
+            if self._busy >= len(self._pool):
+                start = time.time()
+                while self._busy >= len(self._pool) and not self._closing:
+                    # reclaim a worker that is waiting on an idle connection
+                    for worker in self._pool:
+                        if worker.idle.is_set():
+                            LOG.debug("pool size: %d, closing idle connection...", self._busy)
+                            worker.reclaim()
+                            break
+                    self._pool_ready.wait()
+                wait = time.time() - start
+                self._saturated += wait
+            if self._closing:
+                return None
+        return wait
+
+    def _worker(self, worker):
+        # handle connections from the queue until None is received
+        while True:
+            item = self._connections.get()
+            if item is None:
+                break
+            worker.conn, job, accepted, next_job = item
+            try:
+                SapphireWorker.handle_request(
+                    worker.conn, job, accepted=accepted, idle=worker.idle, next_job=next_job)
+            finally:
+                worker.conn = None
+                worker.idle.clear()
+                with self._pool_ready:
+                    self._busy -= 1
+                    self._handled += 1
+                    self._pool_ready.notify_all()
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def start(self):
+        pass
+
+    @property
+    def stats(self):
+        """Worker pool occupancy.
+
+        Args:
+            None
+
+        Returns:
+            PoolStats: Current state of the worker pool.
+        """
+        with self._pool_ready:
+            return PoolStats(self._busy, self._handled, self._peak, self._saturated, len(self._pool))
+
+
+class SapphireLoadManager(WorkerPool):
+    """Serve SapphireJobs using a listener thread that hands accepted connections
+    to a fixed pool of worker threads. The listener and workers remain active
+    between jobs. Use switch() to start serving the next job once the current
+    job is complete.
+    """
+    __slots__ = ("_job", "_socket")
+
+    def __init__(self, job, sock, max_workers=1):
+        super().__init__(max_workers=max_workers)
+        self._job = job
+        self._socket = sock
+
+    def _next_job(self, current):
+        # wait for a job that follows current and is not complete, returns None when closing
+        with self._job_ready:
+            self._job_ready.wait_for(
+                lambda: self._closing or (self._job is not current and not self._job.is_complete()))
+            return None if self._closing else self._job
+
     def close(self):
+        with self._job_ready:
+            self._closing = True
+            self._job_ready.notify_all()
+        with self._pool_ready:
+            self._pool_ready.notify_all()
         self._job.finish()
         if self._listener is not None:
             self._listener.join()
             self._listener = None
+        self._close_pool(self.SHUTDOWN_DELAY)
+        self.finish_job()
+
+    def finish_job(self):
+        """Mark the current job as complete and re-raise exceptions from the
+        listener and workers. The listener and workers remain active.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._job.finish()
         if not self._job.exceptions.empty():
             exc_type, exc_obj, exc_tb = self._job.exceptions.get()
             LOG.error(
@@ -50,94 +294,70 @@ class SapphireLoadManager(object):
 
     def start(self):
         assert self._job.pending
+        self._start_pool()
         # create the listener thread to handle incoming requests
-        listener = threading.Thread(
-            target=self.listener,
-            args=(self._socket, self._job, self._workers),
-            kwargs={"shutdown_delay": self.SHUTDOWN_DELAY})
-        # launch listener thread and handle thread errors
-        for retry in reversed(range(10)):
-            try:
-                listener.start()
-            except threading.ThreadError:
-                # thread errors can be due to low system resources while fuzzing
-                LOG.warning("ThreadError (listener), threads: %d", threading.active_count())
-                if retry < 1:
-                    raise
-                time.sleep(1)
-                continue
-            self._listener = listener
-            break
+        self._listener = self._spawn(self.listener, args=(self._socket,))
+
+    def switch(self, job):
+        """Start serving the next job. Requests that have not been processed
+        when the current job completes are handled by the next job.
+
+        Args:
+            job (SapphireJob): Job to serve.
+
+        Returns:
+            None
+        """
+        assert job.pending
+        assert self._job.is_complete()
+        with self._job_ready:
+            self._job = job
+            self._job_ready.notify_all()
+        if self._listener is None or not self._listener.is_alive():
+            # the listener exits if an unexpected exception occurs
+            self._listener = None
+            self.start()
 
     def wait(self, timeout, continue_cb=None, poll=0.5):
         assert self._listener is not None
-        if timeout > 0:
-            deadline = time.time() + timeout
-        else:
-            deadline = None
-        if continue_cb is not None and not callable(continue_cb):
-            raise TypeError("continue_cb must be callable")
-        # it is important to keep this loop fast because it can limit
-        # the total iteration rate of Grizzly
-        while not self._job.is_complete(wait=poll):
-            # check for a timeout
-            if deadline and deadline <= time.time():
-                return False
-            # check if callback returns False
-            if continue_cb is not None and not continue_cb():
-                LOG.debug("continue_cb() returned False")
-                break
-        return True
+        return wait_job(self._job, timeout, continue_cb=continue_cb, poll=poll)
 
-    @staticmethod
-    def listener(serv_sock, serv_job, max_workers, shutdown_delay=0):
-        assert max_workers > 0
-        assert shutdown_delay >= 0
-        worker_pool = list()
-        pool_size = 0
+    def wake(self):
+        """Wake wait() to check continue_cb immediately. This can be called from
+        any thread, for example when the state checked by continue_cb changes.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._job.wake()
+
+    def listener(self, serv_sock):
+        serv_job = self._job
         LOG.debug("starting listener")
         try:
-            while not serv_job.is_complete():
-                if not serv_job.accepting.wait(0.05):
+            while True:
+                with self._job_ready:
+                    # wait for an active job
+                    self._job_ready.wait_for(lambda: self._closing or not self._job.is_complete())
+                    if self._closing:
+                        break
+                    serv_job = self._job
+                # connections are accepted as soon as a worker is available,
+                # the worker that serves the last pending file finishes the job
+                wait = self._wait_for_worker()
+                if wait is None:
+                    break
+                if serv_job.is_complete():
                     continue
-                worker = SapphireWorker.launch(serv_sock, serv_job)
-                if worker is not None:
-                    worker_pool.append(worker)
-                    pool_size += 1
-                # manage worker pool
-                if pool_size >= max_workers:
-                    LOG.debug("pool size: %d, waiting for worker to finish...", pool_size)
-                    serv_job.worker_complete.wait()
-                    serv_job.worker_complete.clear()
-                    # remove complete workers
-                    LOG.debug("trimming worker pool")
-                    # sometimes the thread that triggered the event doesn't quite cleanup in time
-                    # so add a retry (10x with 0.5 second sleep on failure)
-                    for _ in range(10):
-                        worker_pool = list(w for w in worker_pool if not w.done)
-                        pool_size = len(worker_pool)
-                        if pool_size < max_workers:
-                            break
-                        time.sleep(0.5)  # pragma: no cover
-                    else:  # pragma: no cover
-                        # this should never happen
-                        raise RuntimeError("Failed to trim worker pool!")
-                    LOG.debug("trimmed worker pool (size: %d)", pool_size)
+                conn = SapphireWorker.accept(serv_sock, serv_job)
+                if conn is None:
+                    continue
+                self._hand_off(conn, serv_job, wait, self._next_job)
         except Exception:  # pylint: disable=broad-except
             if serv_job.exceptions.empty():
                 serv_job.exceptions.put(sys.exc_info())
             serv_job.finish()
-        finally:
-            LOG.debug("listener cleaning up workers")
-            deadline = time.time() + shutdown_delay
-            while time.time() < deadline:
-                worker_pool = list(w for w in worker_pool if not w.done)
-                if not worker_pool:
-                    break
-                # avoid cutting off connections
-                LOG.debug("waiting for %d worker(s)...", len(worker_pool))
-                time.sleep(0.1)
-            else:  # pragma: no cover
-                LOG.debug("closing remaining workers")
-                for worker in (w for w in worker_pool if not w.done):
-                    worker.close()
+        LOG.debug("listener exiting")
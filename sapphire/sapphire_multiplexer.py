@@ -0,0 +1,265 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Serve concurrent Sapphire jobs on many listening sockets using one listener
+thread and one worker pool
+"""
+from logging import getLogger
+import selectors
+import socket
+import sys
+import threading
+import traceback
+
+from .sapphire_load_manager import WorkerPool, wait_job
+from .sapphire_worker import SapphireWorker
+
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = getLogger("sphr_mux")
+
+
+class _Channel(object):
+    """Jobs served on one listening socket of a SapphireMultiplexer. This provides
+    the interface of SapphireLoadManager that is used by Sapphire.
+    """
+    # pylint: disable=protected-access
+    __slots__ = ("_closed", "_mux", "_registered", "job", "sock")
+
+    def __init__(self, mux, job, sock):
+        self._closed = False
+        self._mux = mux
+        self._registered = False  # sock is registered with the selector of the listener
+        self.job = job
+        self.sock = sock
+
+    def _next_job(self, current):
+        # wait for a job that follows current and is not complete, returns None when closing
+        mux = self._mux
+        with mux._job_ready:
+            mux._job_ready.wait_for(
+                lambda: self.closing or (self.job is not current and not self.job.is_complete()))
+            return None if self.closing else self.job
+
+    def close(self):
+        self.job.finish()
+        self._mux._remove(self)
+        self.finish_job()
+
+    @property
+    def closing(self):
+        return self._closed or self._mux._closing
+
+    def finish_job(self):
+        """Mark the current job as complete and re-raise exceptions from the
+        listener and workers.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.job.finish()
+        if not self.job.exceptions.empty():
+            exc_type, exc_obj, exc_tb = self.job.exceptions.get()
+            LOG.error(
+                "Unexpected exception:\n%s",
+                "".join(traceback.format_exception(exc_type, exc_obj, exc_tb)))
+            raise exc_obj
+
+    def start(self):
+        assert self.job.pending
+        self._mux._add(self)
+
+    def switch(self, job):
+        """Start serving the next job. Requests that have not been processed
+        when the current job completes are handled by the next job.
+
+        Args:
+            job (SapphireJob): Job to serve.
+
+        Returns:
+            None
+        """
+        assert job.pending
+        assert self.job.is_complete()
+        with self._mux._job_ready:
+            self.job = job
+            self._mux._job_ready.notify_all()
+        self._mux._activate(self)
+
+    def wait(self, timeout, continue_cb=None, poll=0.5):
+        return wait_job(self.job, timeout, continue_cb=continue_cb, poll=poll)
+
+    def wake(self):
+        self.job.wake()
+
+
+class SapphireMultiplexer(WorkerPool):
+    """Serve the jobs of multiple Sapphire instances concurrently. Each Sapphire
+    instance keeps its own listening socket (port), jobs, timeout and continue_cb
+    while a single listener thread accepts connections on all sockets and hands
+    them to a shared worker pool.
+
+    Usage:
+        with SapphireMultiplexer(max_workers=64) as mux:
+            with Sapphire(multiplexer=mux) as serv:
+                ...
+    """
+    # pylint: disable=protected-access
+    __slots__ = ("_channels", "_lock", "_selector", "_waker")
+
+    def __init__(self, max_workers=40):
+        super().__init__(max_workers=max_workers)
+        self._channels = set()  # open channels
+        self._lock = threading.Lock()  # protects the selector and the listener thread
+        self._selector = None
+        self._waker = None  # socket pair used to interrupt select()
+
+    def _activate(self, channel):
+        # accept connections on the socket of the channel
+        with self._lock:
+            if self._selector is None:
+                return
+            if not channel._registered:
+                self._selector.register(channel.sock, selectors.EVENT_READ, channel)
+                channel._registered = True
+            if not self._closing and (self._listener is None or not self._listener.is_alive()):
+                # the listener exits if an unexpected exception occurs
+                self._listener = self._spawn(self.listener)
+        self._wake_listener()
+
+    def _add(self, channel):
+        with self._job_ready:
+            assert not self._closing
+            self._channels.add(channel)
+        self._activate(channel)
+
+    def _deactivate(self, channel):
+        # stop accepting connections on the socket of the channel
+        with self._lock:
+            if channel._registered:
+                if self._selector is not None:
+                    self._selector.unregister(channel.sock)
+                channel._registered = False
+
+    def _remove(self, channel):
+        with self._job_ready:
+            channel._closed = True
+            self._channels.discard(channel)
+            self._job_ready.notify_all()
+        # the socket must be unregistered before it is closed
+        self._deactivate(channel)
+
+    def _wake_listener(self):
+        waker = self._waker
+        if waker is not None:
+            try:
+                waker[1].send(b"\x00")
+            except (BlockingIOError, OSError):  # pragma: no cover
+                # a wake up is already pending or the multiplexer was closed
+                pass
+
+    def close(self):
+        with self._job_ready:
+            self._closing = True
+            self._job_ready.notify_all()
+            channels = tuple(self._channels)
+        with self._pool_ready:
+            self._pool_ready.notify_all()
+        for channel in channels:
+            channel.job.finish()
+        self._wake_listener()
+        with self._lock:
+            listener = self._listener
+            self._listener = None
+        if listener is not None:
+            listener.join()
+        self._close_pool(self.SHUTDOWN_DELAY)
+        with self._lock:
+            if self._selector is not None:
+                self._selector.close()
+                self._selector = None
+            if self._waker is not None:
+                for sock in self._waker:
+                    sock.close()
+                self._waker = None
+
+    def open(self, job, sock):
+        """Create a channel that serves jobs on a listening socket. The channel
+        provides the interface of SapphireLoadManager.
+
+        Args:
+            job (SapphireJob): First job to serve.
+            sock (socket.socket): Listening socket.
+
+        Returns:
+            _Channel: Channel that is used to serve jobs on sock.
+        """
+        assert self._selector is not None, "start() must be called first"
+        return _Channel(self, job, sock)
+
+    def start(self):
+        with self._lock:
+            assert self._selector is None
+            self._selector = selectors.DefaultSelector()
+            self._waker = socket.socketpair()
+            for sock in self._waker:
+                sock.setblocking(False)
+            self._selector.register(self._waker[0], selectors.EVENT_READ)
+            self._start_pool()
+            self._listener = self._spawn(self.listener)
+
+    def listener(self):
+        LOG.debug("starting listener")
+        try:
+            while True:
+                # connections are accepted as soon as a worker is available
+                wait = self._wait_for_worker()
+                if wait is None:
+                    break
+                try:
+                    events = self._selector.select(timeout=1)
+                except (OSError, ValueError):
+                    # a socket was unregistered and closed by another thread during select()
+                    LOG.debug("select() failed, retrying")
+                    events = ()
+                for key, _ in events:
+                    if key.fileobj is self._waker[0]:
+                        try:
+                            self._waker[0].recv(64)
+                        except BlockingIOError:  # pragma: no cover
+                            pass
+                        continue
+                    channel = key.data
+                    with self._job_ready:
+                        serv_job = channel.job
+                        if channel.closing or serv_job.is_complete():
+                            # connections are accepted again once the next job is started
+                            self._deactivate(channel)
+                            continue
+                    with self._lock:
+                        # the socket is unregistered before it is closed
+                        if not channel._registered:
+                            continue
+                        conn = SapphireWorker.accept(channel.sock, serv_job)
+                    if conn is not None:
+                        self._hand_off(conn, serv_job, wait, channel._next_job)
+                        # wait for an available worker before accepting another connection
+                        break
+                with self._job_ready:
+                    if self._closing:
+                        break
+        except Exception:  # pylint: disable=broad-except
+            exc_info = sys.exc_info()
+            with self._job_ready:
+                channels = tuple(self._channels)
+            for channel in channels:
+                if channel.job.exceptions.empty():
+                    channel.job.exceptions.put(exc_info)
+                channel.job.finish()
+        LOG.debug("listener exiting")
@@ -0,0 +1,404 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Sapphire HTTP server event loop
+"""
+from logging import getLogger
+import mmap
+import os
+import selectors
+import socket
+import sys
+import time
+import traceback
+
+from .sapphire_worker import SapphireWorker
+
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = getLogger("sphr_selector")
+
+
+class _Client(object):
+    __slots__ = (
+        "accepted", "body", "buffered", "conn", "deadline", "in_fp", "in_map", "offset", "out_data",
+        "remaining", "response", "sent", "stream", "tx_start")
+
+    def __init__(self, conn, accepted=None):
+        self.accepted = accepted  # time the connection was accepted, reset once a response is sent
+        self.body = None  # response body waiting to be sent once out_data is sent
+        self.buffered = b""  # received data that has not been processed
+        self.conn = conn
+        self.deadline = None  # time at which an idle persistent connection is closed
+        self.in_fp = None  # file containing the response body
+        self.in_map = None  # memory mapped in_fp (used when sendfile is not available)
+        self.offset = 0  # position of the next response body data in in_fp
+        self.out_data = None  # data waiting to be sent
+        self.remaining = 0  # response body data remaining in in_fp
+        self.response = None  # response in progress
+        self.sent = 0  # bytes of the response in progress that have been sent
+        self.stream = None  # response body data that is sent as it is generated
+        self.tx_start = None  # time the response body transfer started
+
+    def close_file(self):
+        # out_data may reference in_map and must be released first
+        self.body = None
+        self.out_data = None
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.in_map is not None:
+            self.in_map.close()
+            self.in_map = None
+        if self.in_fp is not None:
+            self.in_fp.close()
+            self.in_fp = None
+
+
+class SapphireSelector(object):
+    """Serve SapphireJobs using a single threaded event loop that multiplexes
+    all connections. This provides the same interface as SapphireLoadManager.
+    Connections remain open between jobs. Use switch() to start serving the next
+    job once the current job is complete.
+    """
+    SHUTDOWN_DELAY = 0.5  # allow responses in progress to complete when a job finishes or closing
+
+    __slots__ = ("_clients", "_job", "_selector", "_socket", "_waker")
+
+    def __init__(self, job, sock):
+        self._clients = dict()
+        self._job = job
+        self._selector = None
+        self._socket = sock
+        self._waker = None  # socket pair used by wake() to interrupt select()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _accept(self):
+        try:
+            conn, _ = self._socket.accept()
+        except (socket.error, socket.timeout):  # pragma: no cover
+            return
+        conn.setblocking(False)
+        # do not delay small writes such as response headers
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(conn, accepted=time.time())
+        self._clients[conn] = client
+        self._job.metrics.record_accept(len(self._clients))
+        self._selector.register(conn, selectors.EVENT_READ, client)
+
+    def _close_client(self, client):
+        self._clients.pop(client.conn, None)
+        try:
+            self._selector.unregister(client.conn)
+        except (KeyError, ValueError):  # pragma: no cover
+            pass
+        client.close_file()
+        client.conn.close()
+
+    def _complete(self, client):
+        # the response has been sent
+        response = client.response
+        client.response = None
+        if client.in_fp is not None:
+            elapsed = max(time.time() - client.tx_start, 0.000001)
+            LOG.debug(
+                "sent %s bytes in %0.3fs (%0.2f MB/s)",
+                format(response.length, ","), elapsed, response.length / elapsed / 0x100000)
+            client.close_file()
+        self._job.metrics.record_response(response.code, client.sent)
+        client.sent = 0
+        if response.target is not None:
+            self._job.increment_served(response.target)
+        if response.finish:
+            self._close_client(client)
+            self._job.finish()
+        elif not response.keep_alive:
+            self._close_client(client)
+        else:
+            # wait for the next request on the persistent connection
+            client.deadline = time.time() + self._job.keep_alive
+            self._selector.modify(client.conn, selectors.EVENT_READ, client)
+            # pipelined requests received after the job is complete are handled by the next job
+            if client.buffered and not self._job.is_finishing():
+                self._next_response(client, eof=False)
+
+    def _dispatch(self, client, handler, *args):
+        try:
+            handler(client, *args)
+        except (socket.timeout, socket.error):
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            LOG.debug("%s: %r (line %d)", exc_type.__name__, exc_obj, exc_tb.tb_lineno)
+            self._close_client(client)
+        except Exception:  # pylint: disable=broad-except
+            if self._job.exceptions.empty():
+                self._job.exceptions.put(sys.exc_info())
+            self._close_client(client)
+            self._job.finish()
+
+    def _flush(self, timeout):
+        # allow responses in progress to complete, returns False on timeout
+        deadline = time.time() + timeout
+        while any(client.response is not None for client in self._clients.values()):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._process(remaining)
+        return True
+
+    def _next_response(self, client, eof):
+        result = SapphireWorker.split_request(client.buffered)
+        if result is None:
+            if not eof:
+                # wait for the rest of the request
+                return
+            result = (client.buffered, None)
+        raw_request, remaining = result
+        client.buffered = remaining or b""
+        if not raw_request:
+            LOG.debug("raw_request was empty")
+            self._close_client(client)
+            return
+        client.deadline = None
+        client.response = SapphireWorker.build_response(
+            self._job, raw_request, persist=remaining is not None and not eof)
+        if client.accepted is not None:
+            # time from accepting the connection to the first response
+            self._job.metrics.record_first_byte(time.time() - client.accepted)
+            client.accepted = None
+        if client.response.stream is not None:
+            client.out_data = memoryview(client.response.header)
+            client.stream = client.response.stream
+        elif client.response.body is None:
+            client.out_data = memoryview(client.response.header)
+            if client.response.target is not None:
+                self._open_file(client)
+        elif client.response.length > SapphireWorker.DEFAULT_TX_SIZE:
+            # avoid copying large response bodies
+            client.body = client.response.body
+            client.out_data = memoryview(client.response.header)
+        else:
+            client.out_data = memoryview(client.response.header + client.response.body)
+        self._selector.modify(client.conn, selectors.EVENT_WRITE, client)
+        # attempt to send immediately, the socket is likely writable
+        self._send(client)
+
+    @staticmethod
+    def _open_file(client):
+        client.in_fp = open(client.response.target, "rb")
+        client.offset = client.response.offset
+        client.remaining = client.response.length
+        client.tx_start = time.time()
+        if not SapphireWorker.USE_SENDFILE:
+            # the offset of a memory map must be a multiple of ALLOCATIONGRANULARITY
+            skip = client.offset % mmap.ALLOCATIONGRANULARITY
+            try:
+                client.in_map = mmap.mmap(
+                    client.in_fp.fileno(),
+                    client.remaining + skip,
+                    access=mmap.ACCESS_READ,
+                    offset=client.offset - skip)
+            except ValueError:
+                raise IOError("%r was truncated while sending" % (client.response.target,))
+            # send directly from the memory mapped file
+            client.body = memoryview(client.in_map)[skip:]
+            client.remaining = 0
+
+    def _process(self, timeout):
+        # returns True if wake() was called
+        woken = False
+        for key, events in self._selector.select(timeout):
+            if key.fileobj is self._socket:
+                self._accept()
+                continue
+            if key.fileobj is self._waker[0]:
+                try:
+                    self._waker[0].recv(64)
+                except BlockingIOError:  # pragma: no cover
+                    pass
+                woken = True
+                continue
+            client = key.data
+            if events & selectors.EVENT_WRITE and client.response is not None:
+                self._dispatch(client, self._send)
+            elif events & selectors.EVENT_READ:
+                self._dispatch(client, self._recv)
+        # close idle persistent connections
+        now = time.time()
+        for client in tuple(self._clients.values()):
+            if client.deadline is not None and client.deadline <= now:
+                LOG.debug("closing idle connection")
+                self._close_client(client)
+        return woken
+
+    def _recv(self, client):
+        try:
+            data = client.conn.recv(SapphireWorker.DEFAULT_REQUEST_LIMIT)
+        except BlockingIOError:  # pragma: no cover
+            return
+        if data:
+            client.buffered += data
+            if self._job.is_finishing():
+                # requests received after all required files were requested are handled by the next job
+                if len(client.buffered) > SapphireWorker.DEFAULT_REQUEST_LIMIT:
+                    LOG.debug("closing connection, too much data received while job is finishing")
+                    self._close_client(client)
+                return
+        self._next_response(client, eof=not data)
+
+    def _send(self, client):
+        while True:
+            if client.out_data:
+                try:
+                    sent = client.conn.send(client.out_data)
+                except BlockingIOError:
+                    return
+                client.out_data = client.out_data[sent:]
+                client.sent += sent
+                continue
+            if client.body is not None:
+                client.out_data = memoryview(client.body)
+                client.body = None
+                continue
+            if client.stream is not None:
+                # this blocks the event loop while the data is generated
+                chunk = next(client.stream, None)
+                if chunk is None:
+                    client.stream = None
+                else:
+                    client.out_data = memoryview(chunk)
+                continue
+            if client.remaining < 1:
+                self._complete(client)
+                return
+            # file data is copied directly to the socket by the kernel
+            try:
+                sent = os.sendfile(
+                    client.conn.fileno(), client.in_fp.fileno(), client.offset, client.remaining)
+            except BlockingIOError:
+                return
+            if not sent:
+                raise IOError("%r was truncated while sending" % (client.response.target,))
+            client.offset += sent
+            client.remaining -= sent
+            client.sent += sent
+
+    def close(self):
+        self._job.finish()
+        if self._selector is not None:
+            self._selector.unregister(self._socket)
+            for client in tuple(self._clients.values()):
+                if client.response is None:
+                    self._close_client(client)
+            if not self._flush(self.SHUTDOWN_DELAY):
+                LOG.debug("closing %d remaining connection(s)", len(self._clients))
+            for client in tuple(self._clients.values()):
+                self._close_client(client)
+            self._selector.unregister(self._waker[0])
+            self._selector.close()
+            self._selector = None
+            for sock in self._waker:
+                sock.close()
+            self._waker = None
+        self.finish_job()
+
+    def finish_job(self):
+        """Mark the current job as complete and re-raise exceptions. Connections
+        remain open.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._job.finish()
+        # the event loop only runs while serving, complete responses that are in progress
+        # instead of stalling them until the next job
+        if self._selector is not None and not self._flush(self.SHUTDOWN_DELAY):
+            LOG.debug("responses in progress will be completed by the next job")
+        if not self._job.exceptions.empty():
+            exc_type, exc_obj, exc_tb = self._job.exceptions.get()
+            LOG.error(
+                "Unexpected exception:\n%s",
+                "".join(traceback.format_exception(exc_type, exc_obj, exc_tb)))
+            raise exc_obj
+
+    def start(self):
+        assert self._job.pending
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._waker = socket.socketpair()
+        for sock in self._waker:
+            sock.setblocking(False)
+        self._selector.register(self._waker[0], selectors.EVENT_READ)
+
+    def switch(self, job):
+        """Start serving the next job. Requests that have not been processed
+        when the current job completes are handled by the next job.
+
+        Args:
+            job (SapphireJob): Job to serve.
+
+        Returns:
+            None
+        """
+        assert job.pending
+        assert self._job.is_complete()
+        assert self._selector is not None
+        self._job = job
+        # handle requests that were received after the previous job was complete
+        for client in tuple(self._clients.values()):
+            if client.response is None and client.buffered:
+                self._dispatch(client, self._next_response, False)
+
+    def wait(self, timeout, continue_cb=None, poll=0.5):
+        assert self._selector is not None
+        if timeout > 0:
+            deadline = time.time() + timeout
+        else:
+            deadline = None
+        if continue_cb is not None and not callable(continue_cb):
+            raise TypeError("continue_cb must be callable")
+        next_poll = time.time() + poll
+        while not self._job.is_complete():
+            now = time.time()
+            # check for a timeout
+            if deadline and deadline <= now:
+                return False
+            if next_poll <= now:
+                # check if callback returns False
+                if continue_cb is not None and not continue_cb():
+                    LOG.debug("continue_cb() returned False")
+                    break
+                next_poll = now + poll
+            if self._process(min(next_poll, deadline) - now if deadline else next_poll - now):
+                # check continue_cb immediately
+                next_poll = 0
+        return True
+
+    def wake(self):
+        """Wake wait() to check continue_cb immediately. This can be called from
+        any thread, for example when the state checked by continue_cb changes.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        waker = self._waker
+        if waker is not None:
+            try:
+                waker[1].send(b"\x00")
+            except (BlockingIOError, OSError):  # pragma: no cover
+                # a wake up is already pending or the selector was closed
+                pass
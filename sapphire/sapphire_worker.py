@@ -6,11 +6,14 @@
 Sapphire HTTP server worker
 """
 
+from collections import namedtuple, OrderedDict
 import mimetypes
 from logging import getLogger
+import mmap
 import os
 import re
 import socket
+import stat
 import sys
 import threading
 import time
@@ -23,40 +26,138 @@ __credits__ = ["Tyson Smith"]
 
 LOG = getLogger("sphr_worker")
 
+# body: response data (bytes) or None when the content of 'target' is sent separately
+# code: HTTP status code
+# finish: the job is complete once the response has been sent
+# header: response header (bytes)
+# keep_alive: the connection can be reused once the response has been sent
+# length: size of the response body (None when streamed)
+# offset: position of the response body in 'target' (partial content)
+# stream: iterator of response body data that is sent once the header is sent or None
+# target: file that is served by the response or None
+Response = namedtuple("Response", "body code finish header keep_alive length offset stream target")
+
 
 class SapphireWorkerError(Exception):
     """Raised by SapphireWorker"""
 
 
+class _FileInfo(object):
+    __slots__ = ("c_type", "headers", "mtime", "size")
+
+    def __init__(self, c_type, mtime, size):
+        self.c_type = c_type
+        self.headers = dict()  # prebuilt 200 response headers keyed by keep_alive
+        self.mtime = mtime
+        self.size = size
+
+
+class FileInfoCache(object):
+    """LRU cache of file metadata (MIME type, size and response headers) shared
+    across jobs. Entries are invalidated when the modification time or size of
+    the file changes.
+    """
+    __slots__ = ("_entries", "_limit", "_lock")
+
+    def __init__(self, limit=0x1000):
+        assert limit > 0
+        self._entries = OrderedDict()
+        self._limit = limit
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def lookup(self, target):
+        """Look up the metadata of a file.
+
+        Args:
+            target (str): Path of the file.
+
+        Returns:
+            _FileInfo: Metadata of target or None if target is not a regular file.
+        """
+        try:
+            f_stat = os.stat(target)
+        except (OSError, ValueError):
+            return None
+        if not stat.S_ISREG(f_stat.st_mode):
+            return None
+        with self._lock:
+            info = self._entries.get(target)
+            if info is not None and info.mtime == f_stat.st_mtime_ns and info.size == f_stat.st_size:
+                self._entries.move_to_end(target)
+                return info
+        # default to "application/octet-stream"
+        info = _FileInfo(
+            mimetypes.guess_type(target)[0] or "application/octet-stream",
+            f_stat.st_mtime_ns,
+            f_stat.st_size)
+        with self._lock:
+            self._entries[target] = info
+            if len(self._entries) > self._limit:
+                self._entries.popitem(last=False)
+        return info
+
+
 class SapphireWorker(object):
     DEFAULT_REQUEST_LIMIT = 0x1000  # 4KB
     DEFAULT_TX_SIZE = 0x10000  # 64KB
-    REQ_PATTERN = re.compile(b"^GET\\s/(?P<request>\\S*)\\sHTTP/1")
-
-    __slots__ = ("_conn", "_thread")
+    SEND_TIMEOUT = 60  # maximum time to wait for other responses before finishing a job
+    USE_SENDFILE = hasattr(os, "sendfile")  # otherwise send from a memory mapped file
+    CONN_CLOSE_PATTERN = re.compile(b"^Connection:\\s*close\\s*$", re.IGNORECASE | re.MULTILINE)
+    RANGE_PATTERN = re.compile(
+        b"^Range:[ \\t]*bytes[ \\t]*=(?P<range>[^\\r\\n]*)", re.IGNORECASE | re.MULTILINE)
+    REQ_PATTERN = re.compile(b"^GET\\s/(?P<request>\\S*)\\sHTTP/1(?P<persist>\\.1)?")
 
-    def __init__(self, conn, thread):
-        self._conn = conn
-        self._thread = thread
+    FILE_CACHE = FileInfoCache()
 
     @staticmethod
-    def _200_header(c_length, c_type, encoding="ascii"):
+    def _200_header(c_length, c_type, encoding="ascii", keep_alive=False):
+        # c_length is None when chunked transfer encoding is used
         data = "HTTP/1.1 200 OK\r\n" \
+               "Cache-Control: max-age=0, no-cache\r\n" \
+               "%s\r\n" \
+               "Content-Type: %s\r\n" \
+               "Connection: %s\r\n\r\n" % (
+                   "Transfer-Encoding: chunked" if c_length is None else "Content-Length: %d" % (c_length,),
+                   c_type,
+                   "keep-alive" if keep_alive else "close")
+        return data.encode(encoding)
+
+    @staticmethod
+    def _206_header(c_length, c_type, first, last, total, encoding="ascii", keep_alive=False):
+        data = "HTTP/1.1 206 Partial Content\r\n" \
                "Cache-Control: max-age=0, no-cache\r\n" \
                "Content-Length: %d\r\n" \
+               "Content-Range: bytes %d-%d/%d\r\n" \
                "Content-Type: %s\r\n" \
-               "Connection: close\r\n\r\n" % (c_length, c_type)
+               "Connection: %s\r\n\r\n" % (
+                   c_length, first, last, total, c_type, "keep-alive" if keep_alive else "close")
         return data.encode(encoding)
 
     @staticmethod
-    def _307_redirect(redirct_to, encoding="ascii"):
+    def _307_redirect(redirct_to, encoding="ascii", keep_alive=False):
         data = "HTTP/1.1 307 Temporary Redirect\r\n" \
                "Location: %s\r\n" \
-               "Connection: close\r\n\r\n" % (redirct_to,)
+               "Content-Length: 0\r\n" \
+               "Connection: %s\r\n\r\n" % (redirct_to, "keep-alive" if keep_alive else "close")
+        return data.encode(encoding)
+
+    @staticmethod
+    def _416_header(total, encoding="ascii", keep_alive=False):
+        data = "HTTP/1.1 416 Range Not Satisfiable\r\n" \
+               "Content-Range: bytes */%d\r\n" \
+               "Content-Length: 0\r\n" \
+               "Connection: %s\r\n\r\n" % (total, "keep-alive" if keep_alive else "close")
         return data.encode(encoding)
 
     @staticmethod
-    def _4xx_page(code, hdr_msg, close=-1, encoding="ascii"):
+    def _4xx_page(code, hdr_msg, close=-1, encoding="ascii", keep_alive=False):
         if close < 0:
             content = "<h3>%d!</h3>" % (code,)
         else:
@@ -67,119 +168,479 @@ class SapphireWorker(object):
         data = "HTTP/1.1 %d %s\r\n" \
                "Content-Length: %d\r\n" \
                "Content-Type: text/html\r\n" \
-               "Connection: close\r\n\r\n%s" % (code, hdr_msg, len(content), content)
+               "Connection: %s\r\n\r\n%s" % (
+                   code, hdr_msg, len(content), "keep-alive" if keep_alive else "close", content)
         return data.encode(encoding)
 
-    def close(self):
-        if not self.done:
-            LOG.debug("closing socket while thread is running!")
-        self._conn.close()
-        self.join(timeout=60)
-        if self._thread is not None and self._thread.is_alive():
-            # this is here to catch unexpected hangs
-            raise SapphireWorkerError("Worker thread failed to join!")
-
-    @property
-    def done(self):
-        if self._thread is not None and not self._thread.is_alive():
-            self.join()
-            self._thread = None
-        return self._thread is None
+    @classmethod
+    def _byte_range(cls, raw_request, size):
+        """Parse the Range header of a request.
+
+        Args:
+            raw_request (bytes): Request header.
+            size (int): Size of the requested resource.
+
+        Returns:
+            tuple: First and last byte (inclusive) of the requested range or None
+                   if the whole resource should be sent. The first byte is greater
+                   than or equal to size if the range cannot be satisfied.
+        """
+        match = cls.RANGE_PATTERN.search(raw_request)
+        if match is None:
+            return None
+        spec = match.group("range").decode("ascii", "replace").strip()
+        if "," in spec:
+            # multipart/byteranges responses are not supported, RFC 7233 allows
+            # the header to be ignored and the whole resource to be sent
+            LOG.debug("ignoring multi-range request %r", spec)
+            return None
+        first, _, last = (x.strip() for x in spec.partition("-"))
+        if first.isdigit() and (last.isdigit() or not last):
+            first = int(first)
+            last = min(int(last), size - 1) if last else size - 1
+            if last < first and first < size:
+                # invalid range
+                return None
+            return (first, last)
+        if not first and last.isdigit():
+            # suffix range (the last N bytes)
+            return (max(size - int(last), 0) if int(last) else size, size - 1)
+        LOG.debug("ignoring invalid range %r", spec)
+        return None
 
     @classmethod
-    def handle_request(cls, conn, serv_job):
-        finish_job = False  # call finish() on return
+    def _chunked(cls, source, encode=True):
+        """Read data returned by a dynamic response callback.
+
+        Args:
+            source (iterable or file-like): Object returned by the callback.
+            encode (bool): Use chunked transfer encoding.
+
+        Yields:
+            bytes: Response body data.
+        """
+        if hasattr(source, "read"):
+            chunks = iter(lambda: source.read(cls.DEFAULT_TX_SIZE), b"")
+        else:
+            chunks = iter(source)
         try:
-            # receive all the incoming data
-            raw_request = conn.recv(cls.DEFAULT_REQUEST_LIMIT)
-            if not raw_request:
-                LOG.debug("raw_request was empty")
-                serv_job.accepting.set()
-                return
-
-            request = cls.REQ_PATTERN.match(raw_request)
-            if request is None:
-                serv_job.accepting.set()
-                conn.sendall(cls._4xx_page(400, "Bad Request", serv_job.auto_close))
-                LOG.debug("400 request length %d (%d to go)", len(raw_request), serv_job.pending)
-                return
-
-            request = unquote_plus(request.group("request").decode("ascii"))
-            LOG.debug("check_request(%r)", request)
-            resource = serv_job.check_request(request)
-            if resource is None:
-                LOG.debug("resource is None")  # 404
-            elif resource.type in (Resource.URL_FILE, Resource.URL_INCLUDE):
-                finish_job = serv_job.remove_pending(resource.target)
-            elif resource.type == Resource.URL_REDIRECT:
-                finish_job = serv_job.remove_pending(request)
+            for chunk in chunks:
+                if not isinstance(chunk, bytes):
+                    raise TypeError("dynamic response data must be 'bytes'")
+                if not chunk:
+                    # an empty chunk marks the end of the response body
+                    continue
+                if not encode:
+                    yield chunk
+                elif len(chunk) > cls.DEFAULT_TX_SIZE:
+                    # avoid copying large chunks
+                    yield b"%x\r\n" % (len(chunk),)
+                    yield chunk
+                    yield b"\r\n"
+                else:
+                    yield b"%x\r\n%s\r\n" % (len(chunk), chunk)
+            if encode:
+                yield b"0\r\n\r\n"
+        finally:
+            if hasattr(source, "close"):
+                source.close()
+
+    @classmethod
+    def _content_response(cls, serv_job, code, finish_job, header, keep_alive, target, offset, length):
+        """Create a response that serves data from an entry in serv_job.contents.
+        Small responses are read into memory, larger responses are streamed.
+
+        Args:
+            serv_job (SapphireJob): Job containing the entry.
+            code (int): HTTP status code.
+            finish_job (bool): The job is complete once the response has been sent.
+            header (bytes): Response header.
+            keep_alive (bool): The connection can be reused.
+            target (str): Name of the entry.
+            offset (int): Position of the response body in the entry.
+            length (int): Size of the response body.
+
+        Returns:
+            Response: The response to send.
+        """
+        if length <= cls.DEFAULT_TX_SIZE:
+            data = serv_job.read_content(target, offset, length)
+            if len(data) != length:
+                raise IOError("%r was truncated while sending" % (target,))
+            return Response(data, code, finish_job, header, keep_alive, length, offset, None, target)
+        return Response(
+            None,
+            code,
+            finish_job,
+            header,
+            keep_alive,
+            None,
+            offset,
+            cls._read_content(serv_job, target, offset, length),
+            target)
+
+    @classmethod
+    def _read_content(cls, serv_job, target, offset, length):
+        """Read data from an entry in serv_job.contents in chunks. The entry is
+        not read as a whole to avoid copying large files.
+
+        Args:
+            serv_job (SapphireJob): Job containing the entry.
+            target (str): Name of the entry.
+            offset (int): Position to start reading from.
+            length (int): Number of bytes to read.
+
+        Yields:
+            bytes: Data read from the entry.
+        """
+        while length > 0:
+            chunk = serv_job.read_content(target, offset, min(length, cls.DEFAULT_TX_SIZE))
+            if not chunk:
+                raise IOError("%r was truncated while sending" % (target,))
+            offset += len(chunk)
+            length -= len(chunk)
+            yield chunk
+
+    @classmethod
+    def _range_response(cls, byte_range, size, c_type, finish_job, keep_alive, target, serv_job=None):
+        # serv_job is only required when target is an entry in serv_job.contents
+        first, last = byte_range
+        if first >= size:
+            LOG.debug("416 %d-%d of %d bytes", first, last, size)
+            return Response(
+                None, 416, finish_job, cls._416_header(size, keep_alive=keep_alive),
+                keep_alive, 0, 0, None, None)
+        length = last - first + 1
+        LOG.debug("206 %d-%d of %d bytes", first, last, size)
+        header = cls._206_header(length, c_type, first, last, size, keep_alive=keep_alive)
+        if serv_job is not None:
+            return cls._content_response(serv_job, 206, finish_job, header, keep_alive, target, first, length)
+        if length > cls.DEFAULT_TX_SIZE:
+            return Response(None, 206, finish_job, header, keep_alive, length, first, None, target)
+        # small ranges are sent with the header in a single write
+        with open(target, "rb") as in_fp:
+            in_fp.seek(first)
+            data = in_fp.read(length)
+        if len(data) != length:
+            raise IOError("%r was truncated while sending" % (target,))
+        return Response(data, 206, finish_job, header, keep_alive, length, first, None, target)
+
+    @classmethod
+    def _recv_request(cls, conn, buffered):
+        """Receive data from conn until a complete request header is available.
+
+        Args:
+            conn (socket.socket): Connection to receive data from.
+            buffered (bytes): Data previously received that has not been processed.
+
+        Returns:
+            tuple: Request data (bytes) and data remaining after the request (bytes).
+                   The remaining data is None if the end of the request could not be
+                   found, in which case the connection cannot be reused.
+        """
+        while True:
+            result = cls.split_request(buffered)
+            if result is not None:
+                return result
+            data = conn.recv(cls.DEFAULT_REQUEST_LIMIT)
+            if not data:
+                return buffered, None
+            buffered += data
 
-            if finish_job and serv_job.forever:
-                LOG.debug("serv_job.forever is set, resetting finish_job")
-                finish_job = False
+    @classmethod
+    def _send_response(cls, conn, response):
+        """Send a response.
+
+        Args:
+            conn (socket.socket): Connection to send the response on.
+            response (Response): Response to send.
 
-            if not finish_job:
-                serv_job.accepting.set()
+        Returns:
+            int: Number of bytes sent.
+        """
+        sent = len(response.header)
+        if response.stream is not None:
+            conn.sendall(response.header)
+            try:
+                for chunk in response.stream:
+                    conn.sendall(chunk)
+                    sent += len(chunk)
+            finally:
+                response.stream.close()
+        elif response.body is None:
+            conn.sendall(response.header)
+            if response.target is not None:
+                cls._send_file(conn, response.target, response.length, response.offset)
+        elif response.length > cls.DEFAULT_TX_SIZE:
+            # avoid copying large response bodies
+            conn.sendall(response.header)
+            conn.sendall(response.body)
+        else:
+            conn.sendall(response.header + response.body)
+        if response.length is not None:
+            sent += response.length
+        return sent
+
+    @classmethod
+    def _send_file(cls, conn, target, length, offset=0):
+        start = time.time()
+        with open(target, "rb") as in_fp:
+            if cls.USE_SENDFILE:
+                # file data is copied directly to the socket by the kernel
+                sent = conn.sendfile(in_fp, offset=offset, count=length)
             else:
-                LOG.debug("expecting to finish")
+                # the offset of a memory map must be a multiple of ALLOCATIONGRANULARITY
+                skip = offset % mmap.ALLOCATIONGRANULARITY
+                try:
+                    with mmap.mmap(
+                            in_fp.fileno(),
+                            length + skip,
+                            access=mmap.ACCESS_READ,
+                            offset=offset - skip) as in_map, memoryview(in_map) as view:
+                        conn.sendall(view[skip:])
+                except ValueError:
+                    sent = 0
+                else:
+                    sent = length
+        if sent < length:
+            raise IOError("%r was truncated while sending" % (target,))
+        elapsed = max(time.time() - start, 0.000001)
+        LOG.debug(
+            "sent %s bytes in %0.3fs (%0.2f MB/s)",
+            format(length, ","), elapsed, length / elapsed / 0x100000)
 
-            if resource is None:
-                conn.sendall(cls._4xx_page(404, "Not Found", serv_job.auto_close))
-                LOG.debug("404 %r (%d to go)", request, serv_job.pending)
-                return
-            if resource.type in (Resource.URL_FILE, Resource.URL_INCLUDE):
-                LOG.debug("target %r", resource.target)
-                if not os.path.isfile(resource.target):
-                    conn.sendall(cls._4xx_page(404, "Not Found", serv_job.auto_close))
-                    LOG.debug("404 %r (%d to go)", request, serv_job.pending)
-                    return
-                if serv_job.is_forbidden(resource.target):
-                    # NOTE: this does info leak if files exist on disk.
-                    # We could replace 403 with 404 if it turns out we care but this
-                    # is meant to run locally and only be accessible from localhost
-                    conn.sendall(cls._4xx_page(403, "Forbidden", serv_job.auto_close))
-                    LOG.debug("403 %r (%d to go)", request, serv_job.pending)
-                    return
-            elif resource.type == Resource.URL_REDIRECT:
-                conn.sendall(cls._307_redirect(resource.target))
-                LOG.debug(
-                    "307 %r -> %r (%d to go)",
-                    request,
-                    resource.target,
-                    serv_job.pending)
-                return
-            elif resource.type == Resource.URL_DYNAMIC:
-                data = resource.target()
-                if not isinstance(data, bytes):
-                    LOG.debug("dynamic request: %r", request)
-                    raise TypeError("dynamic request callback must return 'bytes'")
-                conn.sendall(cls._200_header(len(data), resource.mime))
-                conn.sendall(data)
-                LOG.debug("200 %r (dynamic request)", request)
-                return
+    @classmethod
+    def build_response(cls, serv_job, raw_request, persist=True):
+        """Process a request and create the response. Only the response header
+        and small response bodies are created in memory.
+
+        Args:
+            serv_job (SapphireJob): Job the request belongs to.
+            raw_request (bytes): Request header.
+            persist (bool): The request was framed correctly and the connection
+                            can be reused.
+
+        Returns:
+            Response: The response to send.
+        """
+        request = cls.REQ_PATTERN.match(raw_request)
+        if request is None:
+            LOG.debug("400 request length %d (%d to go)", len(raw_request), serv_job.pending)
+            return Response(
+                None, 400, False, cls._4xx_page(400, "Bad Request", serv_job.auto_close),
+                False, 0, 0, None, None)
+
+        http11 = request.group("persist") is not None
+        # HTTP/1.1 connections are persistent unless the client requests otherwise
+        keep_alive = persist \
+            and serv_job.keep_alive > 0 \
+            and http11 \
+            and cls.CONN_CLOSE_PATTERN.search(raw_request) is None
+
+        byte_range = None
+        finish_job = False
+        info = None
+        request = unquote_plus(request.group("request").decode("ascii"))
+        LOG.debug("check_request(%r)", request)
+        resource = serv_job.check_request(request)
+        if resource is None:
+            LOG.debug("resource is None")  # 404
+        elif resource.type in (Resource.URL_DATA, Resource.URL_FILE, Resource.URL_INCLUDE):
+            if resource.type == Resource.URL_DATA:
+                size = serv_job.content_size(resource.target)
             else:
-                raise SapphireWorkerError("Unknown resource type %r" % (resource.type,))
+                info = cls.FILE_CACHE.lookup(resource.target)
+                size = info.size if info is not None else None
+            if size is not None:
+                byte_range = cls._byte_range(raw_request, size)
+            # a partial request only completes a file once the end of the file is requested
+            if byte_range is None or (byte_range[0] < size and byte_range[1] == size - 1):
+                finish_job = serv_job.remove_pending(resource.target)
+        elif resource.type == Resource.URL_REDIRECT:
+            finish_job = serv_job.remove_pending(request)
 
-            # at this point we know "resource.target" maps to a file on disk
-            # default to "application/octet-stream"
+        if finish_job and serv_job.forever:
+            LOG.debug("serv_job.forever is set, resetting finish_job")
+            finish_job = False
+
+        if resource is not None and resource.type == Resource.URL_FINISH:
+            # the client explicitly requested to finish the job
+            LOG.debug("finish requested (%d to go)", serv_job.pending)
+            finish_job = True
+
+        if finish_job:
+            LOG.debug("expecting to finish")
+            keep_alive = False
+
+        if resource is None:
+            LOG.debug("404 %r (%d to go)", request, serv_job.pending)
+            return Response(None, 404, finish_job, cls._4xx_page(
+                404, "Not Found", serv_job.auto_close, keep_alive=keep_alive), keep_alive, 0, 0, None, None)
+        if resource.type == Resource.URL_DATA:
+            # serve file data from memory
             c_type = mimetypes.guess_type(resource.target)[0] or "application/octet-stream"
-            # serve the file
-            data_size = os.stat(resource.target).st_size
-            LOG.debug("sending file: %s bytes", format(data_size, ","))
-            with open(resource.target, "rb") as in_fp:
-                conn.sendall(cls._200_header(data_size, c_type))
-                offset = 0
-                while offset < data_size:
-                    conn.sendall(in_fp.read(cls.DEFAULT_TX_SIZE))
-                    offset = in_fp.tell()
-            LOG.debug("200 %r (%d to go)", resource.target, serv_job.pending)
-            serv_job.increment_served(resource.target)
+            if byte_range is not None:
+                LOG.debug("range request %r (%d to go)", request, serv_job.pending)
+                return cls._range_response(
+                    byte_range, size, c_type, finish_job, keep_alive, resource.target, serv_job=serv_job)
+            LOG.debug("200 %r: %s bytes (%d to go)", request, format(size, ","), serv_job.pending)
+            return cls._content_response(
+                serv_job,
+                200,
+                finish_job,
+                cls._200_header(size, c_type, keep_alive=keep_alive),
+                keep_alive,
+                resource.target,
+                0,
+                size)
+        if resource.type in (Resource.URL_FILE, Resource.URL_INCLUDE):
+            LOG.debug("target %r", resource.target)
+            if info is None:
+                LOG.debug("404 %r (%d to go)", request, serv_job.pending)
+                return Response(None, 404, finish_job, cls._4xx_page(
+                    404, "Not Found", serv_job.auto_close, keep_alive=keep_alive),
+                    keep_alive, 0, 0, None, None)
+            if serv_job.is_forbidden(resource.target):
+                # NOTE: this does info leak if files exist on disk.
+                # We could replace 403 with 404 if it turns out we care but this
+                # is meant to run locally and only be accessible from localhost
+                LOG.debug("403 %r (%d to go)", request, serv_job.pending)
+                return Response(None, 403, finish_job, cls._4xx_page(
+                    403, "Forbidden", serv_job.auto_close, keep_alive=keep_alive),
+                    keep_alive, 0, 0, None, None)
+            # at this point we know "resource.target" maps to a file on disk
+            if byte_range is not None:
+                LOG.debug("range request %r (%d to go)", request, serv_job.pending)
+                return cls._range_response(
+                    byte_range, info.size, info.c_type, finish_job, keep_alive, resource.target)
+            header = info.headers.get(keep_alive)
+            if header is None:
+                header = cls._200_header(info.size, info.c_type, keep_alive=keep_alive)
+                info.headers[keep_alive] = header
+            LOG.debug("200 %r: %s bytes (%d to go)", request, format(info.size, ","), serv_job.pending)
+            if info.size <= cls.DEFAULT_TX_SIZE:
+                # small files are sent with the header in a single write
+                with open(resource.target, "rb") as in_fp:
+                    data = in_fp.read(info.size)
+                if len(data) != info.size:
+                    # file was truncated after the lookup
+                    header = cls._200_header(len(data), info.c_type, keep_alive=keep_alive)
+                return Response(
+                    data,
+                    200,
+                    finish_job,
+                    header,
+                    keep_alive,
+                    len(data),
+                    0,
+                    None,
+                    resource.target)
+            return Response(
+                None,
+                200,
+                finish_job,
+                header,
+                keep_alive,
+                info.size,
+                0,
+                None,
+                resource.target)
+        if resource.type == Resource.URL_REDIRECT:
+            LOG.debug(
+                "307 %r -> %r (%d to go)",
+                request,
+                resource.target,
+                serv_job.pending)
+            return Response(
+                None, 307, finish_job, cls._307_redirect(resource.target, keep_alive=keep_alive),
+                keep_alive, 0, 0, None, None)
+        if resource.type == Resource.URL_DYNAMIC:
+            data = resource.target()
+            if not isinstance(data, bytes):
+                if isinstance(data, str) or not (hasattr(data, "read") or hasattr(data, "__iter__")):
+                    LOG.debug("dynamic request: %r", request)
+                    raise TypeError(
+                        "dynamic request callback must return 'bytes', an iterable or a file-like object")
+                if http11:
+                    # stream the data as it is generated
+                    LOG.debug("200 %r (dynamic request, chunked)", request)
+                    return Response(
+                        None, 200, finish_job, cls._200_header(None, resource.mime, keep_alive=keep_alive),
+                        keep_alive, None, 0, cls._chunked(data), None)
+                # chunked transfer encoding is not supported by HTTP/1.0 clients
+                data = b"".join(cls._chunked(data, encode=False))
+            LOG.debug("200 %r (dynamic request)", request)
+            return Response(
+                data, 200, finish_job, cls._200_header(len(data), resource.mime, keep_alive=keep_alive),
+                keep_alive, len(data), 0, None, None)
+        if resource.type == Resource.URL_FINISH:
+            LOG.debug("200 %r (finish request)", request)
+            return Response(
+                b"", 200, finish_job, cls._200_header(0, resource.mime, keep_alive=keep_alive),
+                keep_alive, 0, 0, None, None)
+        raise SapphireWorkerError("Unknown resource type %r" % (resource.type,))
+
+    @classmethod
+    def handle_request(cls, conn, serv_job, accepted=None, idle=None, next_job=None):
+        finish_job = False  # call finish() on return
+        buffered = b""
+        try:
+            while True:
+                # receive all the incoming data
+                raw_request, buffered = cls._recv_request(conn, buffered)
+                if idle is not None:
+                    idle.clear()
+                if not raw_request:
+                    LOG.debug("raw_request was empty")
+                    break
+                late = False
+                if next_job is not None and serv_job.is_finishing():
+                    if cls.is_late(serv_job, raw_request):
+                        # the request for an optional resource was sent before the job
+                        # was complete (for example by a test case that is still running)
+                        LOG.debug("late request")
+                        late = True
+                    else:
+                        # the request arrived after all required files were requested
+                        # so it belongs to the next job
+                        LOG.debug("waiting for next job")
+                        serv_job = next_job(serv_job)
+                        if serv_job is None:
+                            break
+
+                response = cls.build_response(serv_job, raw_request, persist=buffered is not None)
+                # the keep-alive timeout only applies while waiting for a request
+                conn.settimeout(None)
+                if late:
+                    # late responses are not included in the served files or the metrics
+                    cls._send_response(conn, response)
+                else:
+                    if accepted is not None:
+                        # time from accepting the connection to the first response
+                        serv_job.metrics.record_first_byte(time.time() - accepted)
+                        accepted = None
+                    # the file is recorded as served once it has been sent, the job is not
+                    # finished until all responses that are being sent are complete
+                    serv_job.begin_send()
+                    try:
+                        sent = cls._send_response(conn, response)
+                    except Exception:
+                        serv_job.end_send(response.target, complete=False)
+                        raise
+                    serv_job.end_send(response.target)
+                    finish_job = response.finish
+                    serv_job.metrics.record_response(response.code, sent)
+
+                if not response.keep_alive or (next_job is None and serv_job.is_complete()):
+                    break
+                # wait for the next request on the persistent connection
+                conn.settimeout(serv_job.keep_alive)
+                if idle is not None and not buffered:
+                    idle.set()
 
         except (socket.timeout, socket.error):
             exc_type, exc_obj, exc_tb = sys.exc_info()
             LOG.debug("%s: %r (line %d)", exc_type.__name__, exc_obj, exc_tb.tb_lineno)
-            if not finish_job:
-                serv_job.accepting.set()
 
         except Exception:  # pylint: disable=broad-except
             # set finish_job to abort immediately
@@ -190,36 +651,82 @@ class SapphireWorker(object):
         finally:
             conn.close()
             if finish_job:
+                # files that are being sent by other workers are included in the served files
+                if not serv_job.wait_sends(timeout=cls.SEND_TIMEOUT):
+                    LOG.debug("responses are still being sent")
                 serv_job.finish()
-            serv_job.worker_complete.set()
 
-    def join(self, timeout=None):
-        if self._thread is not None:
-            self._thread.join(timeout=timeout)
-            if not self._thread.is_alive():
-                self._thread = None
+    @staticmethod
+    def accept(listen_sock, job):
+        """Accept a connection to be handled by handle_request().
 
-    @classmethod
-    def launch(cls, listen_sock, job):
-        assert job.accepting.is_set()
+        Args:
+            listen_sock (socket.socket): Listening socket.
+            job (SapphireJob): Job the connection is accepted for.
+
+        Returns:
+            socket.socket: Accepted connection or None if no connection was accepted.
+        """
         conn = None
         try:
             conn, _ = listen_sock.accept()
-            conn.settimeout(None)
-            # create a worker thread to handle client request
-            w_thread = threading.Thread(target=cls.handle_request, args=(conn, job))
-            job.accepting.clear()
-            w_thread.start()
-            return cls(conn, w_thread)
+            # connections that never send a request are closed like idle persistent connections
+            conn.settimeout(job.keep_alive if job.keep_alive > 0 else None)
+            # do not delay small writes such as response headers
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except (socket.error, socket.timeout):
             if conn is not None:  # pragma: no cover
                 conn.close()
-        except threading.ThreadError:
-            if conn is not None:  # pragma: no cover
-                conn.close()
-            # reset accepting status
-            job.accepting.set()
-            LOG.warning("ThreadError (worker), threads: %d", threading.active_count())
-            # wait for system resources to free up
-            time.sleep(0.1)
+            return None
+        return conn
+
+    @classmethod
+    def is_late(cls, serv_job, raw_request):
+        """Check if a request received while the job is finishing is for an
+        optional resource of the job. Requests for resources that are not
+        available, that were required to complete the job or for files that were
+        added after the job was created belong to the next job.
+
+        Args:
+            serv_job (SapphireJob): Job that is finishing.
+            raw_request (bytes): Request header.
+
+        Returns:
+            bool: True if the request can be answered by the job otherwise False.
+        """
+        request = cls.REQ_PATTERN.match(raw_request)
+        if request is None:
+            return False
+        resource = serv_job.check_request(unquote_plus(request.group("request").decode("ascii")))
+        if resource is None or resource.type == Resource.URL_FINISH:
+            return False
+        if resource.type in (Resource.URL_DATA, Resource.URL_FILE):
+            return serv_job.is_optional(resource.target)
+        if resource.type == Resource.URL_INCLUDE:
+            return cls.FILE_CACHE.lookup(resource.target) is not None
+        return not resource.required
+
+    @classmethod
+    def split_request(cls, buffered):
+        """Find the end of the first request in buffered.
+
+        Args:
+            buffered (bytes): Data received from the client.
+
+        Returns:
+            tuple: Request data (bytes) and data remaining after the request (bytes)
+                   or None if more data is required. The remaining data is None if
+                   the request is invalid or incomplete and cannot be framed.
+        """
+        if b"\r\n\r\n" in buffered:
+            raw_request, remaining = buffered.split(b"\r\n\r\n", 1)
+            return raw_request, remaining
+        if not b"GET ".startswith(buffered[:4]):
+            # unsupported request method, do not wait for the remaining headers
+            return buffered, None
+        if b"\r\n" in buffered and cls.REQ_PATTERN.match(buffered) is None:
+            # invalid request line, do not wait for the remaining headers
+            return buffered, None
+        if len(buffered) >= cls.DEFAULT_REQUEST_LIMIT:
+            return buffered, None
         return None
@@ -28,6 +28,8 @@ class Resource(object):
     URL_FILE = 1
     URL_INCLUDE = 2
     URL_REDIRECT = 3
+    URL_DATA = 4
+    URL_FINISH = 5
 
     __slots__ = ("mime", "required", "target", "type")
 
@@ -38,6 +40,126 @@ class Resource(object):
         self.type = resource_type
 
 
+class _IndexNode(object):
+    __slots__ = ("children", "dynamic", "include", "redirect")
+
+    def __init__(self):
+        self.children = dict()
+        self.dynamic = None
+        self.include = None
+        self.redirect = None
+
+
+class ServerMapIndex(object):
+    """Prefix tree of the entries in a ServerMap keyed by URL path segment.
+    This is built once per job so lookups only depend on the depth of the
+    request and not on the number of entries in the ServerMap.
+    """
+    CACHE_LIMIT = 4096  # maximum number of resolved include requests to keep
+
+    __slots__ = ("_cache", "_include_targets", "_root")
+
+    def __init__(self, server_map):
+        self._cache = dict()  # request -> (Resource, check file exists) or None
+        self._include_targets = frozenset(x.target for x in server_map.include.values())
+        self._root = _IndexNode()
+        for url, resource in server_map.dynamic.items():
+            self._node(url).dynamic = resource
+        for url, resource in server_map.include.items():
+            self._node(url).include = resource
+        for url, resource in server_map.redirect.items():
+            self._node(url).redirect = resource
+
+    def _node(self, url):
+        # find or create the node for the given url
+        node = self._root
+        if url:
+            for segment in url.split("/"):
+                node = node.children.setdefault(segment, _IndexNode())
+        return node
+
+    def _resolve_include(self, request):
+        # find the deepest include mount that contains request
+        node = self._root
+        mount = None
+        if request:
+            depth = 0
+            for segment in request.split("/"):
+                node = node.children.get(segment)
+                if node is None:
+                    break
+                depth += len(segment) + 1
+                if node.include is not None and request[depth:].lstrip("/"):
+                    mount = (node.include, request[depth:].lstrip("/"))
+        if mount is None:
+            # try empty mount point
+            if self._root.include is None or not request:
+                return None
+            mount = (self._root.include, request)
+        LOG.debug("found include match %r", mount[0].target)
+        return (
+            Resource(
+                Resource.URL_INCLUDE,
+                os.path.normpath(os.path.join(mount[0].target, mount[1])),
+                mime=mount[0].mime,
+                required=mount[0].required),
+            mount[0] is self._root.include)
+
+    def find(self, request):
+        """Look up the resource mapped to request.
+
+        Args:
+            request (str): Request path without the query string.
+
+        Returns:
+            Resource: The resource or None if request is not mapped.
+        """
+        node = self._root
+        if request:
+            for segment in request.split("/"):
+                node = node.children.get(segment)
+                if node is None:
+                    break
+        if node is not None:
+            if node.redirect is not None:
+                return node.redirect
+            if node.dynamic is not None:
+                return node.dynamic
+        try:
+            resolved = self._cache[request]
+        except KeyError:
+            resolved = self._resolve_include(request)
+            if len(self._cache) >= self.CACHE_LIMIT:
+                self._cache.clear()
+            self._cache[request] = resolved
+        if resolved is None:
+            return None
+        resource, check_exists = resolved
+        # if the mapping url is empty check the file exists
+        if check_exists and not os.path.isfile(resource.target):
+            return None
+        return resource
+
+    def is_included(self, target_file):
+        """Check if target_file is located in an include directory.
+
+        Args:
+            target_file (str): Absolute normalized path of a file.
+
+        Returns:
+            bool: True if target_file is in an include directory otherwise False.
+        """
+        if self._include_targets:
+            parent = os.path.dirname(target_file)
+            while parent not in self._include_targets:
+                next_parent = os.path.dirname(parent)
+                if next_parent == parent:
+                    return False
+                parent = next_parent
+            return True
+        return False
+
+
 class ServerMap(object):
     __slots__ = ("dynamic", "include", "redirect")
 
@@ -68,6 +190,17 @@ class ServerMap(object):
             callback,
             mime=mime_type)
 
+    def set_finish(self, url):
+        # requesting url finishes the job that is being served, this includes 'forever' jobs
+        url = self._check_url(url)
+        if url in self.include or url in self.redirect:
+            raise MapCollisionError("URL collision on %r" % (url,))
+        LOG.debug("mapping finish %r", url)
+        self.dynamic[url] = Resource(
+            Resource.URL_FINISH,
+            None,
+            mime="text/plain")
+
     def set_include(self, url, target_path):
         url = self._check_url(url)
         if not os.path.isdir(target_path):
@@ -0,0 +1,97 @@
+# coding=utf-8
+"""
+Sapphire metrics unit tests
+"""
+from .metrics import Histogram, JobMetrics, ServeResult, ServerMetrics
+from .status_codes import SERVED_ALL
+
+
+def test_histogram_01():
+    """test empty Histogram"""
+    hist = Histogram()
+    assert hist.count == 0
+    assert hist.mean == 0
+    assert hist.percentile(50) == 0
+    assert hist.percentile(99) == 0
+    assert not hist.dump()
+    assert "count: 0" in hist.summary()
+
+
+def test_histogram_02():
+    """test Histogram.add() and Histogram.percentile()"""
+    hist = Histogram(bounds=(1, 2, 4, 8))
+    for value in (0.5, 1, 1.5, 3, 3, 7):
+        hist.add(value)
+    assert hist.count == 6
+    assert hist.buckets == [2, 1, 2, 1, 0]
+    assert hist.maximum == 7
+    assert hist.mean == 16 / 6.0
+    assert hist.percentile(0) == 1
+    assert hist.percentile(50) == 2
+    assert hist.percentile(100) == 7
+    # values larger than the last bound
+    hist.add(100)
+    assert hist.buckets[-1] == 1
+    assert hist.percentile(100) == 100
+    lines = hist.dump(fmt="%d")
+    assert len(lines) == 5
+    assert lines[0].strip().startswith("<= 1:")
+    assert lines[-1].strip().startswith("> 8:")
+
+
+def test_histogram_03():
+    """test Histogram.merge()"""
+    hist_a = Histogram(bounds=(1, 2))
+    hist_a.add(1)
+    hist_b = Histogram(bounds=(1, 2))
+    hist_b.add(2)
+    hist_b.add(3)
+    hist_a.merge(hist_b)
+    assert hist_a.buckets == [1, 1, 1]
+    assert hist_a.count == 3
+    assert hist_a.maximum == 3
+    assert hist_a.total == 6
+
+
+def test_server_metrics_01():
+    """test ServerMetrics collecting JobMetrics"""
+    metrics = ServerMetrics()
+    assert metrics.jobs == 0
+    job_a = JobMetrics()
+    job_a.record_accept(1)
+    job_a.record_accept(2, wait=0.5)
+    job_a.record_first_byte(0.01)
+    job_a.record_response(200, 100)
+    job_a.record_response(404, 50)
+    job_a.served_all = 1.0
+    metrics.add(job_a)
+    job_b = JobMetrics()
+    job_b.record_response(200, 10)
+    metrics.add(job_b)
+    assert metrics.jobs == 2
+    assert metrics.bytes_sent == 160
+    assert metrics.requests == {200: 2, 404: 1}
+    assert metrics.accept_wait.count == 2
+    assert metrics.accept_wait.maximum == 0.5
+    assert metrics.first_byte.count == 1
+    assert metrics.occupancy.maximum == 2
+    # only jobs that served all files are included
+    assert metrics.served_all.count == 1
+    report = metrics.dump()
+    assert "Jobs: 2, requests: 3, bytes sent: 160" in report
+    assert "200: 2, 404: 1" in report
+    assert "Time to SERVED_ALL (s) - count: 1" in report
+    assert "Occupancy - count: 2, mean: 1, p50: 1, p99: 2, max: 2" in report
+
+
+def test_serve_result_01():
+    """test ServeResult"""
+    metrics = JobMetrics()
+    result = ServeResult(SERVED_ALL, ("a.html",), metrics=metrics)
+    assert result == (SERVED_ALL, ("a.html",))
+    status, served = result
+    assert status == SERVED_ALL
+    assert served == ("a.html",)
+    assert result.status == SERVED_ALL
+    assert result.served == ("a.html",)
+    assert result.metrics is metrics
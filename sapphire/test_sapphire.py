@@ -5,15 +5,22 @@ Sapphire unit tests
 # pylint: disable=protected-access
 
 import hashlib
+from http.client import HTTPConnection
+import io
+import mmap
 import os
 import random
 import threading
+import time
 
 import pytest
 
-from grizzly.common import TestCase
+from grizzly.common import TestCase, TestFile
 
 from .core import Sapphire
+from .sapphire_load_manager import SapphireLoadManager
+from .sapphire_multiplexer import SapphireMultiplexer
+from .sapphire_selector import SapphireSelector
 from .sapphire_worker import SapphireWorker
 from .server_map import ServerMap
 from .status_codes import SERVED_ALL, SERVED_NONE, SERVED_REQUEST, SERVED_TIMEOUT
@@ -46,6 +53,15 @@ def _create_test(fname, path, data=b"Test!", calc_hash=False, url_prefix=None):
     return test
 
 
+def _disable_poll(mocker, use_selector):
+    # make the continue_cb poll interval longer than any timeout used by the tests
+    manager_cls = SapphireSelector if use_selector else SapphireLoadManager
+    real_wait = manager_cls.wait
+    mocker.patch.object(
+        manager_cls, "wait", autospec=True,
+        side_effect=lambda mgr, timeout, continue_cb=None: real_wait(mgr, timeout, continue_cb, poll=60))
+
+
 def test_sapphire_00(client, tmp_path):
     """test requesting a single file"""
     with Sapphire(timeout=10) as serv:
@@ -57,12 +73,13 @@ def test_sapphire_00(client, tmp_path):
     assert test.code == 200
     assert test.len_srv == test.len_org
 
-def test_sapphire_01(client, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_01(client, tmp_path, use_selector):
     """test requesting multiple files (test cleanup code)"""
     to_serve = list()
     for i in range(100):
         to_serve.append(_create_test("test_%03d.html" % i, tmp_path, data=os.urandom(5), calc_hash=True))
-    with Sapphire(timeout=30) as serv:
+    with Sapphire(timeout=30, use_selector=use_selector) as serv:
         client.launch("127.0.0.1", serv.port, to_serve)
         status, files_served = serv.serve_path(str(tmp_path))
     assert status == SERVED_ALL
@@ -185,8 +202,11 @@ def test_sapphire_08(client, tmp_path):
     assert status == SERVED_REQUEST
     assert len(files_served) < len(files_to_serve)
 
-def test_sapphire_09(client, tmp_path):
+@pytest.mark.parametrize("use_sendfile", [False, True])
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_09(client, mocker, tmp_path, use_selector, use_sendfile):
     """test serving interesting sized files"""
+    mocker.patch.object(SapphireWorker, "USE_SENDFILE", use_sendfile)
     tests = [
         {"size": SapphireWorker.DEFAULT_TX_SIZE, "name": "even.html"},
         {"size": SapphireWorker.DEFAULT_TX_SIZE - 1, "name": "minus_one.html"},
@@ -200,7 +220,7 @@ def test_sapphire_09(client, tmp_path):
         t_data = "".join(random.choice("ABCD1234") for _ in range(test["size"])).encode("ascii")
         (tmp_path / test["file"].url).write_bytes(t_data)
         test["file"].md5_org = hashlib.md5(t_data).hexdigest()
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         client.launch("127.0.0.1", serv.port, [test["file"] for test in tests])
         status, served_list = serv.serve_path(str(tmp_path))
     assert status == SERVED_ALL
@@ -211,7 +231,8 @@ def test_sapphire_09(client, tmp_path):
         assert test["file"].len_srv == test["size"]
         assert test["file"].md5_srv == test["file"].md5_org
 
-def test_sapphire_10(client, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_10(client, tmp_path, use_selector):
     """test serving a large (100MB) file"""
     t_file = _TestFile("test_case.html")
     data_hash = hashlib.md5()
@@ -222,7 +243,7 @@ def test_sapphire_10(client, tmp_path):
             test_fp.write(data)
             data_hash.update(data)
     t_file.md5_org = data_hash.hexdigest()
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         client.launch("127.0.0.1", serv.port, [t_file])
         assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
     assert client.wait(timeout=10)
@@ -306,10 +327,11 @@ def test_sapphire_16(client, tmp_path):
     assert test.code == 200
     assert test.len_srv == test.len_org
 
-def test_sapphire_17(client, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_17(client, tmp_path, use_selector):
     """test required mapped redirects"""
     smap = ServerMap()
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         files_to_serve = list()
         # redir_target will be requested indirectly via the redirect
         redir_target = _create_test("redir_test_case.html", tmp_path, data=b"Redirect DATA!")
@@ -328,7 +350,8 @@ def test_sapphire_17(client, tmp_path):
     assert redir_test.code == 200
     assert redir_test.len_srv == redir_target.len_org
 
-def test_sapphire_18(client, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_18(client, tmp_path, use_selector):
     """test include directories and permissions"""
     inc1_path = tmp_path / "inc1"
     inc2_path = tmp_path / "inc2"
@@ -338,7 +361,7 @@ def test_sapphire_18(client, tmp_path):
     root_path.mkdir()
     files_to_serve = list()
     smap = ServerMap()
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         # add files to inc dirs
         inc1 = _create_test("included_file1.html", inc1_path, data=b"blah....1")
         files_to_serve.append(inc1)
@@ -385,7 +408,8 @@ def test_sapphire_18(client, tmp_path):
     assert inc404.code == 404
     assert inc403.code == 403
 
-def test_sapphire_19(client, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_19(client, tmp_path, use_selector):
     """test dynamic response"""
     _test_string = b"dynamic response -- TEST DATA!"
 
@@ -398,7 +422,7 @@ def test_sapphire_19(client, tmp_path):
     test_dr.md5_org = hashlib.md5(_test_string).hexdigest()
     smap.set_dynamic_response("dynm_test", _dyn_test_cb, mime_type="text/plain")
     test = _create_test("test_case.html", tmp_path)
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         client.launch("127.0.0.1", serv.port, [test_dr, test], in_order=True)
         assert serv.serve_path(str(tmp_path), server_map=smap)[0] == SERVED_ALL
     assert client.wait(timeout=10)
@@ -408,14 +432,15 @@ def test_sapphire_19(client, tmp_path):
     assert test_dr.len_srv == test_dr.len_org
     assert test_dr.md5_srv == test_dr.md5_org
 
-def test_sapphire_20(client_factory, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_20(client_factory, tmp_path, use_selector):
     """test pending_files == 0 in worker thread"""
     client_defer = client_factory(rx_size=2)
     # server should shutdown while this file is being served
     test_defer = _create_test("defer_test.html", tmp_path)
     optional = [test_defer.url]
     test = _create_test("test_case.html", tmp_path, data=b"112233")
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         # this test needs to wait just long enough to have the required file served
         # but not too long or the connection will be closed by the server
         client_defer.launch("127.0.0.1", serv.port, [test_defer], delay=0.1, indicate_failure=True)
@@ -425,7 +450,9 @@ def test_sapphire_20(client_factory, tmp_path):
     assert client_defer.wait(timeout=10)
     assert client.wait(timeout=10)
     assert test.code == 200
-    assert test_defer.code == 0
+    # the threaded server answers the late request for the optional file while closing,
+    # the selector closes connections that do not have a response in progress
+    assert test_defer.code == (0 if use_selector else 200)
 
 def test_sapphire_21(client, tmp_path):
     """test handling an invalid request"""
@@ -479,13 +506,14 @@ def test_sapphire_23(client_factory, tmp_path):
         assert t_file.code == 200
         assert t_file.len_srv == t_file.len_org
 
-def test_sapphire_24(client_factory, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_24(client_factory, tmp_path, use_selector):
     """test all request types via multiple connections"""
     def _dyn_test_cb():
         return b"A" if random.getrandbits(1) else b"AA"
 
     smap = ServerMap()
-    with Sapphire(max_workers=10, timeout=60) as serv:
+    with Sapphire(max_workers=10, timeout=60, use_selector=use_selector) as serv:
         to_serve = list()
         for i in range(50):
             # add required files
@@ -510,18 +538,20 @@ def test_sapphire_24(client_factory, tmp_path):
             clients[-1].launch("127.0.0.1", serv.port, to_serve, throttle=throttle)
         assert serv.serve_path(str(tmp_path), server_map=smap)[0] == SERVED_ALL
 
-def test_sapphire_25(client, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_25(client, tmp_path, use_selector):
     """test dynamic response with bad callbacks"""
     test_dr = _TestFile("dynm_test")
     smap = ServerMap()
     smap.set_dynamic_response("dynm_test", lambda: None, mime_type="text/plain")
     test = _create_test("test_case.html", tmp_path)
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         client.launch("127.0.0.1", serv.port, [test_dr, test], in_order=True)
         with pytest.raises(TypeError):
             serv.serve_path(str(tmp_path), server_map=smap)
 
-def test_sapphire_26(client, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_26(client, tmp_path, use_selector):
     """test serving to a slow client"""
     t_data = "".join(random.choice("ABCD1234") for _ in range(0x19000))  # 100KB
     t_file = _create_test("test_case.html", tmp_path, data=t_data.encode("ascii"), calc_hash=True)
@@ -529,7 +559,7 @@ def test_sapphire_26(client, tmp_path):
     # also taking 2.5 seconds to complete will hopefully find problems
     # with any assumptions that were made
     client.rx_size = 0x2800
-    with Sapphire(timeout=60) as serv:
+    with Sapphire(timeout=60, use_selector=use_selector) as serv:
         client.launch("127.0.0.1", serv.port, [t_file], throttle=0.25)
         assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
     assert client.wait(timeout=10)
@@ -563,10 +593,11 @@ def test_sapphire_28(client, tmp_path):
     assert files_served
     assert test.duration >= 0
 
-def test_sapphire_29(client_factory, tmp_path):
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_29(client_factory, tmp_path, use_selector):
     """test Sapphire.serve_path() with forever=True"""
     clients = list()
-    with Sapphire(timeout=10) as serv:
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
         assert serv.timeout == 10
         test = _create_test("test_case.html", tmp_path)
         for _ in range(3):
@@ -641,6 +672,429 @@ def test_sapphire_32(mocker):
     assert fake_sock.return_value.listen.call_count == 1
     assert fake_sleep.call_count == 1
 
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_33(tmp_path, use_selector):
+    """test serving multiple requests via a persistent connection"""
+    to_serve = [_create_test("test_%d.html" % i, tmp_path, data=b"A" * i) for i in range(3)]
+    responses = list()
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            for t_file in to_serve:
+                conn.request("GET", "/" + t_file.url)
+                resp = conn.getresponse()
+                responses.append((resp.status, resp.getheader("Connection"), resp.read()))
+        finally:
+            conn.close()
+
+    with Sapphire(keep_alive=10, timeout=10, use_selector=use_selector) as serv:
+        client = threading.Thread(target=_client, args=(serv.port,))
+        client.start()
+        try:
+            status, files_served = serv.serve_path(str(tmp_path))
+        finally:
+            client.join(timeout=10)
+    assert status == SERVED_ALL
+    assert len(files_served) == len(to_serve)
+    assert len(responses) == len(to_serve)
+    for t_file, (code, conn_hdr, data) in zip(to_serve, responses):
+        assert code == 200
+        assert len(data) == t_file.len_org
+        assert conn_hdr == ("close" if t_file is to_serve[-1] else "keep-alive")
+
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_34(client, mocker, tmp_path, use_selector):
+    """test Sapphire.serve_testcase() serving from memory"""
+    # data is read from the TestFile objects without creating a copy
+    mocker.patch.object(TestFile, "data", new_callable=mocker.PropertyMock, side_effect=AssertionError)
+    large = b"A" * (SapphireWorker.DEFAULT_TX_SIZE * 4)
+    with TestCase("test.html", "none.test", "foo") as test:
+        test.add_from_data(b"test", "test.html")
+        test.add_from_data(large, "nested/large.bin")
+        test.add_from_data(b"optional", "opt.js", required=False)
+        t_test = _TestFile("test.html")
+        t_test.len_org = 4
+        t_large = _TestFile("nested/large.bin")
+        t_large.len_org = len(large)
+        t_large.md5_org = hashlib.md5(large).hexdigest()
+        with Sapphire(timeout=10, use_selector=use_selector) as serv:
+            client.launch("127.0.0.1", serv.port, [t_test, t_large])
+            status, files_served = serv.serve_testcase(test)
+    assert status == SERVED_ALL
+    assert set(files_served) == {"test.html", os.path.join("nested", "large.bin")}
+    assert client.wait(timeout=10)
+    assert t_test.code == 200
+    assert t_test.len_srv == t_test.len_org
+    assert t_large.code == 200
+    assert t_large.len_srv == t_large.len_org
+    assert t_large.md5_srv == t_large.md5_org
+    # nothing was written to disk
+    assert not any(tmp_path.iterdir())
+
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_35(tmp_path, use_selector):
+    """test serving multiple jobs using a persistent connection"""
+    switched = threading.Event()
+    responses = list()
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            conn.request("GET", "/a.html")
+            resp = conn.getresponse()
+            responses.append((resp.status, resp.read()))
+            sock = conn.sock
+            # complete the first job using another connection
+            closing = HTTPConnection("127.0.0.1", port, timeout=10)
+            try:
+                closing.request("GET", "/b.html", headers={"Connection": "close"})
+                resp = closing.getresponse()
+                responses.append((resp.status, resp.read()))
+            finally:
+                closing.close()
+            assert switched.wait(10)
+            # request from the next job on the existing connection
+            conn.request("GET", "/c.html")
+            assert conn.sock is sock
+            resp = conn.getresponse()
+            responses.append((resp.status, resp.read()))
+        finally:
+            conn.close()
+
+    with TestCase("a.html", None, "foo") as test1, TestCase("c.html", None, "foo") as test2:
+        test1.add_from_data(b"a", "a.html", required=False)
+        test1.add_from_data(b"b", "b.html")
+        test2.add_from_data(b"c", "c.html")
+        with Sapphire(keep_alive=10, timeout=10, use_selector=use_selector) as serv:
+            client = threading.Thread(target=_client, args=(serv.port,))
+            client.start()
+            try:
+                assert serv.serve_testcase(test1)[0] == SERVED_ALL
+                manager = serv._manager
+                switched.set()
+                assert serv.serve_testcase(test2) == (SERVED_ALL, ("c.html",))
+                # the same listener is used for both jobs
+                assert serv._manager is manager
+            finally:
+                client.join(timeout=10)
+    assert responses == [(200, b"a"), (200, b"b"), (200, b"c")]
+
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_36(mocker, tmp_path, use_selector):
+    """test Sapphire.wake() ends serving without waiting for the next poll"""
+    _create_test("test_case.html", tmp_path)
+    stop = threading.Event()
+
+    def _stop():
+        stop.set()
+        serv.wake()
+
+    # continue_cb is never polled, only wake() can end serving before the timeout
+    _disable_poll(mocker, use_selector)
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
+        waker = threading.Timer(0.1, _stop)
+        waker.start()
+        try:
+            status, served = serv.serve_path(str(tmp_path), continue_cb=lambda: not stop.is_set())
+        finally:
+            waker.join()
+    assert status == SERVED_NONE
+    assert not served
+
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_37(mocker, tmp_path, use_selector):
+    """test iteration turnaround is not limited by a polling interval"""
+    iterations = 20
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            for _ in range(iterations):
+                conn.request("GET", "/test.html")
+                resp = conn.getresponse()
+                assert resp.status == 200
+                resp.read()
+        finally:
+            conn.close()
+
+    with TestCase("test.html", None, "foo") as test:
+        test.add_from_data(b"test", "test.html")
+        # each job must be completed by the last request, polling would end with a timeout
+        _disable_poll(mocker, use_selector)
+        with Sapphire(keep_alive=10, timeout=10, use_selector=use_selector) as serv:
+            client = threading.Thread(target=_client, args=(serv.port,))
+            client.start()
+            try:
+                for _ in range(iterations):
+                    status, served = serv.serve_testcase(test)
+                    assert status == SERVED_ALL
+                    assert served == ("test.html",)
+            finally:
+                client.join(timeout=10)
+
+@pytest.mark.parametrize("use_sendfile", [False, True])
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_38(mocker, tmp_path, use_selector, use_sendfile):
+    """test serving range requests"""
+    mocker.patch.object(SapphireWorker, "USE_SENDFILE", use_sendfile)
+    data = os.urandom(SapphireWorker.DEFAULT_TX_SIZE * 4)
+    (tmp_path / "media.webm").write_bytes(data)
+    responses = list()
+
+    def _client(port, ranges):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            for value in ranges:
+                conn.request("GET", "/media.webm", headers={"Range": "bytes=%s" % (value,)})
+                resp = conn.getresponse()
+                responses.append((resp.status, resp.read()))
+        finally:
+            conn.close()
+
+    offset = mmap.ALLOCATIONGRANULARITY + 1
+    with Sapphire(keep_alive=10, timeout=10, use_selector=use_selector) as serv:
+        # partial requests do not complete the file
+        ranges = ("0-99", "%d-%d" % (offset, len(data) - 2), "0-0, 5-6")
+        client = threading.Thread(target=_client, args=(serv.port, ranges))
+        client.start()
+        try:
+            status, served = serv.serve_path(str(tmp_path))
+        finally:
+            client.join(timeout=10)
+    assert status == SERVED_ALL
+    assert served == ("media.webm",)
+    assert len(responses) == 3
+    assert responses[0] == (206, data[:100])
+    assert responses[1] == (206, data[offset:-1])
+    # multiple ranges are not supported, the whole file is sent
+    assert responses[2] == (200, data)
+
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_39(tmp_path, use_selector):
+    """test streamed dynamic responses"""
+    chunk = os.urandom(0x19000)
+    (tmp_path / "test.html").write_bytes(b"a")
+    smap = ServerMap()
+    smap.set_dynamic_response("gen", lambda: (chunk for _ in range(10)), mime_type="video/webm")
+    smap.set_dynamic_response("file", lambda: io.BytesIO(chunk))
+    responses = dict()
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            for url in ("gen", "file", "test.html"):
+                conn.request("GET", "/%s" % (url,))
+                resp = conn.getresponse()
+                responses[url] = (resp.status, resp.getheader("Transfer-Encoding"), resp.read())
+        finally:
+            conn.close()
+
+    with Sapphire(keep_alive=10, timeout=10, use_selector=use_selector) as serv:
+        client = threading.Thread(target=_client, args=(serv.port,))
+        client.start()
+        try:
+            assert serv.serve_path(str(tmp_path), server_map=smap)[0] == SERVED_ALL
+        finally:
+            client.join(timeout=10)
+    assert responses["gen"] == (200, "chunked", chunk * 10)
+    assert responses["file"] == (200, "chunked", chunk)
+    assert responses["test.html"] == (200, None, b"a")
+
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_40(tmp_path, use_selector):
+    """test request metrics"""
+    (tmp_path / "test.html").write_bytes(b"a" * 100)
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            for url in ("missing.html", "test.html"):
+                conn.request("GET", "/%s" % (url,))
+                conn.getresponse().read()
+        finally:
+            conn.close()
+
+    with Sapphire(keep_alive=10, timeout=10, use_selector=use_selector) as serv:
+        client = threading.Thread(target=_client, args=(serv.port,))
+        client.start()
+        try:
+            result = serv.serve_path(str(tmp_path))
+        finally:
+            client.join(timeout=10)
+        assert result.status == SERVED_ALL
+        assert result.metrics.requests == {200: 1, 404: 1}
+        assert result.metrics.bytes_sent > 100
+        assert result.metrics.first_byte.count == 1
+        assert result.metrics.occupancy.count == 1
+        assert result.metrics.accept_wait.count == 1
+        assert result.metrics.served_all is not None
+        assert serv.metrics.jobs == 1
+        assert serv.metrics.served_all.count == 1
+        assert serv.metrics.bytes_sent == result.metrics.bytes_sent
+
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_41(tmp_path, use_selector):
+    """test responses in progress when the job completes are not stalled until the next job"""
+    data = os.urandom(0x1000000)
+    for num in range(3):
+        (tmp_path / ("%d.bin" % (num,))).write_bytes(data)
+    received = list()
+
+    def _client(port, url):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            conn.request("GET", url)
+            received.append(conn.getresponse().read())
+        finally:
+            conn.close()
+
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
+        clients = list()
+        for num in range(3):
+            clients.append(threading.Thread(target=_client, args=(serv.port, "/%d.bin" % (num,))))
+            clients[-1].start()
+        try:
+            assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
+        finally:
+            for client in clients:
+                client.join(timeout=5)
+        assert not any(client.is_alive() for client in clients)
+    assert received == [data] * 3
+
+@pytest.mark.parametrize("forever", [False, True])
+@pytest.mark.parametrize("use_selector", [False, True])
+def test_sapphire_42(tmp_path, forever, use_selector):
+    """test finishing a job with a finish request"""
+    (tmp_path / "test.html").write_bytes(b"a")
+    (tmp_path / "other.html").write_bytes(b"b")
+    smap = ServerMap()
+    smap.set_finish("done")
+    responses = list()
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            for url in ("/test.html", "/done"):
+                conn.request("GET", url)
+                resp = conn.getresponse()
+                responses.append((resp.status, resp.read()))
+        finally:
+            conn.close()
+
+    with Sapphire(timeout=10, use_selector=use_selector) as serv:
+        client = threading.Thread(target=_client, args=(serv.port,))
+        client.start()
+        try:
+            start = time.time()
+            status, served = serv.serve_path(str(tmp_path), forever=forever, server_map=smap)
+        finally:
+            client.join(timeout=10)
+        assert time.time() - start < 10
+    assert status == SERVED_REQUEST
+    assert served == ("test.html",)
+    assert responses == [(200, b"a"), (200, b"")]
+
+@pytest.mark.parametrize("use_working_path", [False, True])
+def test_sapphire_43(tmp_path, use_working_path):
+    """test Sapphire.serve_testcase() with test cases that are still running"""
+    responses = dict()
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            for url in ("old.html", "shared.js", "current.html"):
+                conn.request("GET", "/%s" % (url,))
+                resp = conn.getresponse()
+                responses[url] = (resp.status, resp.read())
+        finally:
+            conn.close()
+
+    with TestCase("old.html", None, "foo") as test1, TestCase("current.html", None, "foo") as test2:
+        test1.add_from_data(b"old", "old.html")
+        test1.add_from_data(b"old-js", "shared.js")
+        test2.add_from_data(b"current", "current.html")
+        test2.add_from_data(b"current-js", "shared.js", required=False)
+        with Sapphire(timeout=10) as serv:
+            client = threading.Thread(target=_client, args=(serv.port,))
+            client.start()
+            try:
+                status, served = serv.serve_testcase(
+                    test2,
+                    in_flight=[test1],
+                    working_path=str(tmp_path) if use_working_path else None)
+            finally:
+                client.join(timeout=10)
+    # only the files of the current test case are required
+    assert status == SERVED_ALL
+    assert set(served) == {"old.html", "shared.js", "current.html"}
+    # files of the current test case take precedence
+    assert responses == {
+        "old.html": (200, b"old"),
+        "shared.js": (200, b"current-js"),
+        "current.html": (200, b"current")}
+    # temporary files are removed
+    assert not any(tmp_path.iterdir())
+
+@pytest.mark.parametrize("use_multiplexer", [False, True])
+def test_sapphire_44(tmp_path, use_multiplexer):
+    """test late request on a persistent connection after the job is complete"""
+    job1 = tmp_path / "job1"
+    job1.mkdir()
+    (job1 / "a.html").write_bytes(b"a")
+    (job1 / "c.html").write_bytes(b"c")
+    (job1 / "opt.html").write_bytes(b"opt")
+    job2 = tmp_path / "job2"
+    job2.mkdir()
+    (job2 / "b.html").write_bytes(b"b")
+    responses = list()
+
+    def _client(port):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            conn.request("GET", "/a.html")
+            resp = conn.getresponse()
+            responses.append(("a.html", resp.status, resp.read()))
+            # complete the job using another connection
+            other = HTTPConnection("127.0.0.1", port, timeout=10)
+            try:
+                other.request("GET", "/c.html")
+                resp = other.getresponse()
+                responses.append(("c.html", resp.status, resp.read()))
+            finally:
+                other.close()
+            # only the previous job has opt.html
+            for url in ("opt.html", "b.html"):
+                conn.request("GET", "/%s" % (url,))
+                resp = conn.getresponse()
+                responses.append((url, resp.status, resp.read()))
+        finally:
+            conn.close()
+
+    mux = SapphireMultiplexer() if use_multiplexer else None
+    if mux is not None:
+        mux.start()
+    try:
+        with Sapphire(keep_alive=10, multiplexer=mux, timeout=10) as serv:
+            client = threading.Thread(target=_client, args=(serv.port,))
+            client.start()
+            try:
+                result1 = serv.serve_path(str(job1), optional_files=["opt.html"])
+                result2 = serv.serve_path(str(job2))
+            finally:
+                client.join(timeout=10)
+    finally:
+        if mux is not None:
+            mux.close()
+    assert responses == [
+        ("a.html", 200, b"a"), ("c.html", 200, b"c"), ("opt.html", 200, b"opt"), ("b.html", 200, b"b")]
+    assert result1.status == SERVED_ALL
+    assert set(result1.served) == {"a.html", "c.html"}
+    # the late request is not included in the next job
+    assert result2.status == SERVED_ALL
+    assert result2.served == ("b.html",)
+    assert result2.metrics.requests == {200: 1}
+
 def test_main_01(mocker, tmp_path):
     """test Sapphire.main()"""
     args = mocker.Mock(
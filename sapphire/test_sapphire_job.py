@@ -4,6 +4,8 @@ SapphireJob unit tests
 """
 # pylint: disable=protected-access
 
+import io
+import os
 import platform
 
 import pytest
@@ -26,7 +28,7 @@ def test_sapphire_job_01(tmp_path):
     assert not job.is_forbidden(str(tmp_path / "missing_file"))
     assert job.pending == 0
     assert not job.is_complete()
-    assert job.remove_pending("no_file.test")
+    assert not job.remove_pending("no_file.test")
     job.finish()
     assert not any(job.served)
     assert job.is_complete()
@@ -56,12 +58,16 @@ def test_sapphire_job_02(tmp_path):
     assert job.remove_pending(str(req2_path))
     assert job.status == SERVED_ALL
     assert job.pending == 0
-    assert job.remove_pending(str(req1_path))
+    # only the request that removed the last pending file finishes the job
+    assert not job.remove_pending(str(req1_path))
+    assert not job.remove_pending(str(req2_path))
     resource = job.check_request("opt_file.txt")
     assert not resource.required
     assert resource.target == str(tmp_path / "opt_file.txt")
     assert resource.type == Resource.URL_FILE
-    assert job.remove_pending(str(opt_path))
+    assert not job.remove_pending(str(opt_path))
+    assert job.is_optional(str(opt_path))
+    assert not job.is_optional(str(req1_path))
     job.finish()
     assert job.is_complete()
 
@@ -239,3 +245,101 @@ def test_sapphire_job_10(tmp_path):
     assert "file.bin" in job.served
     job.increment_served("/some/include/path/inc.bin")
     assert "/some/include/path/inc.bin" in job.served
+
+def test_sapphire_job_11():
+    """test SapphireJob serving from memory"""
+    smap = ServerMap()
+    smap.set_redirect("grz_next_test", "test.html", required=True)
+    contents = {"test.html": b"a", "opt.js": b"b", os.path.join("nested", "c.html"): b"c"}
+    job = SapphireJob(None, contents=contents, optional_files=("opt.js",), server_map=smap)
+    assert job.base_path is None
+    assert job.pending == 3
+    resource = job.check_request("test.html")
+    assert resource.type == Resource.URL_DATA
+    assert resource.target == "test.html"
+    assert resource.required
+    resource = job.check_request("opt.js?q=1")
+    assert resource.type == Resource.URL_DATA
+    assert not resource.required
+    resource = job.check_request("nested/../nested/c.html")
+    assert resource.type == Resource.URL_DATA
+    assert resource.target == os.path.join("nested", "c.html")
+    assert resource.required
+    assert job.check_request("missing.html") is None
+    assert job.check_request("grz_next_test").type == Resource.URL_REDIRECT
+    assert job.is_optional("opt.js")
+    assert not job.is_optional("test.html")
+    assert job.is_forbidden("/some/file")
+    assert not job.remove_pending("test.html")
+    job.increment_served("test.html")
+    assert tuple(job.served) == ("test.html",)
+    assert not job.remove_pending(os.path.join("nested", "c.html"))
+    assert job.remove_pending("grz_next_test")
+    assert job.status == SERVED_ALL
+
+def test_sapphire_job_14():
+    """test SapphireJob.content_size() and SapphireJob.read_content()"""
+    contents = {"a.bin": b"0123456789", "b.bin": io.BytesIO(b"0123456789")}
+    job = SapphireJob(None, contents=contents)
+    for name in contents:
+        assert job.content_size(name) == 10
+        assert job.read_content(name) == b"0123456789"
+        assert job.read_content(name, offset=2, size=3) == b"234"
+        assert job.read_content(name, offset=8) == b"89"
+        assert job.read_content(name, offset=20, size=3) == b""
+
+def test_sapphire_job_12(tmp_path):
+    """test SapphireJob.wait() and SapphireJob.wake()"""
+    (tmp_path / "test.html").write_bytes(b"a")
+    job = SapphireJob(str(tmp_path))
+    assert not job.wait(0)
+    # wake() interrupts wait() without completing the job
+    job.wake()
+    assert not job.wait(10)
+    assert not job.is_complete()
+    # finish() wakes wait() and completes the job
+    job.finish()
+    assert job.wait(10)
+    assert job.wait()
+
+def test_sapphire_job_13():
+    """test SapphireJob.is_finishing()"""
+    job = SapphireJob(None, contents={"a.html": b"a"})
+    assert not job.is_finishing()
+    # the last required file was requested but the response has not been sent
+    assert job.remove_pending("a.html")
+    assert job.is_finishing()
+    assert not job.is_complete()
+    job.finish()
+    assert job.is_finishing()
+    # forever jobs only finish when finish() is called
+    job = SapphireJob(None, contents={"a.html": b"a"}, forever=True)
+    assert job.remove_pending("a.html")
+    assert not job.is_finishing()
+    job.finish()
+    assert job.is_finishing()
+
+def test_sapphire_job_15():
+    """test SapphireJob.begin_send(), SapphireJob.end_send() and SapphireJob.wait_sends()"""
+    job = SapphireJob(None, contents={"a.html": b"a", "b.html": b"b"})
+    assert job.wait_sends(timeout=0)
+    # files are only served once the response is complete
+    assert not job.remove_pending("a.html")
+    job.begin_send()
+    assert not job.wait_sends(timeout=0)
+    assert not any(job.served)
+    job.end_send("a.html")
+    assert job.wait_sends(timeout=0)
+    assert tuple(job.served) == ("a.html",)
+    # a required file that was not completely sent is pending again
+    assert job.remove_pending("b.html")
+    assert job.status == SERVED_ALL
+    job.begin_send()
+    job.end_send("b.html", complete=False)
+    assert job.pending == 1
+    assert job.status == SERVED_REQUEST
+    # files that were served before are not pending again
+    job.begin_send()
+    job.end_send("a.html", complete=False)
+    assert job.pending == 1
+    assert tuple(job.served) == ("a.html",)
@@ -4,6 +4,7 @@ SapphireLoadManager unit tests
 """
 # pylint: disable=protected-access
 
+from itertools import chain, count, repeat
 import socket
 import threading
 
@@ -11,6 +12,7 @@ import pytest
 
 from .sapphire_load_manager import SapphireLoadManager
 from .sapphire_job import SapphireJob
+from .status_codes import SERVED_ALL
 
 
 def test_sapphire_load_manager_01(mocker, tmp_path):
@@ -18,7 +20,7 @@ def test_sapphire_load_manager_01(mocker, tmp_path):
     (tmp_path / "testfile").write_bytes(b"test")
     job = SapphireJob(str(tmp_path))
     clnt_sock = mocker.Mock(spec=socket.socket)
-    clnt_sock.recv.return_value = b"GET /testfile HTTP/1.1"
+    clnt_sock.recv.return_value = b"GET /testfile HTTP/1.1\r\nConnection: close\r\n\r\n"
     serv_sock = mocker.Mock(spec=socket.socket)
     serv_sock.accept.return_value = (clnt_sock, None)
     assert not job.is_complete()
@@ -26,7 +28,6 @@ def test_sapphire_load_manager_01(mocker, tmp_path):
         assert loadmgr.wait(1)
     assert clnt_sock.close.call_count == 1
     assert job.is_complete()
-    assert not job.accepting.is_set()
     assert job.exceptions.empty()
 
 def test_sapphire_load_manager_02(mocker):
@@ -49,21 +50,22 @@ def test_sapphire_load_manager_03(mocker, tmp_path):
     (tmp_path / "test3").touch()
     job = SapphireJob(str(tmp_path))
     clnt_sock = mocker.Mock(spec=socket.socket)
-    clnt_sock.recv.side_effect = (
-        b"GET /test1 HTTP/1.1",
-        b"GET /missing HTTP/1.1",
+    # connections accepted after the job is complete are closed without a request
+    clnt_sock.recv.side_effect = chain((
+        b"GET /test1 HTTP/1.1\r\nConnection: close\r\n\r\n",
+        b"GET /missing HTTP/1.1\r\nConnection: close\r\n\r\n",
         b"badrequest",
         b"",
-        b"GET /test2 HTTP/1.1",
-        b"GET /test1 HTTP/1.1",
-        b"GET /test1 HTTP/1.1",
-        b"GET /test3 HTTP/1.1")
+        b"GET /test2 HTTP/1.1\r\nConnection: close\r\n\r\n",
+        b"GET /test1 HTTP/1.1\r\nConnection: close\r\n\r\n",
+        b"GET /test1 HTTP/1.1\r\nConnection: close\r\n\r\n",
+        b"GET /test3 HTTP/1.1\r\nConnection: close\r\n\r\n"), repeat(b""))
     serv_sock = mocker.Mock(spec=socket.socket)
     serv_sock.accept.return_value = (clnt_sock, None)
     assert not job.is_complete()
     with SapphireLoadManager(job, serv_sock, max_workers=2) as loadmgr:
         assert loadmgr.wait(1)
-    assert clnt_sock.close.call_count == 8
+    assert clnt_sock.close.call_count >= 7
     assert job.is_complete()
 
 def test_sapphire_load_manager_04(mocker, tmp_path):
@@ -83,7 +85,7 @@ def test_sapphire_load_manager_04(mocker, tmp_path):
     # timeout
     job = SapphireJob(str(tmp_path))
     fake_time = mocker.patch("sapphire.sapphire_load_manager.time", autospec=True)
-    fake_time.time.side_effect = (1, 2, 3)
+    fake_time.time.side_effect = count(1)
     with SapphireLoadManager(job, serv_sock, max_workers=10) as loadmgr:
         assert not loadmgr.wait(1, continue_cb=lambda: False, poll=0.01)
 
@@ -113,3 +115,101 @@ def test_sapphire_load_manager_06(mocker, tmp_path):
             loadmgr.wait(1)
     assert job.is_complete()
     assert job.exceptions.empty()
+
+def test_sapphire_load_manager_07(mocker):
+    """test SapphireLoadManager.switch()"""
+    job = SapphireJob(None, contents={"test1": b"a"})
+    clnt_sock = mocker.Mock(spec=socket.socket)
+    clnt_sock.recv.return_value = b"GET /test1 HTTP/1.1\r\nConnection: close\r\n\r\n"
+    serv_sock = mocker.Mock(spec=socket.socket)
+    serv_sock.accept.return_value = (clnt_sock, None)
+    with SapphireLoadManager(job, serv_sock) as loadmgr:
+        assert loadmgr.wait(1)
+        loadmgr.finish_job()
+        listener = loadmgr._listener
+        # serve the next job using the same listener
+        clnt_sock.recv.return_value = b"GET /test2 HTTP/1.1\r\nConnection: close\r\n\r\n"
+        next_job = SapphireJob(None, contents={"test2": b"b"})
+        loadmgr.switch(next_job)
+        assert loadmgr.wait(1)
+        assert loadmgr._listener is listener
+        assert "test2" in next_job.served
+    assert next_job.is_complete()
+    assert next_job.exceptions.empty()
+
+def test_sapphire_load_manager_08(mocker, tmp_path):
+    """test SapphireLoadManager worker pool reuse and stats"""
+    for index in range(5):
+        (tmp_path / ("test%d" % (index,))).touch()
+    job = SapphireJob(str(tmp_path))
+    clnt_sock = mocker.Mock(spec=socket.socket)
+    # connections accepted after the job is complete are closed without a request
+    clnt_sock.recv.side_effect = chain(
+        (b"GET /test%d HTTP/1.1\r\nConnection: close\r\n\r\n" % (x,) for x in range(5)),
+        repeat(b""))
+    serv_sock = mocker.Mock(spec=socket.socket)
+    serv_sock.accept.return_value = (clnt_sock, None)
+    with SapphireLoadManager(job, serv_sock, max_workers=2) as loadmgr:
+        threads = tuple(x.thread for x in loadmgr._pool)
+        assert all(x.is_alive() for x in threads)
+        assert loadmgr.wait(1)
+        loadmgr.finish_job()
+        # workers are reused
+        assert tuple(x.thread for x in loadmgr._pool) == threads
+        stats = loadmgr.stats
+    assert stats.size == 2
+    assert stats.handled >= 5
+    assert 0 < stats.peak <= 2
+    assert stats.saturated >= 0
+    assert clnt_sock.close.call_count == stats.handled
+    assert not any(x.is_alive() for x in threads)
+    assert loadmgr.stats.busy == 0
+
+def test_sapphire_load_manager_09():
+    """test SapphireLoadManager reclaim worker waiting on idle connection"""
+    serv_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    serv_sock.settimeout(0.25)
+    serv_sock.bind(("127.0.0.1", 0))
+    serv_sock.listen(5)
+    clients = list()
+    try:
+        job = SapphireJob(None, contents={"a": b"a", "b": b"b"}, keep_alive=10)
+        with SapphireLoadManager(job, serv_sock, max_workers=1) as loadmgr:
+            for name in (b"a", b"b"):
+                clients.append(socket.create_connection(serv_sock.getsockname(), timeout=10))
+                clients[-1].sendall(b"GET /%s HTTP/1.1\r\n\r\n" % (name,))
+                assert clients[-1].recv(1024).endswith(name)
+            assert loadmgr.wait(10)
+        # the persistent connection was closed to serve the second connection
+        assert clients[0].recv(1024) == b""
+        assert loadmgr.stats.handled == 2
+    finally:
+        for client in clients:
+            client.close()
+        serv_sock.close()
+
+def test_sapphire_load_manager_10():
+    """test SapphireLoadManager accepts connections before previous requests are received"""
+    serv_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    serv_sock.settimeout(0.25)
+    serv_sock.bind(("127.0.0.1", 0))
+    serv_sock.listen(5)
+    try:
+        job = SapphireJob(None, contents={"a": b"a", "b": b"b"}, keep_alive=10)
+        with SapphireLoadManager(job, serv_sock, max_workers=2) as loadmgr:
+            # the first connection does not send a request yet
+            slow = socket.create_connection(serv_sock.getsockname(), timeout=10)
+            fast = socket.create_connection(serv_sock.getsockname(), timeout=10)
+            try:
+                fast.sendall(b"GET /a HTTP/1.1\r\nConnection: close\r\n\r\n")
+                assert fast.recv(1024).endswith(b"a")
+                assert not job.is_complete()
+                slow.sendall(b"GET /b HTTP/1.1\r\n\r\n")
+                assert slow.recv(1024).endswith(b"b")
+                assert loadmgr.wait(10)
+            finally:
+                fast.close()
+                slow.close()
+        assert job.status == SERVED_ALL
+    finally:
+        serv_sock.close()
@@ -0,0 +1,201 @@
+# coding=utf-8
+"""
+SapphireMultiplexer unit tests
+"""
+# pylint: disable=protected-access
+
+from http.client import HTTPConnection
+import socket
+import threading
+
+import pytest
+
+from .core import Sapphire
+from .sapphire_multiplexer import SapphireMultiplexer
+from .sapphire_worker import SapphireWorker
+from .status_codes import SERVED_ALL, SERVED_NONE, SERVED_TIMEOUT
+
+
+def _request(port, urls, results, keep_alive=True):
+    conn = HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        for url in urls:
+            conn.request("GET", url, headers={} if keep_alive else {"Connection": "close"})
+            resp = conn.getresponse()
+            results.append((url, resp.status, resp.read()))
+    finally:
+        conn.close()
+
+
+def test_sapphire_multiplexer_01(tmp_path):
+    """test SapphireMultiplexer serving concurrent jobs"""
+    servers = list()
+    results = dict()
+    with SapphireMultiplexer(max_workers=4) as mux:
+        try:
+            for num in range(6):
+                path = tmp_path / ("job%d" % (num,))
+                path.mkdir()
+                (path / "a.html").write_bytes(b"a%d" % (num,))
+                (path / "b.html").write_bytes(b"b%d" % (num,))
+                servers.append((Sapphire(multiplexer=mux, timeout=10), str(path)))
+
+            def _serve(serv, path):
+                results[serv.port] = serv.serve_path(path)
+
+            threads = list()
+            for serv, path in servers:
+                threads.append(threading.Thread(target=_serve, args=(serv, path)))
+                threads[-1].start()
+            responses = dict()
+            clients = list()
+            for serv, _ in servers:
+                responses[serv.port] = list()
+                # persistent connections could be reclaimed since there are fewer workers than clients
+                clients.append(threading.Thread(
+                    target=_request,
+                    args=(serv.port, ("/a.html", "/b.html"), responses[serv.port]),
+                    kwargs={"keep_alive": False}))
+                clients[-1].start()
+            for thread in threads + clients:
+                thread.join(timeout=10)
+            assert not any(thread.is_alive() for thread in threads + clients)
+            ports = tuple(serv.port for serv, _ in servers)
+        finally:
+            for serv, _ in servers:
+                serv.close()
+        assert len(mux._channels) == 0
+        stats = mux.stats
+    assert stats.size == 4
+    assert stats.handled >= 6
+    for num, port in enumerate(ports):
+        status, served = results[port]
+        assert status == SERVED_ALL
+        assert set(served) == {"a.html", "b.html"}
+        assert responses[port] == [
+            ("/a.html", 200, b"a%d" % (num,)),
+            ("/b.html", 200, b"b%d" % (num,))]
+
+
+@pytest.mark.parametrize("keep_alive", [False, True])
+def test_sapphire_multiplexer_02(tmp_path, keep_alive):
+    """test SapphireMultiplexer serving consecutive jobs on the same port"""
+    (tmp_path / "test.html").write_bytes(b"test")
+    responses = list()
+    with SapphireMultiplexer(max_workers=2) as mux:
+        with Sapphire(multiplexer=mux, timeout=10) as serv:
+            client = threading.Thread(
+                target=_request,
+                args=(serv.port, ["/test.html"] * 10, responses),
+                kwargs={"keep_alive": keep_alive})
+            client.start()
+            try:
+                for _ in range(10):
+                    assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
+            finally:
+                client.join(timeout=10)
+    assert responses == [("/test.html", 200, b"test")] * 10
+
+
+def test_sapphire_multiplexer_03(tmp_path):
+    """test SapphireMultiplexer timeout and continue_cb are per job"""
+    (tmp_path / "test.html").write_bytes(b"test")
+    with SapphireMultiplexer() as mux:
+        with Sapphire(multiplexer=mux, timeout=1) as serv_a, Sapphire(multiplexer=mux, timeout=10) as serv_b:
+            result = dict()
+            waiter = threading.Thread(
+                target=lambda: result.update(a=serv_a.serve_path(str(tmp_path))))
+            waiter.start()
+            # serv_b is aborted by continue_cb while serv_a waits
+            assert serv_b.serve_path(str(tmp_path), continue_cb=lambda: False)[0] == SERVED_NONE
+            waiter.join(timeout=10)
+            assert result["a"][0] == SERVED_TIMEOUT
+            # serv_b is still usable
+            responses = list()
+            client = threading.Thread(target=_request, args=(serv_b.port, ("/test.html",), responses))
+            client.start()
+            try:
+                assert serv_b.serve_path(str(tmp_path))[0] == SERVED_ALL
+            finally:
+                client.join(timeout=10)
+            assert responses == [("/test.html", 200, b"test")]
+
+
+def test_sapphire_multiplexer_04(tmp_path):
+    """test closing SapphireMultiplexer while serving"""
+    (tmp_path / "test.html").write_bytes(b"test")
+    mux = SapphireMultiplexer()
+    mux.start()
+    with Sapphire(multiplexer=mux, timeout=10) as serv:
+        closer = threading.Timer(0.1, mux.close)
+        closer.start()
+        try:
+            assert serv.serve_path(str(tmp_path))[0] == SERVED_NONE
+        finally:
+            closer.join()
+    assert mux._listener is None
+    assert mux._selector is None
+    assert not any(worker.thread for worker in mux._pool)
+
+
+def test_sapphire_multiplexer_05(mocker, tmp_path):
+    """test SapphireMultiplexer re-raise listener exceptions"""
+    (tmp_path / "test.html").write_bytes(b"test")
+    mocker.patch.object(SapphireWorker, "accept", side_effect=Exception("listener exception"))
+    with SapphireMultiplexer() as mux:
+        with Sapphire(multiplexer=mux, timeout=10) as serv:
+            # trigger accept()
+            conn = socket.create_connection(("127.0.0.1", serv.port), timeout=10)
+            try:
+                with pytest.raises(Exception, match="listener exception"):
+                    serv.serve_path(str(tmp_path))
+            finally:
+                conn.close()
+            # the listener is restarted when the next job starts
+            mocker.stopall()
+            responses = list()
+            client = threading.Thread(target=_request, args=(serv.port, ("/test.html",), responses))
+            client.start()
+            try:
+                assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
+            finally:
+                client.join(timeout=10)
+            assert responses[-1] == ("/test.html", 200, b"test")
+
+
+def test_sapphire_multiplexer_06():
+    """test Sapphire with SapphireMultiplexer and use_selector"""
+    with pytest.raises(AssertionError, match="use_selector is not supported"):
+        Sapphire(multiplexer=SapphireMultiplexer(), use_selector=True)
+
+
+def test_sapphire_multiplexer_07(mocker, tmp_path):
+    """test SapphireMultiplexer listener with sockets closed during select()"""
+    (tmp_path / "test.html").write_bytes(b"test")
+    with SapphireMultiplexer() as mux:
+        with Sapphire(multiplexer=mux, timeout=10) as serv:
+            select = mux._selector.select
+            closed = mocker.Mock(_registered=False, closing=False)
+            closed.job.is_complete.return_value = False
+
+            def _select(timeout=None):
+                if fake_select.call_count == 1:
+                    raise ValueError("Invalid file descriptor: -1")
+                if fake_select.call_count == 2:
+                    # the socket of the channel was unregistered after select() returned
+                    return [(mocker.Mock(data=closed, fileobj=None), None)]
+                return select(timeout=timeout)
+
+            fake_select = mocker.patch.object(mux._selector, "select", side_effect=_select)
+            accept = mocker.spy(SapphireWorker, "accept")
+            mux._wake_listener()
+            responses = list()
+            client = threading.Thread(target=_request, args=(serv.port, ("/test.html",), responses))
+            client.start()
+            try:
+                assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
+            finally:
+                client.join(timeout=10)
+            assert responses == [("/test.html", 200, b"test")]
+            assert fake_select.call_count > 2
+            assert all(call[0][0] is serv._socket for call in accept.call_args_list)
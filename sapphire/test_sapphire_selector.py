@@ -0,0 +1,171 @@
+# coding=utf-8
+"""
+SapphireSelector unit tests
+"""
+# pylint: disable=protected-access
+
+import socket
+
+import pytest
+
+from .sapphire_job import SapphireJob
+from .sapphire_selector import _Client, SapphireSelector
+from .sapphire_worker import SapphireWorker
+from .server_map import ServerMap
+
+
+@pytest.fixture
+def listen_sock():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(0.25)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(5)
+    yield sock
+    sock.close()
+
+
+def _connect(listen_sock):
+    conn = socket.create_connection(listen_sock.getsockname(), timeout=10)
+    return conn
+
+
+def _recv_all(conn):
+    data = list()
+    while True:
+        chunk = conn.recv(0x10000)
+        if not chunk:
+            break
+        data.append(chunk)
+    return b"".join(data)
+
+
+def test_sapphire_selector_01(listen_sock, tmp_path):
+    """test basic SapphireSelector"""
+    (tmp_path / "testfile").write_bytes(b"test")
+    job = SapphireJob(str(tmp_path))
+    conn = _connect(listen_sock)
+    try:
+        conn.sendall(b"GET /testfile HTTP/1.1\r\n\r\n")
+        with SapphireSelector(job, listen_sock) as loadmgr:
+            assert loadmgr.wait(10)
+        data = _recv_all(conn)
+    finally:
+        conn.close()
+    assert data.startswith(b"HTTP/1.1 200 OK")
+    assert b"Connection: close" in data
+    assert data.endswith(b"\r\n\r\ntest")
+    assert job.is_complete()
+    assert job.exceptions.empty()
+    assert "testfile" in job.served
+
+def test_sapphire_selector_02(listen_sock, tmp_path):
+    """test SapphireSelector pipelined requests on a persistent connection"""
+    (tmp_path / "test1").write_bytes(b"a")
+    (tmp_path / "test2").write_bytes(b"b")
+    job = SapphireJob(str(tmp_path), keep_alive=10)
+    conn = _connect(listen_sock)
+    try:
+        conn.sendall(b"GET /test1 HTTP/1.1\r\n\r\nGET /missing HTTP/1.1\r\n\r\nGET /test2 HTTP/1.1\r\n\r\n")
+        with SapphireSelector(job, listen_sock) as loadmgr:
+            assert loadmgr.wait(10)
+        data = _recv_all(conn)
+    finally:
+        conn.close()
+    assert data.count(b"HTTP/1.1 200 OK") == 2
+    assert data.count(b"HTTP/1.1 404 Not Found") == 1
+    assert data.count(b"Connection: keep-alive") == 2
+    assert data.count(b"Connection: close") == 1
+    assert job.is_complete()
+    assert len(tuple(job.served)) == 2
+
+def test_sapphire_selector_03(listen_sock, tmp_path):
+    """test SapphireSelector closing idle persistent connections"""
+    (tmp_path / "test1").write_bytes(b"a")
+    (tmp_path / "test2").write_bytes(b"b")
+    job = SapphireJob(str(tmp_path), keep_alive=0.1)
+    conn = _connect(listen_sock)
+    try:
+        conn.sendall(b"GET /test1 HTTP/1.1\r\n\r\n")
+        with SapphireSelector(job, listen_sock) as loadmgr:
+            # connection is closed by the server after keep_alive
+            assert not loadmgr.wait(1, poll=0.05)
+            assert not loadmgr._clients
+        data = _recv_all(conn)
+    finally:
+        conn.close()
+    assert data.startswith(b"HTTP/1.1 200 OK")
+    assert b"Connection: keep-alive" in data
+    assert job.pending == 1
+
+def test_sapphire_selector_04(listen_sock, mocker, tmp_path):
+    """test SapphireSelector.wait()"""
+    (tmp_path / "test1").touch()
+    job = SapphireJob(str(tmp_path))
+    with SapphireSelector(job, listen_sock) as loadmgr:
+        # invalid callback
+        with pytest.raises(TypeError, match="continue_cb must be callable"):
+            loadmgr.wait(0, continue_cb="test")
+        # callback abort
+        callback = mocker.Mock(return_value=False)
+        assert loadmgr.wait(1, continue_cb=callback, poll=0.01)
+        assert callback.call_count == 1
+    # timeout
+    job = SapphireJob(str(tmp_path))
+    with SapphireSelector(job, listen_sock) as loadmgr:
+        assert not loadmgr.wait(0.1, continue_cb=lambda: True, poll=0.01)
+
+def test_sapphire_selector_05(listen_sock, tmp_path):
+    """test SapphireSelector bad and empty requests"""
+    (tmp_path / "test1").touch()
+    job = SapphireJob(str(tmp_path))
+    bad = _connect(listen_sock)
+    empty = _connect(listen_sock)
+    try:
+        bad.sendall(b"badrequest")
+        empty.shutdown(socket.SHUT_WR)
+        with SapphireSelector(job, listen_sock) as loadmgr:
+            assert not loadmgr.wait(0.5, poll=0.01)
+        assert _recv_all(bad).startswith(b"HTTP/1.1 400 Bad Request")
+        assert not _recv_all(empty)
+    finally:
+        bad.close()
+        empty.close()
+    assert job.exceptions.empty()
+
+def test_sapphire_selector_06(listen_sock, mocker, tmp_path):
+    """test SapphireSelector re-raise exceptions"""
+    (tmp_path / "test1").touch()
+    smap = ServerMap()
+    smap.set_dynamic_response("dyn", mocker.Mock(side_effect=Exception("handler exception")))
+    job = SapphireJob(str(tmp_path), server_map=smap)
+    conn = _connect(listen_sock)
+    try:
+        conn.sendall(b"GET /dyn HTTP/1.1\r\n\r\n")
+        with pytest.raises(Exception, match="handler exception"):
+            with SapphireSelector(job, listen_sock) as loadmgr:
+                loadmgr.wait(10)
+    finally:
+        conn.close()
+    assert job.is_complete()
+    assert job.exceptions.empty()
+
+def test_sapphire_selector_07(listen_sock, mocker, tmp_path):
+    """test SapphireSelector limits data buffered while the job is finishing"""
+    (tmp_path / "testfile").touch()
+    job = SapphireJob(str(tmp_path))
+    mocker.patch.object(SapphireJob, "is_finishing", return_value=True)
+    with SapphireSelector(job, listen_sock) as loadmgr:
+        conn = mocker.Mock(spec=socket.socket)
+        client = _Client(conn)
+        loadmgr._clients[conn] = client
+        # data is buffered for the next job
+        conn.recv.return_value = b"GET /a HTTP/1.1\r\n\r\n"
+        loadmgr._recv(client)
+        assert client.buffered == conn.recv.return_value
+        assert conn in loadmgr._clients
+        assert conn.close.call_count == 0
+        # too much data buffered
+        conn.recv.return_value = b"A" * SapphireWorker.DEFAULT_REQUEST_LIMIT
+        loadmgr._recv(client)
+        assert conn not in loadmgr._clients
+        assert conn.close.call_count == 1
@@ -4,97 +4,348 @@ Sapphire unit tests
 """
 # pylint: disable=protected-access
 
+import io
+import os
 import socket
 import threading
 
 import pytest
 
 from .sapphire_job import SapphireJob
-from .sapphire_worker import SapphireWorker, SapphireWorkerError
+from .sapphire_worker import FileInfoCache, SapphireWorker
+from .server_map import ServerMap
 
 def test_sapphire_worker_01(mocker):
-    """test simple SapphireWorker in running state"""
-    wthread = mocker.Mock(spec=threading.Thread)
-    wthread.is_alive.return_value = True
-    worker = SapphireWorker(mocker.Mock(spec=socket.socket), wthread)
-    assert worker._conn is not None
-    assert worker._thread is not None
-    # it is assumed that launch() has already been called at this point
-    assert not worker.done
-    assert wthread.join.call_count == 0
-    assert wthread.is_alive.call_count == 1
-    worker.join(timeout=0)
-    assert wthread.join.call_count == 1
-    assert wthread.is_alive.call_count == 2
-    assert worker._conn.close.call_count == 0
-    wthread.is_alive.return_value = False
-    worker.close()
-    assert worker._conn.close.call_count == 1
-    assert worker._thread is None
-    assert worker.done
+    """test SapphireWorker.accept()"""
+    serv_sock = mocker.Mock(spec=socket.socket)
+    serv_job = mocker.Mock(spec=SapphireJob, keep_alive=0)
+    serv_sock.accept.side_effect = socket.timeout
+    assert SapphireWorker.accept(serv_sock, serv_job) is None
+    serv_sock.accept.side_effect = None
+    conn = mocker.Mock(spec=socket.socket)
+    serv_sock.accept.return_value = (conn, None)
+    assert SapphireWorker.accept(serv_sock, serv_job) is conn
+    conn.settimeout.assert_called_once_with(None)
+    conn.setsockopt.assert_called_once_with(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    serv_job.keep_alive = 5
+    conn.reset_mock()
+    assert SapphireWorker.accept(serv_sock, serv_job) is conn
+    conn.settimeout.assert_called_once_with(5)
+    assert conn.close.call_count == 0
 
 def test_sapphire_worker_02(mocker):
-    """test simple SapphireWorker fails to close"""
-    worker = SapphireWorker(
-        mocker.Mock(spec=socket.socket),
-        mocker.Mock(spec=threading.Thread))
-    # it is assumed that launch() has already been called at this point
-    worker._thread.is_alive.return_value = True
-    with pytest.raises(SapphireWorkerError, match="Worker thread failed to join!"):
-        worker.close()
-
-def test_sapphire_worker_03(mocker):
-    """test SapphireWorker.launch() fail cases"""
+    """test SapphireWorker.handle_request() socket errors"""
     serv_con = mocker.Mock(spec=socket.socket)
+    serv_con.recv.side_effect = socket.error
     serv_job = mocker.Mock(spec=SapphireJob)
-    fake_thread = mocker.patch("sapphire.sapphire_worker.threading.Thread", autospec=True)
-    mocker.patch("sapphire.sapphire_worker.time.sleep", autospec=True)
-
-    serv_con.accept.side_effect = socket.timeout
-    assert SapphireWorker.launch(serv_con, serv_job) is None
+    SapphireWorker.handle_request(serv_con, serv_job)
+    assert serv_job.finish.call_count == 0
+    assert serv_con.sendall.call_count == 0
+    assert serv_con.close.call_count == 1
 
-    serv_con.accept.side_effect = None
-    conn = mocker.Mock(spec=socket.socket)
-    serv_con.accept.return_value = (conn, None)
-    fake_thread.side_effect = threading.ThreadError
-    assert SapphireWorker.launch(serv_con, serv_job) is None
-    assert conn.close.call_count == 1
-    assert serv_job.accepting.clear.call_count == 0
-    assert serv_job.accepting.set.call_count == 1
+def test_sapphire_worker_03(mocker, tmp_path):
+    """test SapphireWorker.handle_request() persistent connection with pipelined requests"""
+    (tmp_path / "test1").write_bytes(b"a")
+    (tmp_path / "test2").write_bytes(b"b")
+    job = SapphireJob(str(tmp_path), keep_alive=1)
+    serv_con = mocker.Mock(spec=socket.socket)
+    serv_con.recv.return_value = b"GET /test1 HTTP/1.1\r\n\r\nGET /missing HTTP/1.1\r\n\r\n" \
+                                 b"GET /test2 HTTP/1.1\r\n\r\n"
+    SapphireWorker.handle_request(serv_con, job)
+    assert job.is_complete()
+    assert job.exceptions.empty()
+    assert serv_con.recv.call_count == 1
+    # the keep-alive timeout is only used while waiting for the next request
+    assert [x[0][0] for x in serv_con.settimeout.call_args_list] == [None, 1, None, 1, None]
+    assert serv_con.close.call_count == 1
+    headers = [x[0][0] for x in serv_con.sendall.call_args_list if x[0][0].startswith(b"HTTP/1.1")]
+    assert len(headers) == 3
+    assert b"Connection: keep-alive" in headers[0]
+    assert b"404 Not Found" in headers[1]
+    assert b"Connection: keep-alive" in headers[1]
+    # the connection is closed after the last required file is served
+    assert b"Connection: close" in headers[2]
 
 def test_sapphire_worker_04(mocker, tmp_path):
-    """test SapphireWorker.launch()"""
-    (tmp_path / "testfile").touch()
-    job = SapphireJob(str(tmp_path))
-    clnt_sock = mocker.Mock(spec=socket.socket)
-    clnt_sock.recv.return_value = b"GET /testfile HTTP/1.1"
-    serv_sock = mocker.Mock(spec=socket.socket)
-    serv_sock.accept.return_value = (clnt_sock, None)
-    worker = SapphireWorker.launch(serv_sock, job)
-    assert worker is not None
+    """test SapphireWorker.handle_request() persistent connection idle timeout"""
+    (tmp_path / "test1").write_bytes(b"a")
+    (tmp_path / "test2").write_bytes(b"b")
+    job = SapphireJob(str(tmp_path), keep_alive=1)
+    serv_con = mocker.Mock(spec=socket.socket)
+    serv_con.recv.side_effect = (b"GET /test1 HTTP/1.1\r\n", b"\r\n", socket.timeout)
+    idle = threading.Event()
+    SapphireWorker.handle_request(serv_con, job, idle=idle)
+    assert idle.is_set()
+    assert not job.is_complete()
+    assert job.exceptions.empty()
+    assert job.pending == 1
+    assert serv_con.recv.call_count == 3
+    assert [x[0][0] for x in serv_con.settimeout.call_args_list] == [None, 1]
+    assert serv_con.close.call_count == 1
+    # HTTP/1.0 and 'Connection: close' requests are not persistent
+    for request in (b"GET /test1 HTTP/1.0\r\n\r\n", b"GET /test1 HTTP/1.1\r\nConnection: Close\r\n\r\n"):
+        serv_con.reset_mock()
+        serv_con.recv.side_effect = None
+        serv_con.recv.return_value = request
+        SapphireWorker.handle_request(serv_con, job)
+        assert serv_con.recv.call_count == 1
+        serv_con.settimeout.assert_called_once_with(None)
+        assert b"Connection: close" in serv_con.sendall.call_args_list[0][0][0]
+
+@pytest.mark.parametrize("use_sendfile", [False, True])
+def test_sapphire_worker_08(mocker, tmp_path, use_sendfile):
+    """test SapphireWorker._send_file()"""
+    mocker.patch.object(SapphireWorker, "USE_SENDFILE", use_sendfile)
+    test_file = tmp_path / "testfile"
+    test_file.write_bytes(bytes(range(100)))
+    srv_sock, clnt_sock = socket.socketpair()
     try:
-        assert job.is_complete(wait=1)
+        SapphireWorker._send_file(srv_sock, str(test_file), 100)
+        assert clnt_sock.recv(200) == bytes(range(100))
+        # send part of the file
+        SapphireWorker._send_file(srv_sock, str(test_file), 10, offset=50)
+        assert clnt_sock.recv(200) == bytes(range(50, 60))
+        # file was truncated
+        with pytest.raises(IOError, match="was truncated while sending"):
+            SapphireWorker._send_file(srv_sock, str(test_file), 101)
     finally:
-        worker.close()
-    assert worker.done
-    assert serv_sock.accept.call_count == 1
-    assert clnt_sock.close.call_count == 2
+        clnt_sock.close()
+        srv_sock.close()
 
-def test_sapphire_worker_05(mocker):
-    """test SapphireWorker.handle_request() socket errors"""
+def test_sapphire_worker_09(tmp_path):
+    """test FileInfoCache"""
+    cache = FileInfoCache(limit=2)
+    test_file = tmp_path / "test.html"
+    test_file.write_bytes(b"a")
+    assert cache.lookup(str(tmp_path / "missing.html")) is None
+    assert cache.lookup(str(tmp_path)) is None
+    info = cache.lookup(str(test_file))
+    assert info.c_type == "text/html"
+    assert info.size == 1
+    # unchanged files are cached
+    assert cache.lookup(str(test_file)) is info
+    # modified files are not
+    test_file.write_bytes(b"ab")
+    os.utime(str(test_file), ns=(0, info.mtime + 1))
+    updated = cache.lookup(str(test_file))
+    assert updated is not info
+    assert updated.size == 2
+    # least recently used entries are removed
+    (tmp_path / "a.bin").write_bytes(b"a")
+    (tmp_path / "b.bin").write_bytes(b"b")
+    a_info = cache.lookup(str(tmp_path / "a.bin"))
+    assert cache.lookup(str(test_file)) is updated
+    cache.lookup(str(tmp_path / "b.bin"))
+    assert len(cache) == 2
+    assert cache.lookup(str(test_file)) is updated
+    assert cache.lookup(str(tmp_path / "a.bin")) is not a_info
+    cache.clear()
+    assert not cache
+
+def test_sapphire_worker_10(mocker, tmp_path):
+    """test SapphireWorker.build_response() reuses cached response headers"""
+    mocker.patch.object(SapphireWorker, "FILE_CACHE", FileInfoCache())
+    (tmp_path / "test.html").write_bytes(b"a")
+    (tmp_path / "other.html").write_bytes(b"b")
+    job = SapphireJob(str(tmp_path), keep_alive=1)
+    first = SapphireWorker.build_response(job, b"GET /test.html HTTP/1.1\r\n\r\n")
+    assert first.code == 200
+    assert first.body == b"a"
+    assert b"Content-Length: 1" in first.header
+    assert b"Content-Type: text/html" in first.header
+    assert b"Connection: keep-alive" in first.header
+    second = SapphireWorker.build_response(job, b"GET /test.html HTTP/1.1\r\n\r\n")
+    assert second.header is first.header
+    assert len(SapphireWorker.FILE_CACHE) == 1
+    # a different header is created when the connection is closing
+    last = SapphireWorker.build_response(job, b"GET /other.html HTTP/1.1\r\n\r\n")
+    assert last.finish
+    assert b"Connection: close" in last.header
+
+def test_sapphire_worker_11():
+    """test SapphireWorker._byte_range()"""
+    def _range(value, size=100):
+        return SapphireWorker._byte_range(b"GET / HTTP/1.1\r\nRange: %s\r\n\r\n" % (value,), size)
+    assert SapphireWorker._byte_range(b"GET / HTTP/1.1\r\n\r\n", 100) is None
+    assert _range(b"bytes=0-") == (0, 99)
+    assert _range(b"bytes=10-19") == (10, 19)
+    assert _range(b"bytes = 10-1000") == (10, 99)
+    assert _range(b"bytes=-10") == (90, 99)
+    assert _range(b"bytes=-1000") == (0, 99)
+    # unsatisfiable
+    assert _range(b"bytes=100-") == (100, 99)
+    assert _range(b"bytes=-0") == (100, 99)
+    assert _range(b"bytes=0-", size=0) == (0, -1)
+    # multiple ranges are ignored
+    assert _range(b"bytes=0-1, 5-6") is None
+    # invalid ranges are ignored
+    assert _range(b"bytes=10-5") is None
+    assert _range(b"bytes=a-b") is None
+    assert _range(b"bytes=-") is None
+    assert _range(b"items=0-1") is None
+
+@pytest.mark.parametrize("use_contents", [None, "bytes", "file"])
+def test_sapphire_worker_12(tmp_path, use_contents):
+    """test SapphireWorker.build_response() with range requests"""
+    data = bytes(range(256)) * 0x200
+    if use_contents == "bytes":
+        job = SapphireJob(None, contents={"test.bin": data, "opt.bin": b"opt"}, keep_alive=1)
+    elif use_contents == "file":
+        job = SapphireJob(None, contents={"test.bin": io.BytesIO(data), "opt.bin": b"opt"}, keep_alive=1)
+    else:
+        (tmp_path / "test.bin").write_bytes(data)
+        (tmp_path / "opt.bin").write_bytes(b"opt")
+        job = SapphireJob(str(tmp_path), keep_alive=1)
+    request = b"GET /test.bin HTTP/1.1\r\nRange: bytes=%s\r\n\r\n"
+    # small range
+    response = SapphireWorker.build_response(job, request % (b"1-10",))
+    assert response.code == 206
+    assert response.body == data[1:11]
+    assert response.length == 10
+    assert b"Content-Range: bytes 1-10/%d" % (len(data),) in response.header
+    assert b"Content-Length: 10\r\n" in response.header
+    assert response.keep_alive
+    # partially requested files are still pending
+    assert job.pending == 2
+    # large range
+    response = SapphireWorker.build_response(job, request % (b"100-100099",))
+    assert response.code == 206
+    assert b"Content-Length: 100000\r\n" in response.header
+    assert response.offset == 100
+    assert response.body is None
+    if use_contents:
+        # large ranges are streamed
+        assert response.length is None
+        assert b"".join(response.stream) == data[100:100100]
+    else:
+        assert response.length == 100000
+        assert response.stream is None
+    assert job.pending == 2
+    # unsatisfiable range
+    response = SapphireWorker.build_response(job, request % (b"%d-" % (len(data),),))
+    assert response.code == 416
+    assert b"Content-Range: bytes */%d" % (len(data),) in response.header
+    assert response.target is None
+    assert job.pending == 2
+    # a range that includes the end of the file completes the file
+    response = SapphireWorker.build_response(job, request % (b"-10",))
+    assert response.code == 206
+    assert response.body == data[-10:]
+    assert job.pending == 1
+
+def test_sapphire_worker_15():
+    """test SapphireWorker.build_response() serving file objects from contents"""
+    large = bytes(range(256)) * 0x400
+    src = io.BytesIO(large)
+    job = SapphireJob(None, contents={"large.bin": src, "small.txt": io.BytesIO(b"small")}, keep_alive=1)
+    # small files are sent with the header
+    response = SapphireWorker.build_response(job, b"GET /small.txt HTTP/1.1\r\n\r\n")
+    assert response.code == 200
+    assert response.body == b"small"
+    assert response.stream is None
+    # large files are read in chunks as they are sent
+    response = SapphireWorker.build_response(job, b"GET /large.bin HTTP/1.1\r\n\r\n")
+    assert response.code == 200
+    assert response.body is None
+    assert response.length is None
+    assert response.target == "large.bin"
+    assert b"Content-Length: %d\r\n" % (len(large),) in response.header
+    chunks = list(response.stream)
+    assert len(chunks) == len(large) // SapphireWorker.DEFAULT_TX_SIZE
+    assert b"".join(chunks) == large
+    # truncated file
+    response = SapphireWorker.build_response(job, b"GET /large.bin HTTP/1.1\r\n\r\n")
+    src.truncate(10)
+    with pytest.raises(IOError, match="was truncated while sending"):
+        tuple(response.stream)
+
+def test_sapphire_worker_13(mocker):
+    """test SapphireWorker._chunked()"""
+    assert b"".join(SapphireWorker._chunked([b"abc", b"", b"d"])) == b"3\r\nabc\r\n1\r\nd\r\n0\r\n\r\n"
+    assert b"".join(SapphireWorker._chunked(iter(()))) == b"0\r\n\r\n"
+    large = b"a" * (SapphireWorker.DEFAULT_TX_SIZE + 1)
+    assert tuple(SapphireWorker._chunked([large], encode=False)) == (large,)
+    assert b"".join(SapphireWorker._chunked([large])) == b"%x\r\n%s\r\n0\r\n\r\n" % (len(large), large)
+    # file-like objects are read and closed
+    source = io.BytesIO(large)
+    assert b"".join(SapphireWorker._chunked(source, encode=False)) == large
+    assert source.closed
+    # generators are closed
+    source = mocker.MagicMock()
+    source.__iter__.return_value = iter((b"a", b"b"))
+    del source.read
+    stream = SapphireWorker._chunked(source)
+    assert next(stream) == b"1\r\na\r\n"
+    stream.close()
+    assert source.close.call_count == 1
+    with pytest.raises(TypeError, match="dynamic response data must be 'bytes'"):
+        tuple(SapphireWorker._chunked(["a"]))
+
+def test_sapphire_worker_14(tmp_path):
+    """test SapphireWorker.build_response() with streamed dynamic responses"""
+    (tmp_path / "test.html").touch()
+    smap = ServerMap()
+    smap.set_dynamic_response("gen", lambda: (x for x in (b"a", b"b")), mime_type="text/plain")
+    smap.set_dynamic_response("file", lambda: io.BytesIO(b"data"))
+    smap.set_dynamic_response("str", lambda: "data")
+    job = SapphireJob(str(tmp_path), keep_alive=1, server_map=smap)
+    response = SapphireWorker.build_response(job, b"GET /gen HTTP/1.1\r\n\r\n")
+    assert response.code == 200
+    assert response.body is None
+    assert response.length is None
+    assert b"Transfer-Encoding: chunked" in response.header
+    assert b"Content-Length" not in response.header
+    assert b"Content-Type: text/plain" in response.header
+    assert b"".join(response.stream) == b"1\r\na\r\n1\r\nb\r\n0\r\n\r\n"
+    # HTTP/1.0 clients do not support chunked transfer encoding
+    response = SapphireWorker.build_response(job, b"GET /file HTTP/1.0\r\n\r\n")
+    assert response.stream is None
+    assert response.body == b"data"
+    assert b"Content-Length: 4" in response.header
+    with pytest.raises(TypeError, match="dynamic request callback must return"):
+        SapphireWorker.build_response(job, b"GET /str HTTP/1.1\r\n\r\n")
+
+def test_sapphire_worker_16(mocker, tmp_path):
+    """test SapphireWorker.handle_request() response is not completely sent"""
+    (tmp_path / "test.html").write_bytes(b"a")
+    job = SapphireJob(str(tmp_path), keep_alive=1)
     serv_con = mocker.Mock(spec=socket.socket)
-    serv_con.recv.side_effect = socket.error
-    serv_job = mocker.Mock(spec=SapphireJob)
-    SapphireWorker.handle_request(serv_con, serv_job)
-    assert serv_job.accepting.set.call_count == 1
-    assert serv_con.sendall.call_count == 0
-    assert serv_con.close.call_count == 1
+    serv_con.recv.return_value = b"GET /test.html HTTP/1.1\r\n\r\n"
+    serv_con.sendall.side_effect = socket.timeout
+    SapphireWorker.handle_request(serv_con, job)
+    # the file must be requested again
+    assert not job.is_complete()
+    assert job.exceptions.empty()
+    assert job.pending == 1
+    assert not any(job.served)
+    # the keep-alive timeout is not used while sending
+    serv_con.settimeout.assert_called_once_with(None)
+
+def test_sapphire_worker_17():
+    """test SapphireWorker.is_late()"""
+    smap = ServerMap()
+    smap.set_dynamic_response("dynamic", lambda: b"a")
+    smap.set_finish("done")
+    smap.set_redirect("grz_next_test", "a.html", required=True)
+    smap.set_redirect("grz_current_test", "a.html", required=False)
+    contents = {"a.html": b"a", "opt.js": b"b"}
+    job = SapphireJob(None, contents=contents, optional_files=("opt.js",), server_map=smap)
+    # optional resources of the job
+    for url in ("opt.js", "dynamic", "grz_current_test"):
+        assert SapphireWorker.is_late(job, b"GET /%s HTTP/1.1" % (url.encode("ascii"),))
+    # resources that belong to the next job
+    for url in ("a.html", "missing.html", "done", "grz_next_test"):
+        assert not SapphireWorker.is_late(job, b"GET /%s HTTP/1.1" % (url.encode("ascii"),))
+    assert not SapphireWorker.is_late(job, b"a bad request")
 
 def test_response_data_01():
     """test _200_header()"""
     output = SapphireWorker._200_header(10, "text/html")
     assert b"Content-Length: 10" in output
     assert b"Content-Type: text/html" in output
+    output = SapphireWorker._200_header(None, "text/html")
+    assert b"Content-Length" not in output
+    assert b"Transfer-Encoding: chunked" in output
 
 def test_response_data_02():
     """test _307_redirect()"""
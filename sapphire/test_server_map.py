@@ -6,7 +6,7 @@
 
 import pytest
 
-from .server_map import InvalidURLError, MapCollisionError, Resource, ServerMap
+from .server_map import InvalidURLError, MapCollisionError, Resource, ServerMap, ServerMapIndex
 
 
 def test_servermap_01():
@@ -101,3 +101,58 @@ def test_servermap_05():
     # cannot map more than one '/' deep
     with pytest.raises(InvalidURLError):
         ServerMap._check_url("/test/test")
+
+def test_servermap_06(tmp_path):
+    """test ServerMapIndex"""
+    inc_a = tmp_path / "inc"
+    inc_a.mkdir()
+    (inc_a / "a.js").write_bytes(b"a")
+    inc_b = tmp_path / "inc_b"
+    inc_b.mkdir()
+    (inc_b / "b.js").write_bytes(b"b")
+    srv_map = ServerMap()
+    srv_map.set_dynamic_response("dyn", lambda: b"x", mime_type="test/type")
+    srv_map.set_include("inc", str(inc_a))
+    srv_map.set_redirect("next", "test.html")
+    # add manually to avoid sanity checks in ServerMap.set_include()
+    srv_map.include["inc/deep"] = Resource(Resource.URL_INCLUDE, str(inc_b))
+    srv_map.include[""] = Resource(Resource.URL_INCLUDE, str(inc_b))
+    index = ServerMapIndex(srv_map)
+    assert index.find("dyn") is srv_map.dynamic["dyn"]
+    assert index.find("next") is srv_map.redirect["next"]
+    resource = index.find("inc/a.js")
+    assert resource.type == Resource.URL_INCLUDE
+    assert resource.target == str(inc_a / "a.js")
+    # resolved includes are cached
+    assert index.find("inc/a.js") is resource
+    # deepest mount wins
+    assert index.find("inc/deep/b.js").target == str(inc_b / "b.js")
+    # mount points without a location fall back to the empty mount point
+    assert index.find("inc") is None
+    # the empty mount point requires the file to exist
+    assert index.find("b.js").target == str(inc_b / "b.js")
+    assert index.find("missing.js") is None
+    assert index.find("incx/a.js") is None
+    # check include directories
+    assert index.is_included(str(inc_a / "a.js"))
+    assert index.is_included(str(inc_a / "sub" / "a.js"))
+    assert index.is_included(str(inc_b / "b.js"))
+    assert not index.is_included(str(tmp_path / "inc_c" / "c.js"))
+    assert not index.is_included(str(tmp_path / "a.js"))
+    assert not ServerMapIndex(ServerMap()).is_included(str(inc_a / "a.js"))
+
+def test_servermap_07(tmp_path):
+    """test ServerMap finish requests"""
+    srv_map = ServerMap()
+    srv_map.set_finish("done")
+    assert len(srv_map.dynamic) == 1
+    assert srv_map.dynamic["done"].type == Resource.URL_FINISH
+    assert srv_map.dynamic["done"].target is None
+    assert ServerMapIndex(srv_map).find("done") is srv_map.dynamic["done"]
+    with pytest.raises(MapCollisionError):
+        srv_map.set_include("done", str(tmp_path))
+    with pytest.raises(MapCollisionError):
+        srv_map.set_redirect("done", "test_file")
+    srv_map.set_redirect("next", "test_file")
+    with pytest.raises(MapCollisionError):
+        srv_map.set_finish("next")
@@ -67,6 +67,7 @@ if __name__ == '__main__':
             'grizzly.target',
             'loki',
             'sapphire',
+            'sapphire.benchmark',
         ],
         package_data={"grizzly.common": ["harness.html"]},
         url='https://github.com/MozillaSecurity/grizzly',